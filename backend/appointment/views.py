@@ -28,7 +28,8 @@ from dateutil.relativedelta import relativedelta  # <-- Add this
 from dateutil.relativedelta import MO, TU, WE, TH, FR, SA, SU
 from django.db.models import Max
 from .serializers import AppointmentSerializer, QueueSerializer
-from queueing.models import TemporaryStorageQueue
+from queueing.models import TemporaryStorageQueue, DailyQueueCounter, QueueHistory
+from queueing.utils import compact_positions, position_after
 from django.db.models import F
 from django.db import transaction
 import pytz
@@ -404,22 +405,11 @@ class UpcomingAppointments(APIView):
 
 def ensure_positions_initialized_for_date(queue_date):
     """
-    Ensure every TemporaryStorageQueue for queue_date has a sequential non-zero position.
-    Positions will be assigned as 1..N in ascending order of queue_number if any position <= 0.
+    Ensure every TemporaryStorageQueue for queue_date has a non-zero, sparse position.
+    If any position is <= 0 the day is respaced in ascending order of queue_number.
     """
-    qs = TemporaryStorageQueue.objects.filter(queue_date=queue_date).order_by('queue_number')
-    # Initialization needed if any position is <= 0 or missing
-    if qs.filter(position__lte=0).exists():
-        with transaction.atomic():
-            locked = TemporaryStorageQueue.objects.select_for_update().filter(
-                queue_date=queue_date
-            ).order_by('queue_number')
-            pos = 1
-            for entry in locked:
-                if entry.position != pos:
-                    entry.position = pos
-                    entry.save(update_fields=['position'])
-                pos += 1
+    if TemporaryStorageQueue.objects.filter(queue_date=queue_date, position__lte=0).exists():
+        compact_positions(queue_date, ordering=('queue_number', 'id'))
 
 def _patient_identifier(patient):
     """Return a safe scalar identifier for a patient instance."""
@@ -475,23 +465,17 @@ class AcceptAppointmentView(APIView):
         ensure_positions_initialized_for_date(today)
 
         with transaction.atomic():
-            # Lock today's active rows
-            current_qs = TemporaryStorageQueue.objects.select_for_update().filter(
+            # Lock the head of today's active queue; the new entry goes right behind it
+            first_entry = TemporaryStorageQueue.objects.select_for_update().filter(
                 queue_date=today
-            ).exclude(status__in=['Completed', 'Cancelled']).order_by('position', 'queue_number')
-            max_q = current_qs.aggregate(Max('queue_number'))['queue_number__max'] or 0
-            new_queue_number = max_q + 1
-
-            if current_qs.exists():
-                first_entry = current_qs.first()
-
-                TemporaryStorageQueue.objects.filter(
-                    queue_date=today,
-                    position__gt=first_entry.position
-                ).update(position=F('position') + 1)
-                new_position = first_entry.position + 1
+            ).exclude(status__in=['Completed', 'Cancelled']).order_by('position', 'queue_number').first()
+            new_queue_number = DailyQueueCounter.allocate(today)
+
+            if first_entry:
+                # sparse positions: only the new row is written
+                new_position = position_after(first_entry)
             else:
-                new_position = 1
+                new_position = new_queue_number * TemporaryStorageQueue.POSITION_GAP
             queue_entry = TemporaryStorageQueue.objects.create(
                 patient=appointment.patient,
                 priority_level=priority_level,
@@ -606,8 +590,8 @@ class QueueDebugMonthView(APIView):
         first_day = datetime(year, month, 1).date()
         last_day = datetime(year, month, monthrange(year, month)[1]).date()
 
-        # Filter queue entries by queue_date in that range
-        queue_entries = TemporaryStorageQueue.objects.filter(
+        # Filter queue entries by queue_date in that range (live and archived)
+        queue_entries = QueueHistory.objects.select_related('patient').filter(
             queue_date__gte=first_day,
             queue_date__lte=last_day
         ).order_by('queue_number')
@@ -171,6 +171,51 @@ else:
 
 
 
+# In-memory registration queue index (queueing/queue_index.py). The index is
+# rebuilt from the database when it is older than this many seconds, which also
+# picks up changes written by other processes (management commands, shell).
+QUEUE_INDEX_MAX_AGE = int(os.environ.get("QUEUE_INDEX_MAX_AGE", 300))
+# Number of registration queue deltas kept for WebSocket clients resuming with ?since=
+QUEUE_DELTA_BUFFER = int(os.environ.get("QUEUE_DELTA_BUFFER", 256))
+# Queue broadcasts requested within this many seconds are merged into one
+# send per board (queueing/dispatcher.py)
+QUEUE_BROADCAST_WINDOW = float(os.environ.get("QUEUE_BROADCAST_WINDOW", 0.1))
+# Wait-time estimator (queueing/wait_time.py): smoothing of the rolling mean
+# service interval, the estimate used before any sample, and the longest
+# interval still counted as service (longer gaps are idle time)
+QUEUE_WAIT_ALPHA = float(os.environ.get("QUEUE_WAIT_ALPHA", 0.2))
+QUEUE_WAIT_DEFAULT_SECONDS = int(os.environ.get("QUEUE_WAIT_DEFAULT_SECONDS", 600))
+QUEUE_WAIT_MAX_INTERVAL = int(os.environ.get("QUEUE_WAIT_MAX_INTERVAL", 3600))
+# Seconds between keepalive comments on the waiting-room SSE stream
+QUEUE_SSE_KEEPALIVE = int(os.environ.get("QUEUE_SSE_KEEPALIVE", 15))
+# A WebSocket client this many queue updates behind (updates superseded before
+# the previous send finished) is disconnected so it resyncs on reconnect.
+# Only clients that ack are held back until they read, so only for them does
+# this catch a slow network (queueing.consumers.LatestOnlySenderMixin).
+QUEUE_WS_MAX_BEHIND = int(os.environ.get("QUEUE_WS_MAX_BEHIND", 50))
+# Messages an acking WebSocket client may have unacknowledged before the
+# server stops sending to it
+QUEUE_WS_ACK_WINDOW = int(os.environ.get("QUEUE_WS_ACK_WINDOW", 8))
+# Seconds a call-next claim holds a patient; older claims go back to the
+# stage's queue (queueing.utils.unclaimed)
+QUEUE_CLAIM_TTL = int(os.environ.get("QUEUE_CLAIM_TTL", 15 * 60))
+
+# Where the patient read endpoints get their rows (patient/repository.py):
+# "supabase" (PostgREST over HTTPS) or "orm" (Django's own connection).
+# PATIENT_READ_BACKENDS overrides it per view, e.g.
+# PATIENT_READ_BACKENDS="PatientInfoView=orm,TotalPatientsAPIView=orm"
+PATIENT_READ_BACKEND = os.environ.get("PATIENT_READ_BACKEND", "supabase")
+PATIENT_READ_BACKENDS = dict(
+    item.strip().split("=", 1)
+    for item in os.environ.get("PATIENT_READ_BACKENDS", "").split(",")
+    if "=" in item
+)
+# Remote patient reads a view issues together run on a pool of this many
+# threads, each allowed this many seconds (patient.repository.fan_out)
+PATIENT_READ_WORKERS = int(os.environ.get("PATIENT_READ_WORKERS", 8))
+PATIENT_READ_TIMEOUT = float(os.environ.get("PATIENT_READ_TIMEOUT", 5))
+
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -187,6 +232,9 @@ DATABASES = {
         ssl_require=os.environ.get("DB_SSL_REQUIRE", "True").lower() in ("1","true","yes"),
     )
 }
+# The migration history does not replay on an empty database (0002 re-adds
+# columns created in 0001), so the test database is built from the models.
+DATABASES["default"]["TEST"] = {"MIGRATE": False}
 
 
 
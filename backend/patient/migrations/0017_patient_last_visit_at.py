@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def backfill_last_visit(apps, schema_editor):
+    Patient = apps.get_model('patient', 'Patient')
+    # archived entries are older than live ones, so live visits overwrite them
+    for model in ('ArchivedQueueEntry', 'TemporaryStorageQueue'):
+        entries = apps.get_model('queueing', model).objects.filter(patient_id=OuterRef('pk'))
+        latest = entries.order_by('-created_at').values('created_at')[:1]
+        Patient.objects.filter(Exists(entries)).update(last_visit_at=Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0016_patient_role_id'),
+        ('queueing', '0024_queue_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='last_visit_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('last_visit_at__isnull', False)), fields=['-last_visit_at', '-patient_id'], name='patient_last_visit_idx'),
+        ),
+        migrations.RunPython(backfill_last_visit, migrations.RunPython.noop),
+    ]
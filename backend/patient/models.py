@@ -25,6 +25,9 @@ class Patient(BaseProfile):
     street_address = models.CharField(max_length=100, blank=True, null=True)
     barangay = models.CharField(max_length=100, blank=True, null=True)
     municipal_city = models.CharField(max_length=100, blank=True, null=True)
+    # created_at of the patient's latest queue entry, kept by
+    # queueing.models.record_visits; orders the patient list
+    last_visit_at = models.DateTimeField(blank=True, null=True, editable=False)
 
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -35,6 +38,14 @@ class Patient(BaseProfile):
         limit_choices_to={"role": "patient"},
     ) 
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-last_visit_at', '-patient_id'], condition=models.Q(last_visit_at__isnull=False),
+                name='patient_last_visit_idx',
+            ),
+        ]
+
     @property
     def full_name(self):
         return " ".join(filter(None, [self.first_name, self.middle_name, self.last_name]))  
@@ -0,0 +1,485 @@
+"""
+Data access for the patient read endpoints.
+
+The views read rows shaped like Supabase PostgREST responses: table columns
+by name, related rows nested under the related table's name
+("queueing_temporarystoragequeue", "patient_diagnosis", ...). Two
+repositories return those shapes:
+
+    SupabasePatientRepository  PostgREST over HTTPS (the original queries)
+    PatientRepository          the Django ORM, on Django's own connection
+
+patient_repository(view) picks one per view from PATIENT_READ_BACKENDS,
+falling back to PATIENT_READ_BACKEND. fan_out() runs a view's independent
+reads at the same time when they are remote. Dates and datetimes come back as
+strings from PostgREST and as date/datetime objects from the ORM; both
+render the same in a Response.
+"""
+import base64
+import binascii
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as datetime_time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from appointment.models import Appointment
+from queueing.models import LatestTreatment, QueueHistory, TemporaryStorageQueue
+from queueing.models import Treatment as TreatmentModel
+from user.models import Doctor
+from .models import Patient
+
+PATIENT_COLUMNS = tuple(field.attname for field in Patient._meta.concrete_fields)
+QUEUE_COLUMNS = ("id", "status", "created_at", "priority_level", "queue_number", "complaint")
+TREATMENT_COLUMNS = ("id", "treatment_notes", "created_at", "updated_at", "patient_id")
+
+
+def columns_of(instance, columns=None):
+    """A model instance as a row dict of `columns` (default all concrete columns)."""
+    if columns is None:
+        columns = [field.attname for field in instance._meta.concrete_fields]
+    return {column: getattr(instance, column) for column in columns}
+
+
+class PatientRepository:
+    """Patient reads through the Django ORM."""
+
+    # reads share the request's connection and transaction, so they run in order
+    concurrent = False
+
+    def list_patients(self):
+        return list(Patient.objects.values(*PATIENT_COLUMNS))
+
+    def patient_page(self, after=None, limit=50, doctor_id=None):
+        """
+        Up to `limit` patients, most recent visit first and never-seen
+        patients last, after the key `after` ((last_visit_at, patient_id)
+        of the previous page's last row), each with only their latest queue
+        entry, live or archived, under "queueing_temporarystoragequeue".
+        `doctor_id` keeps the patients that doctor treated. Returns (rows,
+        key of the last row, or None on the last page).
+        """
+        patients = Patient.objects.all()
+        if doctor_id is not None:
+            patients = patients.filter(
+                patient_id__in=TreatmentModel.objects.filter(doctor_id=doctor_id).values("patient_id")
+            )
+        # visited patients walk patient_last_visit_idx, then the rest the primary key
+        visited = patients.filter(last_visit_at__isnull=False).order_by("-last_visit_at", "-patient_id")
+        never = patients.filter(last_visit_at__isnull=True).order_by("-patient_id")
+        if after is not None:
+            last_visit_at, patient_id = after
+            if last_visit_at is None:
+                visited = visited.none()
+                never = never.filter(patient_id__lt=patient_id)
+            else:
+                visited = visited.filter(
+                    Q(last_visit_at__lt=last_visit_at) | Q(last_visit_at=last_visit_at, patient_id__lt=patient_id)
+                )
+        rows = list(visited.values(*PATIENT_COLUMNS)[:limit + 1])
+        if len(rows) <= limit:
+            rows += never.values(*PATIENT_COLUMNS)[:limit + 1 - len(rows)]
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        latest = self.latest_queues(QUEUE_COLUMNS, [row["patient_id"] for row in rows])
+        for row in rows:
+            entry = latest.get(row["patient_id"])
+            row["queueing_temporarystoragequeue"] = [entry] if entry else []
+        return rows, page_key(rows[-1]["last_visit_at"], rows[-1]["patient_id"]) if more else None
+
+    def get_patient(self, patient_id, columns=PATIENT_COLUMNS):
+        return Patient.objects.filter(patient_id=patient_id).values(*columns).first()
+
+    def patients_by_ids(self, patient_ids, columns=PATIENT_COLUMNS):
+        return list(Patient.objects.filter(patient_id__in=patient_ids).values(*columns))
+
+    def latest_queue(self, patient_id, columns):
+        """The patient's most recent queue entry, live or archived."""
+        return QueueHistory.objects.filter(patient_id=patient_id).order_by("-created_at").values(*columns).first()
+
+    def latest_queues(self, columns, patient_ids=None):
+        """
+        patient_id -> most recent queue entry, live or archived, of
+        `patient_ids` (default every patient), picked in one query.
+        """
+        entries = QueueHistory.objects.filter(patient_id__isnull=False)
+        if patient_ids is not None:
+            entries = entries.filter(patient_id__in=patient_ids)
+        entries = entries.annotate(
+            visit_rank=Window(RowNumber(), partition_by=F("patient_id"), order_by=F("created_at").desc())
+        ).filter(visit_rank=1)
+        return {entry["patient_id"]: entry for entry in entries.values("patient_id", *columns)}
+
+    def treated_patient_page(self, after=None, limit=50):
+        """
+        Up to `limit` ids of patients with treatments, most recently treated
+        first, after the key `after` ((last treated at, patient_id) of the
+        previous page's last patient). Returns (ids, key of the last
+        patient, or None on the last page).
+        """
+        # walks latest_treatment_created_idx
+        latest = LatestTreatment.objects.order_by("-created_at", "-patient_id")
+        if after is not None:
+            last_treated_at, patient_id = after
+            latest = latest.filter(
+                Q(created_at__lt=last_treated_at) | Q(created_at=last_treated_at, patient_id__lt=patient_id)
+            )
+        rows = list(latest.values_list("created_at", "patient_id")[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return [patient_id for _, patient_id in rows], page_key(*rows[-1]) if more else None
+
+    def treatment_board_patients(self, day, start=None, end=None):
+        """
+        Ids of the patients in `day`'s active (not Completed) queue, plus
+        those whose latest treatment was recorded between the dates `start`
+        and `end` (either end may be open).
+        """
+        patient_ids = set(TemporaryStorageQueue.objects.filter(
+            queue_date=day, patient_id__isnull=False
+        ).exclude(status="Completed").values_list("patient_id", flat=True))
+        if start or end:
+            latest = LatestTreatment.objects.all()
+            if start:
+                latest = latest.filter(created_at__gte=day_start(start))
+            if end:
+                latest = latest.filter(created_at__lt=day_start(end + timedelta(days=1)))
+            patient_ids.update(latest.values_list("patient_id", flat=True))
+        return patient_ids
+
+    def treatments(self, patient_id=None, limit=None, patient=False, doctor=False, medicine=False,
+                   patient_ids=None, latest_only=False):
+        """
+        Treatments, newest first, of `patient_id` or `patient_ids` (default
+        all), with their diagnoses and prescriptions as join-table rows.
+        `patient` nests the patient row, `doctor` the doctor's name and
+        specialization, `medicine` each prescription's medicine (id and
+        name). `latest_only` keeps each patient's latest treatment.
+        """
+        queryset = TreatmentModel.objects.order_by("-created_at", "-id")
+        if patient_id is not None:
+            queryset = queryset.filter(patient_id=patient_id)
+        if patient_ids is not None:
+            queryset = queryset.filter(patient_id__in=patient_ids)
+        if latest_only:
+            queryset = queryset.filter(latest_for__isnull=False)
+        if doctor:
+            queryset = queryset.select_related("doctor__doctor_profile")
+        if limit:
+            queryset = queryset[:limit]
+        treatments = list(queryset)
+        ids = [treatment.id for treatment in treatments]
+
+        diagnoses = defaultdict(list)
+        for link in TreatmentModel.diagnoses.through.objects.filter(
+            treatment_id__in=ids
+        ).select_related("diagnosis").order_by("id"):
+            diagnoses[link.treatment_id].append({
+                "id": link.id,
+                "treatment_id": link.treatment_id,
+                "diagnosis_id": link.diagnosis_id,
+                "patient_diagnosis": columns_of(link.diagnosis),
+            })
+
+        prescriptions = defaultdict(list)
+        for link in TreatmentModel.prescriptions.through.objects.filter(
+            treatment_id__in=ids
+        ).select_related("prescription__medication").order_by("id"):
+            prescription = columns_of(link.prescription)
+            if medicine:
+                medication = link.prescription.medication
+                prescription["medicine_medicine"] = {"id": medication.id, "name": medication.name}
+            prescriptions[link.treatment_id].append({
+                "id": link.id,
+                "treatment_id": link.treatment_id,
+                "prescription_id": link.prescription_id,
+                "patient_prescription": prescription,
+            })
+
+        rows = []
+        for treatment in treatments:
+            row = columns_of(treatment, TREATMENT_COLUMNS)
+            if doctor:
+                row["doctor_id"] = self.doctor_row(treatment.doctor)
+            if patient:
+                row["patient_patient"] = columns_of(treatment.patient)
+            row["queueing_treatment_diagnoses"] = diagnoses[treatment.id]
+            row["queueing_treatment_prescriptions"] = prescriptions[treatment.id]
+            rows.append(row)
+        return rows
+
+    def doctor_row(self, user):
+        if user is None:
+            return None
+        profile = getattr(user, "doctor_profile", None)
+        return {
+            "id": user.id,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "user_doctor": {"specialization": profile.specialization} if profile else None,
+        }
+
+    def appointments(self, patient_id):
+        """The patient's appointments, newest first, with their referral (id and reason)."""
+        rows = []
+        for appointment in Appointment.objects.filter(patient_id=patient_id).select_related(
+            "appointmentreferral"
+        ).order_by("-appointment_date"):
+            referral = getattr(appointment, "appointmentreferral", None)
+            rows.append({
+                "appointment_date": appointment.appointment_date,
+                "status": appointment.status,
+                "doctor_id": appointment.doctor_id,
+                "appointment_appointmentreferral": {"id": referral.id, "reason": referral.reason} if referral else None,
+            })
+        return rows
+
+    def doctor_names(self, doctor_ids):
+        """Doctor profile id -> "First Last"."""
+        return {
+            doctor.id: f"{doctor.user.first_name} {doctor.user.last_name}".strip()
+            for doctor in Doctor.objects.filter(id__in=doctor_ids).select_related("user")
+        }
+
+
+class SupabasePatientRepository:
+    """Patient reads through Supabase PostgREST."""
+
+    # every read is an HTTPS round trip, so independent reads overlap
+    concurrent = True
+
+    @cached_property
+    def client(self):
+        from backend.supabase_client import supabase
+        return supabase
+
+    def list_patients(self):
+        return self.client.table("patient_patient").select("*").execute().data
+
+    def patient_page(self, after=None, limit=50, doctor_id=None):
+        select = "*"
+        if doctor_id is not None:
+            select += ", queueing_treatment!inner(doctor_id)"
+        query = self.client.table("patient_patient").select(select)
+        if doctor_id is not None:
+            query = query.eq("queueing_treatment.doctor_id", doctor_id)
+        if after is not None:
+            last_visit_at, patient_id = after
+            if last_visit_at is None:
+                query = query.is_("last_visit_at", "null").lt("patient_id", patient_id)
+            else:
+                query = query.or_(
+                    f'last_visit_at.lt.{quoted(last_visit_at)},'
+                    f'and(last_visit_at.eq.{quoted(last_visit_at)},patient_id.lt.{quoted(patient_id)}),'
+                    f'last_visit_at.is.null'
+                )
+        query = query.order("last_visit_at", desc=True, nullsfirst=False).order("patient_id", desc=True)
+        rows = query.limit(limit + 1).execute().data
+        more = len(rows) > limit
+        rows = rows[:limit]
+        # the latest visit may be archived, so read it from queueing_queuehistory
+        latest = self.latest_queues(QUEUE_COLUMNS, [row["patient_id"] for row in rows])
+        for row in rows:
+            row.pop("queueing_treatment", None)
+            entry = latest.get(row["patient_id"])
+            row["queueing_temporarystoragequeue"] = [entry] if entry else []
+        return rows, page_key(rows[-1]["last_visit_at"], rows[-1]["patient_id"]) if more else None
+
+    def get_patient(self, patient_id, columns=None):
+        select = ", ".join(columns) if columns else "*"
+        response = self.client.table("patient_patient").select(select).eq("patient_id", patient_id).execute()
+        return response.data[0] if response.data else None
+
+    def patients_by_ids(self, patient_ids, columns=None):
+        select = ", ".join(columns) if columns else "*"
+        return self.client.table("patient_patient").select(select).in_("patient_id", list(patient_ids)).execute().data
+
+    def latest_queue(self, patient_id, columns):
+        response = self.client.table("queueing_queuehistory").select(", ".join(columns)).eq(
+            "patient_id", patient_id
+        ).order("created_at", desc=True).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def latest_queues(self, columns, patient_ids=None):
+        # PostgREST has no DISTINCT ON; one round trip, reduced here
+        query = self.client.table("queueing_queuehistory").select(", ".join(("patient_id", *columns)))
+        if patient_ids is not None:
+            query = query.in_("patient_id", list(patient_ids))
+        response = query.execute()
+        latest = {}
+        for entry in response.data:
+            pid = entry["patient_id"]
+            if pid not in latest or entry["created_at"] > latest[pid]["created_at"]:
+                latest[pid] = entry
+        return latest
+
+    def treated_patient_page(self, after=None, limit=50):
+        query = self.client.table("queueing_latesttreatment").select("patient_id, created_at")
+        if after is not None:
+            last_treated_at, patient_id = after
+            query = query.or_(
+                f'created_at.lt.{quoted(last_treated_at)},'
+                f'and(created_at.eq.{quoted(last_treated_at)},patient_id.lt.{quoted(patient_id)})'
+            )
+        rows = query.order("created_at", desc=True).order("patient_id", desc=True).limit(limit + 1).execute().data
+        more = len(rows) > limit
+        rows = rows[:limit]
+        last = rows[-1] if rows else None
+        return [row["patient_id"] for row in rows], page_key(last["created_at"], last["patient_id"]) if more else None
+
+    def treatment_board_patients(self, day, start=None, end=None):
+        rows = self.client.table("queueing_temporarystoragequeue").select("patient_id").eq(
+            "queue_date", day.isoformat()
+        ).neq("status", "Completed").execute().data
+        patient_ids = {row["patient_id"] for row in rows if row["patient_id"]}
+        if start or end:
+            query = self.client.table("queueing_latesttreatment").select("patient_id")
+            if start:
+                query = query.gte("created_at", day_start(start).isoformat())
+            if end:
+                query = query.lt("created_at", day_start(end + timedelta(days=1)).isoformat())
+            patient_ids.update(row["patient_id"] for row in query.execute().data)
+        return patient_ids
+
+    def treatments(self, patient_id=None, limit=None, patient=False, doctor=False, medicine=False,
+                   patient_ids=None, latest_only=False):
+        select = [", ".join(TREATMENT_COLUMNS)]
+        if doctor:
+            select.append("doctor_id(id, first_name, last_name, user_doctor(specialization))")
+        if patient:
+            select.append("patient_patient(*)")
+        select.append("queueing_treatment_diagnoses(id, treatment_id, diagnosis_id, patient_diagnosis(*))")
+        prescription = "patient_prescription(*, medicine_medicine(id, name))" if medicine else "patient_prescription(*)"
+        select.append(f"queueing_treatment_prescriptions(id, treatment_id, prescription_id, {prescription})")
+        if latest_only:
+            select.append("queueing_latesttreatment!inner(patient_id)")
+
+        query = self.client.table("queueing_treatment").select(", ".join(select))
+        if patient_id is not None:
+            query = query.eq("patient_id", patient_id)
+        if patient_ids is not None:
+            query = query.in_("patient_id", list(patient_ids))
+        query = query.order("created_at", desc=True)
+        if limit:
+            query = query.limit(limit)
+        rows = query.execute().data
+        for row in rows:
+            row.pop("queueing_latesttreatment", None)
+        return rows
+
+    def appointments(self, patient_id):
+        return self.client.table("appointment_appointment").select(
+            "appointment_date, status, doctor_id, appointment_appointmentreferral(id, reason)"
+        ).eq("patient_id", patient_id).order("appointment_date", desc=True).execute().data or []
+
+    def doctor_names(self, doctor_ids):
+        response = self.client.table("user_doctor").select(
+            "id, user_useraccount ( first_name, last_name )"
+        ).in_("id", list(doctor_ids)).execute()
+        names = {}
+        for doc in response.data or []:
+            ua = doc.get("user_useraccount") or {}
+            names[doc["id"]] = f"{ua.get('first_name', '')} {ua.get('last_name', '')}".strip()
+        return names
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, datetime_time.min))
+
+
+def page_key(at, patient_id):
+    """A (timestamp, patient_id) page key, the timestamp as an ISO string."""
+    if at is not None and not isinstance(at, str):
+        at = at.isoformat()
+    return at, patient_id
+
+
+def encode_cursor(key):
+    """An opaque ?cursor= value for a patient_page() key."""
+    last_visit_at, patient_id = key
+    return base64.urlsafe_b64encode(f"{last_visit_at or ''}|{patient_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    The key of an encode_cursor() value; ValueError if it is not one. The
+    timestamp must parse as a datetime, since it ends up in filters.
+    """
+    try:
+        last_visit_at, patient_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        at = parse_datetime(last_visit_at) if last_visit_at else None
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if last_visit_at and at is None:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return page_key(at, patient_id)
+
+
+def quoted(value):
+    """`value` as a double-quoted PostgREST filter value."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+REPOSITORIES = {
+    "orm": PatientRepository,
+    "supabase": SupabasePatientRepository,
+}
+
+
+def patient_repository(view):
+    """The repository configured for `view` (a view instance or class name)."""
+    name = view if isinstance(view, str) else type(view).__name__
+    backend = settings.PATIENT_READ_BACKENDS.get(name, settings.PATIENT_READ_BACKEND)
+    try:
+        return REPOSITORIES[backend]()
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown patient read backend {backend!r} for {name}; use one of {', '.join(REPOSITORIES)}"
+        )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def read_executor():
+    """The process-wide pool for remote reads, PATIENT_READ_WORKERS threads."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PATIENT_READ_WORKERS, thread_name_prefix="patient-read"
+            )
+        return _executor
+
+
+def fan_out(repository, calls):
+    """
+    Run `calls` ({name: callable}) and return {name: result}. For a
+    concurrent repository they are submitted together to read_executor()
+    and each must finish within PATIENT_READ_TIMEOUT seconds of
+    submission, else concurrent.futures.TimeoutError is raised (the late
+    call still finishes in the background). Otherwise they run in order.
+    """
+    if not repository.concurrent:
+        return {name: call() for name, call in calls.items()}
+    executor = read_executor()
+    futures = {name: executor.submit(call) for name, call in calls.items()}
+    deadline = time.monotonic() + settings.PATIENT_READ_TIMEOUT
+    try:
+        return {
+            name: future.result(timeout=max(0, deadline - time.monotonic()))
+            for name, future in futures.items()
+        }
+    finally:
+        for future in futures.values():
+            future.cancel()
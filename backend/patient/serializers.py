@@ -12,7 +12,7 @@ from rest_framework import serializers
 from .models import Patient  # Adjust as needed
 from medicine.serializers import MedicineSerializer
 
-from queueing.models import TemporaryStorageQueue, Treatment
+from queueing.models import TemporaryStorageQueue, Treatment, QueueHistory
 from appointment.models import Appointment
 
 
@@ -265,7 +265,7 @@ class PatientVisitSerializer(serializers.ModelSerializer):
     treatment_created_at = serializers.SerializerMethodField()
 
     class Meta:
-        model = TemporaryStorageQueue
+        model = QueueHistory
         fields = [
             'id', 'patient_name', 'priority_level', 'status',
             'complaint', 'queue_number', 'visit_date',
@@ -353,9 +353,9 @@ class PatientMedicalRecordSerializer(serializers.ModelSerializer):
             'complaint'
         ]
     def get_complaint(self, obj):
-        # Fetch the latest queue entry (if any) for the patient
-        queue = TemporaryStorageQueue.objects.filter(
-            patient=obj.patient
+        # Fetch the latest queue entry (if any) for the patient, archived ones included
+        queue = QueueHistory.objects.filter(
+            patient_id=obj.patient_id
         ).order_by('-created_at').first()
 
         return queue.complaint if queue else None
\ No newline at end of file
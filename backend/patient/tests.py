@@ -1,3 +1,362 @@
-from django.test import TestCase
+import time
+from urllib.parse import parse_qs, urlparse
+from datetime import date, datetime, timezone
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from unittest import mock
+
+from appointment.models import Appointment, AppointmentReferral
+from medicine.models import Medicine
+from queueing.models import LatestTreatment, TemporaryStorageQueue, refresh_latest_treatment
+from queueing.models import Treatment as TreatmentModel
+from user.models import Doctor, UserAccount
+from .models import Diagnosis, Patient, Prescription
+from .repository import QUEUE_COLUMNS, PatientRepository, SupabasePatientRepository, encode_cursor, patient_repository, quoted
+from .views import (
+    PatientInfoView, PatientListView, PatientReportview, PatientTreatmentListView,
+    TotalPatientsAPIView, Treatment, TreatmentDetailView,
+)
+
+
+class PatientRepositorySelectionTests(TestCase):
+    @override_settings(PATIENT_READ_BACKEND="supabase", PATIENT_READ_BACKENDS={"PatientInfoView": "orm"})
+    def test_per_view_override(self):
+        self.assertIsInstance(patient_repository(PatientInfoView()), PatientRepository)
+        self.assertIsInstance(patient_repository("PatientListView"), SupabasePatientRepository)
+
+    @override_settings(PATIENT_READ_BACKEND="graphql", PATIENT_READ_BACKENDS={})
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            patient_repository("PatientListView")
+
+
+@override_settings(PATIENT_READ_BACKEND="orm", PATIENT_READ_BACKENDS={})
+class PatientOrmReadTests(TestCase):
+    def setUp(self):
+        user = UserAccount.objects.create_user(
+            email="juan@example.com", password="x", first_name="Juan", last_name="Cruz", role="patient",
+        )
+        self.patient = Patient.objects.create(
+            user=user, first_name="Juan", last_name="Cruz", email=user.email,
+            phone_number="09170000000", date_of_birth=date(1990, 5, 1),
+        )
+        self.doctor = UserAccount.objects.create_user(
+            email="doc@example.com", password="x", first_name="Maria", last_name="Santos", role="doctor",
+        )
+        self.profile = Doctor.objects.create(user=self.doctor, specialization="Internal Medicine")
+        self.entry = TemporaryStorageQueue.objects.create(
+            patient=self.patient, status="Ongoing for Treatment", priority_level="Regular", complaint="Injury",
+        )
+        medicine = Medicine.objects.create(name="Paracetamol", dosage_form="Tablet", strength="500mg", stocks=10)
+        self.old = TreatmentModel.objects.create(patient=self.patient, doctor=self.doctor, treatment_notes="First")
+        self.latest = TreatmentModel.objects.create(patient=self.patient, doctor=self.doctor, treatment_notes="Second")
+        self.latest.diagnoses.add(Diagnosis.objects.create(
+            patient=self.patient, diagnosis_description="Sprain", diagnosis_date=date(2025, 3, 1),
+        ))
+        self.latest.prescriptions.add(Prescription.objects.create(
+            patient=self.patient, medication=medicine, dosage="500mg", frequency="TID", start_date=date(2025, 3, 1),
+        ))
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.profile, scheduled_by=self.doctor,
+            appointment_date=datetime(2025, 4, 1, 9, tzinfo=timezone.utc),
+        )
+        AppointmentReferral.objects.create(
+            referring_doctor=self.doctor, patient=self.patient, reason="Follow-up", appointment=appointment,
+        )
+
+    def get(self, view, *args, role="doctor", **kwargs):
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, user=UserAccount(id="staff-1", role=role))
+        # any PostgREST call would fail the test
+        with mock.patch.object(SupabasePatientRepository, "client", new_callable=mock.PropertyMock) as client:
+            response = view.as_view()(request, *args, **kwargs)
+        client.assert_not_called()
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_patient_info(self):
+        data = self.get(PatientInfoView, self.patient.patient_id)
+        self.assertEqual(data["patient"]["patient_id"], self.patient.patient_id)
+        self.assertEqual(data["patient"]["queue_data"]["id"], self.entry.id)
+        self.assertEqual(data["latest_treatment_id"], self.latest.id)
+        self.assertEqual(data["latest_treatment"]["diagnoses"][0]["diagnosis_description"], "Sprain")
+        self.assertEqual(data["latest_treatment"]["prescriptions"][0]["medicine_medicine"]["name"], "Paracetamol")
+        self.assertEqual(data["appointments"][0]["doctor_name"], "Maria Santos")
+        self.assertEqual(data["appointments"][0]["reason"], "Follow-up")
+
+    def test_treatment_detail_and_report(self):
+        data = self.get(TreatmentDetailView, patient_id=self.patient.patient_id)
+        self.assertEqual(data["recent_treatment"]["id"], self.latest.id)
+        self.assertEqual(data["recent_treatment"]["doctor_info"], {
+            "id": self.doctor.id, "name": "Maria Santos", "specialization": "Internal Medicine",
+        })
+        self.assertEqual(data["recent_treatment"]["prescriptions"][0]["medication"]["name"], "Paracetamol")
+        self.assertEqual([t["id"] for t in data["previous_treatments"]], [self.old.id])
+
+        report = self.get(PatientReportview, self.patient.patient_id)
+        self.assertEqual(report["all_treatment_notes"], ["Second", "First"])
+        self.assertEqual(len(report["all_diagnoses"]), 1)
+
+    def test_treatment_boards(self):
+        board = self.get(Treatment)
+        self.assertEqual(len(board), 1)
+        self.assertEqual(board[0]["latest_treatment_id"], self.latest.id)
+        self.assertEqual(board[0]["latest_treatment"]["status"], "Ongoing for Treatment")
+
+        grouped = self.get(PatientTreatmentListView)["results"]
+        self.assertEqual(grouped[0]["latest_treatment_id"], self.latest.id)
+        self.assertEqual(grouped[0]["patient"]["queue_data"]["id"], self.entry.id)
+        self.assertEqual([t["id"] for t in grouped[0]["old_treatments"]], [self.old.id])
+
+    def test_patient_lists(self):
+        patients = self.get(PatientListView, role="secretary")["results"]
+        self.assertEqual(patients[0]["latest_queue"]["id"], self.entry.id)
+        self.assertEqual(patients[0]["age"], self.patient.get_age())
+        self.assertEqual(self.get(TotalPatientsAPIView)["count"], 1)
+
+    def test_treatment_queries_do_not_grow_with_rows(self):
+        for _ in range(5):
+            treatment = TreatmentModel.objects.create(patient=self.patient, doctor=self.doctor)
+            treatment.diagnoses.add(*Diagnosis.objects.all())
+            treatment.prescriptions.add(*Prescription.objects.all())
+        # treatments with patient and doctor, diagnoses, prescriptions
+        with self.assertNumQueries(3):
+            rows = PatientRepository().treatments(patient=True, doctor=True, medicine=True)
+        self.assertEqual(len(rows), 7)
+
+
+def slow(result, seconds=0.3):
+    def call(self, *args, **kwargs):
+        time.sleep(seconds)
+        return result
+    return call
+
+
+@override_settings(PATIENT_READ_BACKEND="supabase", PATIENT_READ_BACKENDS={}, PATIENT_READ_TIMEOUT=2)
+class PatientInfoFanOutTests(TestCase):
+    patient = {"patient_id": "cruz-1", "last_name": "Cruz", "date_of_birth": "1990-05-01"}
+
+    def get(self, **patches):
+        calls = {
+            "get_patient": slow(self.patient),
+            "latest_queue": slow(None),
+            "treatments": slow([]),
+            "appointments": slow([{"appointment_date": "2025-04-01T09:00:00", "status": "Scheduled",
+                                   "doctor_id": 7, "appointment_appointmentreferral": None}]),
+            "doctor_names": slow({7: "Maria Santos"}),
+            **patches,
+        }
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, user=UserAccount(id="staff-1", role="doctor"))
+        with mock.patch.multiple(SupabasePatientRepository, **calls):
+            started = time.monotonic()
+            response = PatientInfoView.as_view()(request, "cruz-1")
+        return response, time.monotonic() - started
+
+    def test_remote_reads_overlap(self):
+        response, elapsed = self.get()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["patient"]["age"], Patient(date_of_birth=date(1990, 5, 1)).get_age())
+        self.assertEqual(response.data["appointments"][0]["doctor_name"], "Maria Santos")
+        # appointments then doctor names is the longest chain (0.6s); in
+        # sequence the five reads take 1.5s
+        self.assertLess(elapsed, 1.2)
+
+    def test_timeout(self):
+        response, elapsed = self.get(treatments=slow([], seconds=3))
+        self.assertEqual(response.status_code, 504)
+        self.assertLess(elapsed, 2.8)
+
+
+def make_patient(n, visits=0):
+    user = UserAccount.objects.create_user(
+        email=f"p{n}@example.com", password="x", first_name="Juan", last_name=f"Cruz{n}", role="patient",
+    )
+    patient = Patient.objects.create(
+        user=user, first_name="Juan", last_name=f"Cruz{n}", email=user.email, phone_number="09170000000",
+    )
+    for _ in range(visits):
+        TemporaryStorageQueue.objects.create(patient=patient, status="Completed")
+    return patient
+
+
+@override_settings(PATIENT_READ_BACKEND="orm", PATIENT_READ_BACKENDS={})
+class PatientListPageTests(TestCase):
+    def setUp(self):
+        # created in visit order, so the latest visitor comes first
+        self.never = make_patient(0)
+        self.visited = [make_patient(n, visits=n % 3 + 1) for n in range(1, 8)]
+
+    def page(self, role="secretary", user_id="staff-1", **params):
+        request = APIRequestFactory().get("/patients/", params)
+        force_authenticate(request, user=UserAccount(id=user_id, role=role))
+        return PatientListView.as_view()(request)
+
+    def test_walks_every_patient_once_in_visit_order(self):
+        seen, params = [], {"page_size": 3}
+        while True:
+            response = self.page(**params)
+            self.assertEqual(response.status_code, 200, response.data)
+            seen += response.data["results"]
+            if not response.data["next"]:
+                break
+            params = {"page_size": 3, "cursor": parse_qs(urlparse(response.data["next"]).query)["cursor"][0]}
+        self.assertEqual(
+            [row["patient_id"] for row in seen],
+            [p.patient_id for p in reversed(self.visited)] + [self.never.patient_id],
+        )
+        # only the latest entry is embedded
+        latest = TemporaryStorageQueue.objects.filter(patient=self.visited[-1]).latest("created_at")
+        self.assertEqual([q["id"] for q in seen[0]["queue_data"]], [latest.id])
+        self.assertIsNone(seen[-1]["latest_queue"])
+
+    def test_queries_do_not_grow_with_page_size(self):
+        # visited patients, never-seen patients, latest queue entries
+        for page_size in (2, 8):
+            with CaptureQueriesContext(connection) as queries:
+                self.page(page_size=page_size)
+            self.assertLessEqual(len(queries), 3)
+
+    def test_on_call_doctor_sees_own_patients(self):
+        doctor = UserAccount.objects.create_user(
+            email="oncall@example.com", password="x", first_name="Ana", last_name="Reyes", role="on-call-doctor",
+        )
+        TreatmentModel.objects.create(patient=self.visited[2], doctor=doctor)
+        TreatmentModel.objects.create(patient=self.visited[2], doctor=doctor)
+        response = self.page(role="on-call-doctor", user_id=doctor.id)
+        self.assertEqual([row["patient_id"] for row in response.data["results"]], [self.visited[2].patient_id])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.page(cursor="not a cursor").status_code, 400)
+        self.assertEqual(self.page(cursor=encode_cursor((None, "zzz"))).status_code, 200)
+        # the timestamp is checked before it reaches a PostgREST filter
+        forged = encode_cursor(('2025-01-01",patient_id.neq."x', "zzz"))
+        self.assertEqual(self.page(cursor=forged).status_code, 400)
+
+    def test_supabase_page_embeds_archived_latest_visit(self):
+        rows = [{"patient_id": "P2", "last_visit_at": "2025-03-02T00:00:00Z"}, {"patient_id": "P1", "last_visit_at": None}]
+        query = mock.MagicMock()
+        for method in ("table", "select", "eq", "or_", "is_", "lt", "order", "limit"):
+            getattr(query, method).return_value = query
+        query.execute.return_value.data = rows
+        archived = {"id": 9, "patient_id": "P2", "created_at": "2025-03-02T00:00:00Z"}
+        with mock.patch.object(SupabasePatientRepository, "client", new_callable=mock.PropertyMock, return_value=query), \
+                mock.patch.object(SupabasePatientRepository, "latest_queues", return_value={"P2": archived}) as latest:
+            page, last_key = SupabasePatientRepository().patient_page(limit=5)
+        latest.assert_called_once_with(QUEUE_COLUMNS, ["P2", "P1"])
+        self.assertEqual([row["queueing_temporarystoragequeue"] for row in page], [[archived], []])
+        self.assertIsNone(last_key)
+
+    def test_postgrest_values_are_quoted(self):
+        self.assertEqual(quoted('a"b\\c,d)'), '"a\\"b\\\\c,d)"')
+
+    def test_accepting_a_walk_in_records_the_visit(self):
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="New", status="Waiting")
+        self.never.refresh_from_db()
+        self.assertIsNone(self.never.last_visit_at)
+        entry = TemporaryStorageQueue.objects.get(pk=entry.pk)
+        entry.patient = self.never
+        entry.save()
+        self.never.refresh_from_db()
+        self.assertEqual(self.never.last_visit_at, entry.created_at)
+        # an older entry never moves it back
+        older = TemporaryStorageQueue.objects.create(patient=self.visited[0], status="Completed")
+        TemporaryStorageQueue.objects.filter(pk=older.pk).update(created_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        older = TemporaryStorageQueue.objects.get(pk=older.pk)
+        older.patient = self.never
+        older.save()
+        self.never.refresh_from_db()
+        self.assertEqual(self.never.last_visit_at, entry.created_at)
+
+
+@override_settings(PATIENT_READ_BACKEND="orm", PATIENT_READ_BACKENDS={})
+class PatientTreatmentListPageTests(TestCase):
+    def setUp(self):
+        self.patients = [make_patient(n, visits=1) for n in range(3)]
+        # the first patient was treated last
+        for patient, treatments in zip(reversed(self.patients), (1, 2, 20)):
+            for _ in range(treatments):
+                TreatmentModel.objects.create(patient=patient)
+
+    def page(self, **params):
+        request = APIRequestFactory().get("/patient/patient-treatment-list", params)
+        force_authenticate(request, user=UserAccount(id="staff-1", role="doctor"))
+        response = PatientTreatmentListView.as_view()(request)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_pages_by_patient(self):
+        seen, params = [], {"page_size": 2}
+        while True:
+            data = self.page(**params)
+            seen += data["results"]
+            if not data["next"]:
+                break
+            params = {"page_size": 2, "cursor": parse_qs(urlparse(data["next"]).query)["cursor"][0]}
+        self.assertEqual([row["patient"]["patient_id"] for row in seen], [p.patient_id for p in self.patients])
+        self.assertEqual(len(seen[0]["old_treatments"]), 19)
+        latest = TemporaryStorageQueue.objects.get(patient=self.patients[0])
+        self.assertEqual(seen[0]["patient"]["queue_data"]["id"], latest.id)
+
+    def test_queries_do_not_grow_with_treatments(self):
+        # patients, treatments, diagnoses, prescriptions, latest queue entries
+        with self.assertNumQueries(5):
+            self.page()
+
+
+@override_settings(PATIENT_READ_BACKEND="orm", PATIENT_READ_BACKENDS={})
+class TreatmentBoardTests(TestCase):
+    def setUp(self):
+        self.waiting, self.done, self.earlier = [make_patient(n) for n in range(3)]
+        TemporaryStorageQueue.objects.create(patient=self.waiting, status="Queued for Treatment")
+        TemporaryStorageQueue.objects.create(patient=self.done, status="Completed")
+        self.current = TreatmentModel.objects.create(patient=self.waiting)
+        self.treated_on(self.done, datetime(2025, 3, 1, 9, tzinfo=timezone.utc))
+        self.treated_on(self.earlier, datetime(2025, 3, 10, 9, tzinfo=timezone.utc))
+
+    def treated_on(self, patient, at):
+        treatment = TreatmentModel.objects.create(patient=patient)
+        TreatmentModel.objects.filter(pk=treatment.pk).update(created_at=at)
+        refresh_latest_treatment(patient.patient_id)
+        return treatment
+
+    def board(self, **params):
+        request = APIRequestFactory().get("/patient/treatment", params)
+        force_authenticate(request, user=UserAccount(id="staff-1", role="doctor"))
+        return Treatment.as_view()(request)
+
+    def test_latest_treatment_follows_creates_and_deletes(self):
+        newer = TreatmentModel.objects.create(patient=self.waiting)
+        self.assertEqual(LatestTreatment.objects.get(patient=self.waiting).treatment_id, newer.id)
+        newer.delete()
+        self.assertEqual(LatestTreatment.objects.get(patient=self.waiting).treatment_id, self.current.id)
+        self.current.delete()
+        self.assertFalse(LatestTreatment.objects.filter(patient=self.waiting).exists())
+
+    def test_todays_active_queue_plus_window(self):
+        response = self.board()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([row["latest_treatment_id"] for row in response.data], [self.current.id])
+
+        response = self.board(start="2025-03-01", end="2025-03-05")
+        self.assertEqual(
+            {row["patient"]["patient_id"] for row in response.data},
+            {self.waiting.patient_id, self.done.patient_id},
+        )
+        self.assertEqual(self.board(start="March").status_code, 400)
+
+    def test_queries_do_not_grow_with_history(self):
+        with CaptureQueriesContext(connection) as before:
+            self.board()
+        for n in range(3, 8):
+            patient = make_patient(n, visits=2)
+            for _ in range(3):
+                TreatmentModel.objects.create(patient=patient)
+        with CaptureQueriesContext(connection) as after:
+            data = self.board().data
+        self.assertEqual(len(data), 1)
+        self.assertEqual(len(after), len(before))
@@ -12,6 +12,7 @@ urlpatterns = [
 
     path('patient/patient-register/', views.PatientRegister.as_view(), name='patient-register'),
     path("patient/update-status/", views.AcceptButton.as_view(), name="update_status"),
+    path("patient/update-status/bulk/", views.BulkAcceptButton.as_view(), name="update_status_bulk"),
     path("patient/save-draft-treatment/", views.SaveButton.as_view(), name="update_status"),
 
     # treatment list
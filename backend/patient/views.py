@@ -4,16 +4,16 @@ from rest_framework import status
 from django.http import Http404, FileResponse
 from django.shortcuts import get_object_or_404
 from django.db.models.functions import Lower
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 
 from queueing.serializers import PreliminaryAssessmentBasicSerializer
 from .serializers import PatientMedicalRecordSerializer, PatientSerializer, PatientRegistrationSerializer, LabRequestSerializer, LabResultSerializer, PatientVisitSerializer, PatientLabTestSerializer, CommonDiseasesSerializer
-from queueing.models import  PreliminaryAssessment, TemporaryStorageQueue
+from queueing.models import  PreliminaryAssessment, TemporaryStorageQueue, QueueHistory
 from queueing.models import Treatment as TreatmentModel
 
 from datetime import datetime
 from django.db.models import Max
-from django.db.models import Q, Prefetch
+from django.db.models import OuterRef, Q, Subquery
 from patient.models import Patient, Prescription
 
 # Supabase credentials
@@ -40,12 +40,37 @@ from collections import defaultdict
 # create user
 from user.models import UserAccount
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from queueing.utils import compute_queue_snapshot
+from queueing.utils import broadcast_status_change, broadcast_topics, bulk_transition
+from django.db import transaction
+from user.models import allocate_user_ids
+from .repository import decode_cursor, encode_cursor, fan_out, patient_repository
+from rest_framework.utils.urls import replace_query_param
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+def page_params(request, view):
+    """
+    The page key and size of a keyset-paginated list: ?cursor= and
+    ?page_size= (default view.page_size, at most view.max_page_size).
+    Raises ValueError for a bad value.
+    """
+    cursor = request.query_params.get("cursor")
+    after = decode_cursor(cursor) if cursor else None
+    page_size = min(int(request.query_params.get("page_size", view.page_size)), view.max_page_size)
+    if page_size < 1:
+        raise ValueError("page_size must be positive")
+    return after, page_size
+
+
+def next_page_url(request, last_key):
+    if last_key is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), "cursor", encode_cursor(last_key))
+
 
 class PatientListView(APIView):
     permission_classes = [IsMedicalStaff]
+    page_size = 50
+    max_page_size = 200
 
     def get(self, request):
         try:
@@ -54,38 +79,24 @@ class PatientListView(APIView):
             user_id = request.user.id
             print(user_id)
             if role == "on-call-doctor" and user_id != "cooper-020006" :
-                response = supabase.table("queueing_treatment").select(
-                    "patient_patient(*, queueing_temporarystoragequeue(id, status, created_at, priority_level, queue_number, complaint))"
-                ).eq("doctor_id",user_id).execute()
-                
-                patients = [t["patient_patient"] for t in response.data if "patient_patient" in t]
+                doctor_id = user_id
             elif role in ["secretary", "admin"] or user_id == "cooper-020006":
-                response = (
-                    supabase.table("patient_patient").select("*, queueing_temporarystoragequeue(id, status, created_at, priority_level, queue_number, complaint)").execute()
-                )
-                patients = response.data
+                doctor_id = None
             else: 
                 return Response(
                     {"error": "Unauthorized role"}, 
                     status=status.HTTP_403_FORBIDDEN
                 )
-            for patient in patients:
-                patient_id = patient.get('id', 'unknown')
-                queue_list = patient.get('queueing_temporarystoragequeue') or []
-                
-                if queue_list:
-                    sorted_queue = sorted(
-                        queue_list,
-                        key=lambda q: q.get('created_at'),
-                        reverse=True
-                    )
-                    latest_queue = sorted_queue[0]
-                    print(f"Latest queue for patient {patient_id}: {latest_queue}")
-                else:
-                    print(f"No queue entries for patient {patient_id}.")
 
+            try:
+                after, page_size = page_params(request, self)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # one page, most recent visit first, each patient with only their latest queue entry
+            patients, last_key = patient_repository(self).patient_page(after, page_size, doctor_id=doctor_id)
             serializer = PatientSerializer(patients, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response({"next": next_page_url(request, last_key), "results": serializer.data}, status=status.HTTP_200_OK)
 
         except Exception as e:
             print("Exception occurred:", e)
@@ -96,16 +107,33 @@ class PatientInfoView(APIView):
     
     def get(self, request, patient_id):
         try: 
-            # Fetch patient details
-            response = supabase.table("patient_patient").select("*").eq("patient_id", patient_id).execute()
-            if hasattr(response, 'error') and response.error:
-                return Response({"error": response.error.message}, status=status.HTTP_400_BAD_REQUEST)
+            repository = patient_repository(self)
 
-            patient_data = response.data[0] if response.data else None
+            def appointments_with_doctors():
+                # the doctor names need the appointments, so they follow them
+                appointment_data = repository.appointments(patient_id)
+                doctor_ids = list({a["doctor_id"] for a in appointment_data if a.get("doctor_id")})
+                return appointment_data, repository.doctor_names(doctor_ids) if doctor_ids else {}
+
+            # Fetch patient details, latest queue data, latest treatment with
+            # related diagnoses and prescriptions, and appointments at once
+            try:
+                results = fan_out(repository, {
+                    "patient": lambda: repository.get_patient(patient_id),
+                    "queue": lambda: repository.latest_queue(
+                        patient_id, ("id", "priority_level", "created_at", "queue_number", "complaint", "status")
+                    ),
+                    "treatments": lambda: repository.treatments(patient_id, limit=1, medicine=True),
+                    "appointments": appointments_with_doctors,
+                })
+            except FuturesTimeoutError:
+                return Response({"error": "Patient data took too long to load"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+            patient_data = results["patient"]
             if not patient_data:
                 return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
 
-            if patient_data.get("date_of_birth"):
+            if isinstance(patient_data.get("date_of_birth"), str):
                 try:
                     patient_data['date_of_birth'] = datetime.strptime(patient_data["date_of_birth"], "%Y-%m-%d").date()
                 except Exception as e:
@@ -114,40 +142,14 @@ class PatientInfoView(APIView):
             patient_age = Patient(**patient_data)
             patient_data['age'] = patient_age.get_age()
             
-            # Fetch latest queue data
-            queue_response = supabase.table("queueing_temporarystoragequeue").select(
-                "id, priority_level, created_at, queue_number, complaint, status"
-            ).eq("patient_id", patient_id).order("created_at", desc=True).execute()
-            queue_data = queue_response.data[0] if queue_response.data else None
-
-            # Fetch latest treatment with related diagnoses and prescriptions
-            treatment_response = supabase.table("queueing_treatment").select(
-                "id, treatment_notes, created_at, updated_at, patient_id, "
-                "queueing_treatment_diagnoses(id, diagnosis_id, patient_diagnosis(*)), "
-                "queueing_treatment_prescriptions(id, prescription_id, patient_prescription(*, medicine_medicine(id, name)))"
-            ).eq("patient_id", patient_id).order("created_at", desc=True).limit(1).execute()
-            
-            appointment_response = supabase.table('appointment_appointment').select(
-                "appointment_date, status, doctor_id, "
-                "appointment_appointmentreferral(id, reason)"
-            ).eq('patient_id', patient_id).order('appointment_date', desc=True).execute()
-            appointment_data = appointment_response.data or [] 
+            queue_data = results["queue"]
+            treatment_data = results["treatments"]
+            appointment_data, doctor_name_map = results["appointments"]
             print(appointment_data)
-            doctor_ids = list({a["doctor_id"] for a in appointment_data if a.get("doctor_id")})
-            doctor_name_map = {}
-            
-            if doctor_ids:
-                doctors_resp = supabase.table("user_doctor") \
-                    .select("id, user_useraccount ( first_name, last_name )") \
-                    .in_("id", doctor_ids) \
-                    .execute()
-                for doc in doctors_resp.data or []:
-                        ua = doc.get("user_useraccount") or {}
-                        doctor_name_map[doc["id"]] = f"{ua.get('first_name','')} {ua.get('last_name','')}".strip()
                             
             annotated_appts = []
             for a in appointment_data:
-                referral = a.get("appointment_appointmentreferral", {})
+                referral = a.get("appointment_appointmentreferral") or {}
                 reason   = referral.get("reason", "")
                 annotated_appts.append({
                     "appointment_date": a["appointment_date"],
@@ -157,7 +159,7 @@ class PatientInfoView(APIView):
                     "reason":           reason,
                 })       
                     
-            latest_treatment = treatment_response.data[0] if treatment_response.data else None
+            latest_treatment = treatment_data[0] if treatment_data else None
             if latest_treatment:
                 diagnoses = [
                     d["patient_diagnosis"] for d in latest_treatment.get("queueing_treatment_diagnoses", []) if d.get("patient_diagnosis")
@@ -204,11 +206,10 @@ class PreliminaryAssessmentView(APIView):
     permission_classes = [IsMedicalStaff]
     def get(self, request, patient_id, queue_number):
         try:
-            # Fetch patient details from Supabase
-            response = supabase.table("patient_patient").select(
-                "patient_id, first_name, last_name, date_of_birth, phone_number"
-            ).eq("patient_id", patient_id).execute()
-            patient_data = response.data[0] if response.data else None
+            # Fetch patient details
+            patient_data = patient_repository(self).get_patient(
+                patient_id, ("patient_id", "first_name", "last_name", "date_of_birth", "phone_number")
+            )
 
             if not patient_data:
                 return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -238,45 +239,36 @@ class Treatment(APIView):
 
     def get(self, request): 
         try:
-            # 1. Fetch all treatment records from Supabase in a single query
-            treatment_response = supabase.table("queueing_treatment").select(
-                "id, treatment_notes, created_at, updated_at, patient_id, "
-                "patient_patient(*), "
-                "queueing_treatment_diagnoses(id, treatment_id, diagnosis_id, patient_diagnosis(*)), "
-                "queueing_treatment_prescriptions(id, treatment_id, prescription_id, patient_prescription(*))"
-            ).execute()
-
-            if hasattr(treatment_response, 'error') and treatment_response.error:
-                return Response({"error": treatment_response.error.message},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            treatment_data = treatment_response.data
-            
-            # 2. Fetch all queue data in a single query
-            queue_response = supabase.table("queueing_temporarystoragequeue").select(
-                "id, priority_level, status, created_at, queue_number, complaint, patient_id"
-            ).execute()
+            # Optional window of latest treatments to show besides today's queue
+            start_raw = request.query_params.get("start")
+            end_raw = request.query_params.get("end")
+            start_date = parse_date(str(start_raw)) if start_raw else None
+            end_date = parse_date(str(end_raw)) if end_raw else None
+            if (start_raw and not start_date) or (end_raw and not end_date):
+                return Response({"error": "start and end must be YYYY-MM-DD dates"}, status=status.HTTP_400_BAD_REQUEST)
+
+            repository = patient_repository(self)
+            # 1. The board's patients: today's active queue plus the window
+            board_patient_ids = repository.treatment_board_patients(localdate(), start_date, end_date)
+
+            # 2. Their latest treatments, one per patient
+            treatment_data = repository.treatments(patient=True, patient_ids=board_patient_ids, latest_only=True)
             
-            # Create a mapping of patient_id to their latest queue data
-            queue_map = {}
-            for queue_item in queue_response.data:
-                pid = queue_item["patient_id"]
-                # Keep only the most recent queue item for each patient
-                if pid not in queue_map or queue_item["created_at"] > queue_map[pid]["created_at"]:
-                    queue_map[pid] = queue_item
+            # 3. Map patient_id to their latest queue data in a single query
+            queue_map = repository.latest_queues(
+                ("id", "priority_level", "status", "created_at", "queue_number", "complaint"), board_patient_ids
+            )
             
-            # 3. Get all patient IDs from both treatments and queues
             treatment_patient_ids = {item["patient_id"] for item in treatment_data}
             queue_patient_ids = set(queue_map.keys())
-            all_patient_ids = treatment_patient_ids.union(queue_patient_ids)
             
-            # 4. Fetch all patient details in a single query
-            patient_response = supabase.table("patient_patient").select(
-                "patient_id, first_name, middle_name, last_name"
-            ).in_("patient_id", list(all_patient_ids)).execute()
+            # 4. Fetch details of the patients without a treatment in a single query
+            patient_rows = repository.patients_by_ids(
+                queue_patient_ids - treatment_patient_ids, ("patient_id", "first_name", "middle_name", "last_name")
+            )
             
             # Create a mapping of patient_id to patient details
-            patient_map = {p["patient_id"]: p for p in patient_response.data}
+            patient_map = {p["patient_id"]: p for p in patient_rows}
 
             # Dictionary to group treatment records by patient_id.
             patient_treatments = {}
@@ -381,60 +373,46 @@ class Treatment(APIView):
 
 class PatientTreatmentListView(APIView):
     permission_classes = [IsMedicalStaff]
+    page_size = 50
+    max_page_size = 200
+
     def get(self, request):
         try:
-            # Fetch all treatment records from Supabase
-            response = supabase.table("queueing_treatment").select(
-                "id, treatment_notes, created_at, updated_at, patient_id, "
-                "patient_patient(*), "
-                "queueing_treatment_diagnoses(id, treatment_id, diagnosis_id, patient_diagnosis(*)), "
-                "queueing_treatment_prescriptions(id, treatment_id, prescription_id, patient_prescription(*))"
-            ).execute()
-
-            if hasattr(response, 'error') and response.error:
-                return Response({"error": response.error.message}, status=status.HTTP_400_BAD_REQUEST)
-
-            treatments_data = response.data  # All treatment records
+            try:
+                after, page_size = page_params(request, self)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            repository = patient_repository(self)
+            # One page of patients, most recently treated first, then their
+            # treatments and latest queue entries in one batch each
+            patient_ids, last_key = repository.treated_patient_page(after, page_size)
+            treatments_data = repository.treatments(patient=True, patient_ids=patient_ids)
+            queue_map = repository.latest_queues(
+                ("id", "priority_level", "status", "created_at", "queue_number", "complaint"), patient_ids
+            )
 
-            # Group treatments by patient_id
-            grouped = {}
+            # Group treatments by patient_id, in page order
+            grouped = {pid: [] for pid in patient_ids}
             for item in treatments_data:
-                pid = item["patient_id"]
+                grouped[item["patient_id"]].append(item)
 
-                # Fetch the latest queue data for this patient from the temporary storage queue
-                queue_response = supabase.table("queueing_temporarystoragequeue").select(
-                    "id, priority_level, status, created_at, queue_number, complaint"
-                ).eq("patient_id", pid).order("created_at", desc=True).execute()
-                queue_data = queue_response.data[0] if queue_response.data else None
-
-                # Get patient info from the nested patient_patient object and add queue_data
-                patient_info = item.get("patient_patient", {})
-                patient_info["queue_data"] = queue_data
-
-                # Group treatments by patient
-                if pid not in grouped:
-                    grouped[pid] = {
-                        "patient": patient_info,
-                        "treatments": []
-                    }
-                grouped[pid]["treatments"].append(item)
-
-            # For each patient group, sort treatments by created_at descending,
-            # designate the first one as latest and the remainder as old treatments.
+            # Treatments come newest first: the first is the latest and the
+            # remainder are old treatments.
             results = []
-            for pid, group in grouped.items():
-                treatments = group["treatments"]
-                treatments.sort(key=lambda x: x["created_at"], reverse=True)
+            for pid, treatments in grouped.items():
+                if not treatments:
+                    continue
                 latest_treatment = treatments[0]
-                old_treatments = treatments[1:] if len(treatments) > 1 else []
+                patient_info = {**(latest_treatment.get("patient_patient") or {}), "queue_data": queue_map.get(pid)}
                 results.append({
-                    "patient": group["patient"],
+                    "patient": patient_info,
                     "latest_treatment": latest_treatment,
-                    "old_treatments": old_treatments,
+                    "old_treatments": treatments[1:],
                     "latest_treatment_id": latest_treatment["id"]
                 })
 
-            return Response(results, status=status.HTTP_200_OK)
+            return Response({"next": next_page_url(request, last_key), "results": results}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -444,47 +422,19 @@ class TreatmentDetailView(APIView):
         patient_id = kwargs.get('patient_id')
         
         try:
+            repository = patient_repository(self)
             # 1. Fetch base patient information
-            patient_response = supabase.table("patient_patient").select("*").eq("patient_id", patient_id).execute()
-            if not patient_response.data:
+            patient_data = repository.get_patient(patient_id)
+            if not patient_data:
                 return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
-            patient_data = patient_response.data[0]
 
             # 2. Fetch latest queue information
-            queue_response = supabase.table("queueing_temporarystoragequeue").select(
-                "id, priority_level, status, created_at, queue_number"
-            ).eq("patient_id", patient_id).order("created_at", desc=True).execute()
-            queue_data = queue_response.data[0] if queue_response.data else None
+            queue_data = repository.latest_queue(
+                patient_id, ("id", "priority_level", "status", "created_at", "queue_number")
+            )
 
             # 3. Fetch treatments with related data
-            treatment_response = supabase.table("queueing_treatment").select(
-                """
-                id, 
-                treatment_notes, 
-                created_at, 
-                updated_at, 
-                patient_id, 
-                doctor_id(
-                    id,
-                    first_name,
-                    last_name,
-                    user_doctor(specialization)
-                ),
-                queueing_treatment_diagnoses(
-                    id, 
-                    treatment_id, 
-                    diagnosis_id, 
-                    patient_diagnosis(*)
-                ), 
-                queueing_treatment_prescriptions(
-                    id, 
-                    treatment_id, 
-                    prescription_id, 
-                    patient_prescription(*, medicine_medicine(id, name))
-                )
-                """
-            ).eq("patient_id", patient_id).order("created_at", desc=True).execute()
-            treatments = treatment_response.data
+            treatments = repository.treatments(patient_id, doctor=True, medicine=True)
 
             # 4. Structure response data
             response_data = {
@@ -562,28 +512,12 @@ class PatientRegister(APIView):
                 return queue_entry.priority_level
             return "Regular"
 
-        # generate queue number with daily reset + max 50 reset
-        def generate_queue_number():
-            today = now().date()
-            last_queue_number = TemporaryStorageQueue.objects.filter(
-                created_at__date=today
-            ).aggregate(Max('queue_number'))['queue_number__max']
-
-            if last_queue_number is None:
-                return 1
-            elif last_queue_number >= 50:
-                return 1
-            else:
-                return last_queue_number + 1
-
-
         raw_complaint = request.data.get("complaint", "")
         
         if raw_complaint == "Other":
             raw_complaint = request.data.get("other_complaint", "").strip()
             
-        queue_number = generate_queue_number()
-        print("Assigned Queue Number:", queue_number)     
+        # queue_number is allocated by TemporaryStorageQueue.save() from the daily counter
         
         if request.data.get('patient_id'):
             try:
@@ -593,10 +527,10 @@ class PatientRegister(APIView):
                 queue_entry = TemporaryStorageQueue.objects.create(
                     patient=patient,
                     priority_level=priority_level,
-                    queue_number=queue_number,
                     complaint=raw_complaint,
                     status='Waiting'
                 )
+                print("Assigned Queue Number:", queue_entry.queue_number)
                 return Response({
                     "message": "Patient added to queue successfully.",
                     "queue_entry": {
@@ -642,11 +576,11 @@ class PatientRegister(APIView):
                 
                 # Queue-specific fields
                 priority_level=priority_level,
-                queue_number=queue_number,
                 complaint=raw_complaint,
                 status='Waiting',
                 is_new_patient=True            
             )
+            print("Assigned Queue Number:", queue_entry.queue_number)
             return Response({
                 "message": "Patient registration pending acceptance.",
                 "queue_entry": {
@@ -801,10 +735,9 @@ class SearchPatient(APIView):
     def get(self, request, format=None):
         query = request.GET.get('q', '')
         
-        # Prefetch the related TemporaryStorageQueue objects ordered by created_at (descending)
-        queue_prefetch = Prefetch(
-            'temporarystoragequeue',
-            queryset=TemporaryStorageQueue.objects.order_by('-created_at')
+        # Complaint of each patient's latest visit, archived ones included
+        latest_complaint = Subquery(
+            QueueHistory.objects.filter(patient_id=OuterRef('pk')).order_by('-created_at').values('complaint')[:1]
         )
         
         months = {
@@ -820,15 +753,13 @@ class SearchPatient(APIView):
                 Q(email__icontains=query) |
                 Q(phone_number__icontains=query) |
                 (Q(date_of_birth__isnull=False) & Q(date_of_birth__month=month_number) if month_number else Q()) |
-                Q(temporarystoragequeue__complaint__icontains=query)
-            ).distinct().prefetch_related(queue_prefetch)
+                Q(pk__in=QueueHistory.objects.filter(complaint__icontains=query).values('patient_id'))
+            ).annotate(latest_complaint=latest_complaint)
         else:
-            patients = Patient.objects.all().prefetch_related(queue_prefetch)
+            patients = Patient.objects.all().annotate(latest_complaint=latest_complaint)
         
         data = []
         for patient in patients:
-            # This returns the most recent queue entry because of our ordering
-            latest_queue = patient.temporarystoragequeue.first()
             data.append({
                 'patient_id': patient.patient_id,
                 'first_name': patient.first_name,
@@ -840,7 +771,7 @@ class SearchPatient(APIView):
                 'street_address': patient.street_address,
                 'barangay': patient.barangay,
                 'municipal_city': patient.municipal_city,
-                'complaint': latest_queue.complaint if latest_queue else None,
+                'complaint': patient.latest_complaint,
                 'age': patient.get_age(),
             })
 
@@ -852,17 +783,23 @@ class GetQueue(APIView):
         patient_id = request.GET.get('patient_id')
         if not patient_id:
             return Response({'error': 'patient_id is required'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            queue = TemporaryStorageQueue.objects.filter(
-                patient__patient_id=patient_id
-            ).order_by('-created_at').first()
+        # archived visits included
+        queue = QueueHistory.objects.filter(
+            patient_id=patient_id
+        ).order_by('-created_at').first()
+
+        data = {
+            'complaint': (queue.complaint if queue else None) or "General Illness",
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+# AcceptButton actions and the status each one moves the queue entry to
+ACCEPT_ACTIONS = {
+    'preliminary': "Queued for Assessment",
+    'treatment': "Queued for Treatment",
+    'lab': "Ongoing for Laboratory",
+}
 
-            data = {
-                'complaint': queue.complaint or "General Illness",
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        except TemporaryStorageQueue.DoesNotExist:
-            return Response({'complaint': "General Illness"}, status=status.HTTP_200_OK)
 
 class AcceptButton(APIView):
     permission_classes = [IsMedicalStaff]
@@ -936,34 +873,16 @@ class AcceptButton(APIView):
                 print("✅ New patient created: patient_id =", patient.patient_id)            
                 
             # Update status based on action
-            if action == 'preliminary':
-                queue_entry.status = "Queued for Assessment"
-            elif action == 'treatment':
-                queue_entry.status = "Queued for Treatment"
-            elif action == 'lab':
-                queue_entry.status = "Ongoing for Laboratory"
-            else:
+            new_status = ACCEPT_ACTIONS.get(action)
+            if not new_status:
                 return Response({"error": "Invalid action"}, status=status.HTTP_400_BAD_REQUEST)
             
-            queue_entry.save()
+            previous_status = queue_entry.transition_to(new_status, request.user)
             print("✅ Queue entry status updated to:", queue_entry.status)
 
-            # Broadcast updated snapshot
-            print("🔄 Computing queue snapshot...")
-            snapshot = compute_queue_snapshot()
-            print("📊 Queue snapshot computed:", snapshot)
-            
-            channel_layer = get_channel_layer()
-            print("📡 Broadcasting WebSocket update to 'registration_queue' group...")
-            
-            async_to_sync(channel_layer.group_send)(
-                "registration_queue",
-                {
-                    "type": "queue_update",
-                    "data": snapshot,
-                }
-            )
-            
+            # Broadcast updated snapshots of the boards the entry left and joined
+            print("📡 Broadcasting WebSocket updates...")
+            broadcast_status_change(previous_status, queue_entry.status)
             print("✅ WebSocket broadcast completed")
 
             return Response({
@@ -978,6 +897,138 @@ class AcceptButton(APIView):
         except Exception as e:
             print("❌ Error in POST Accept:", e)
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def create_patients_for(entries):
+    """
+    Create the user accounts and patient records of new-patient queue entries
+    in two inserts, link them to the entries and return them. The password
+    is the patient ID followed by the birth date, as in AcceptButton.
+    """
+    user_ids = allocate_user_ids([entry.temp_last_name for entry in entries])
+    users, patients = [], []
+    for entry, user_id in zip(entries, user_ids):
+        user = UserAccount(
+            id=user_id,
+            email=UserAccount.objects.normalize_email(entry.temp_email),
+            first_name=entry.temp_first_name,
+            last_name=entry.temp_last_name,
+            role='patient',
+        )
+        # the patient ID is the user ID, so the password is known up front
+        user.set_password(f"{user_id}{entry.temp_date_of_birth.strftime('%Y%m%d')}")
+        users.append(user)
+        patients.append(Patient(
+            patient_id=user_id,
+            role_id=user_id,
+            first_name=entry.temp_first_name,
+            middle_name=entry.temp_middle_name,
+            last_name=entry.temp_last_name,
+            email=entry.temp_email,
+            phone_number=entry.temp_phone_number,
+            date_of_birth=entry.temp_date_of_birth,
+            gender=entry.temp_gender,
+            street_address=entry.temp_street_address,
+            barangay=entry.temp_barangay,
+            municipal_city=entry.temp_municipal_city,
+            user=user,
+        ))
+    UserAccount.objects.bulk_create(users)
+    Patient.objects.bulk_create(patients)
+    for entry, patient in zip(entries, patients):
+        entry.patient = patient
+        entry.is_new_patient = False
+    return patients
+
+
+class BulkAcceptButton(APIView):
+    """
+    AcceptButton for many queue entries at once:
+
+        {"transitions": [{"queue_entry_id": 12, "action": "preliminary"}, ...]}
+
+    Either every transition is applied or none is. The entries are read in
+    one query, new patients get their accounts in one batch, the entries are
+    written with one bulk_update and the boards are broadcast once.
+    """
+    permission_classes = [IsMedicalStaff]
+
+    def post(self, request):
+        transitions = request.data.get('transitions')
+        if not isinstance(transitions, list) or not transitions:
+            return Response({"error": "transitions must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        errors, requested = [], {}
+        for index, item in enumerate(transitions):
+            item = item if isinstance(item, dict) else {}
+            try:
+                entry_id = int(item.get('queue_entry_id'))
+            except (ValueError, TypeError):
+                errors.append({"index": index, "error": "Invalid queue_entry_id format."})
+                continue
+            if item.get('action') not in ACCEPT_ACTIONS:
+                errors.append({"index": index, "queue_entry_id": entry_id, "error": "Invalid action"})
+            elif entry_id in requested:
+                errors.append({"index": index, "queue_entry_id": entry_id, "error": "Duplicate queue_entry_id."})
+            else:
+                requested[entry_id] = ACCEPT_ACTIONS[item['action']]
+        if errors:
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                entries = TemporaryStorageQueue.objects.select_for_update().in_bulk(list(requested))
+                missing = [entry_id for entry_id in requested if entry_id not in entries]
+                if missing:
+                    return Response(
+                        {"error": "Queue entry not found", "queue_entry_ids": missing},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+
+                new_patients = [entry for entry in entries.values() if entry.is_new_patient]
+                errors = self.validate_new_patients(new_patients)
+                if errors:
+                    return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+                created = create_patients_for(new_patients) if new_patients else []
+
+                changes = [(entries[entry_id], new_status) for entry_id, new_status in requested.items()]
+                statuses = bulk_transition(changes, actor=request.user, fields=["patient", "is_new_patient"])
+                print(f"✅ Bulk accept: {len(changes)} entries updated, {len(created)} patients created")
+
+            broadcast_status_change(*statuses)
+            return Response({
+                "message": "Status updated successfully",
+                "updated": len(changes),
+                "patients_created": len(created),
+                "results": [
+                    {"queue_entry_id": entry.id, "status": entry.status, "patient_id": entry.patient_id}
+                    for entry, _ in changes
+                ],
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            print("❌ Error in POST Bulk Accept:", e)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def validate_new_patients(self, entries):
+        errors = []
+        emails = [UserAccount.objects.normalize_email(entry.temp_email) for entry in entries if entry.temp_email]
+        taken = set(UserAccount.objects.filter(email__in=emails).values_list('email', flat=True)) if emails else set()
+        seen = set()
+        for entry in entries:
+            email = UserAccount.objects.normalize_email(entry.temp_email) if entry.temp_email else None
+            if not email:
+                error = "New patient has no email address."
+            elif not entry.temp_date_of_birth:
+                error = "New patient has no date of birth."
+            elif email in taken or email in seen:
+                error = f"An account with {email} already exists."
+            else:
+                seen.add(email)
+                continue
+            errors.append({"queue_entry_id": entry.id, "error": error})
+        return errors
+
+
 class SaveButton(APIView):
     permission_classes = [isDoctor]
     def post(self, request, *args, **kwargs):
@@ -1000,8 +1051,8 @@ class SaveButton(APIView):
 
             print("Found queue entry:", queue_entry)
             # Update the status to "Ongoing Treatment"
-            queue_entry.status = "Ongoing for Treatment"
-            queue_entry.save()
+            previous_status = queue_entry.transition_to("Ongoing for Treatment", request.user)
+            broadcast_status_change(previous_status, queue_entry.status)
 
             return Response({"message": "Status updated successfully", "status": queue_entry.status}, status=status.HTTP_200_OK)
 
@@ -1030,6 +1081,7 @@ class LabResultCreateView(generics.CreateAPIView):
         if lab_result.lab_request:
             lab_result.lab_request.status = "Completed"
             lab_result.lab_request.save()
+        broadcast_topics("lab")
 
         
 class LabRequestListView(generics.ListAPIView):
@@ -1091,12 +1143,8 @@ class PatientReportview(APIView):
     def get(self, request, patient_id):
         try:
             #fetch patient
-            response = supabase.table("patient_patient").select("*").eq("patient_id",patient_id).execute()
-
-            if hasattr(response, 'error') and response.error:
-                error_msg = getattr(response.error, 'message', 'Unknown error')
-                return Response({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
-            patient_info = response.data[0] if response.data else None
+            repository = patient_repository(self)
+            patient_info = repository.get_patient(patient_id)
             #fetch patient latest preliminary assessment 
             assessment_obj = PreliminaryAssessment.objects.filter(patient__patient_id=patient_id).order_by("-assessment_date").first()
             if assessment_obj:
@@ -1105,34 +1153,7 @@ class PatientReportview(APIView):
                 assessment_data = None
             
             #fetch recent medications
-            treatment_response = supabase.table("queueing_treatment").select(
-                """
-                id, 
-                treatment_notes, 
-                created_at, 
-                updated_at, 
-                patient_id,             
-                doctor_id(
-                    id,
-                    first_name,
-                    last_name,
-                    user_doctor(specialization)
-                ),
-                queueing_treatment_diagnoses(
-                    id,
-                    treatment_id,
-                    diagnosis_id,
-                    patient_diagnosis(*)
-                ),
-                queueing_treatment_prescriptions(
-                    id,
-                    treatment_id,
-                    prescription_id,
-                    patient_prescription(*, medicine_medicine(id, name))
-                )
-            """
-            ).eq("patient_id", patient_id).order("created_at", desc=True).execute() 
-            treatments = treatment_response.data
+            treatments = repository.treatments(patient_id, doctor=True, medicine=True)
             
             # laboratory fetch
             lab_results_qs = LabResult.objects.filter(
@@ -1223,14 +1244,15 @@ class MonthlyVisitsAPIView(APIView):
         end_date = parse_date(str(end_raw)) if end_raw else None
 
 
-        queryset = TemporaryStorageQueue.objects.all()
+        # live and archived visits
+        queryset = QueueHistory.objects.all()
 
         if start_date and end_date:
-            queryset = queryset.filter(created_at__date__range=(start_date, end_date))
+            queryset = queryset.filter(queue_date__range=(start_date, end_date))
         elif start_date:
-            queryset = queryset.filter(created_at__date__gte=start_date)
+            queryset = queryset.filter(queue_date__gte=start_date)
         elif end_date:
-            queryset = queryset.filter(created_at__date__lte=end_date)
+            queryset = queryset.filter(queue_date__lte=end_date)
 
         # Annotate with truncated month (creates a temporary alias, not a model field)
         monthly_data = (
@@ -1254,7 +1276,7 @@ class MonthlyVisitsAPIView(APIView):
 class MonthlyPatientVisitsDetailedView(APIView):
     def get(self, request):
         # Optimize query with select_related to prevent N+1 queries
-        visits = TemporaryStorageQueue.objects.select_related('patient').all().order_by("queue_date")
+        visits = QueueHistory.objects.select_related('patient').all().order_by("queue_date")
         
         # Get all patient IDs to fetch treatments in bulk
         patient_ids = [visit.patient.patient_id for visit in visits if visit.patient]
@@ -1341,15 +1363,7 @@ class TotalPatientsAPIView(APIView):
 
     def get(self, request):
         try:
-            response = supabase.table("patient_patient").select("*").execute()
-
-            if not hasattr(response, 'data') or not isinstance(response.data, list):
-                return Response(
-                    {"error": "Failed to fetch patient data"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-            patients = response.data
+            patients = patient_repository(self).list_patients()
             serializer = PatientSerializer(patients, many=True)
 
             return Response({
@@ -0,0 +1,120 @@
+"""
+Time-in-stage reports over the QueueTransition log.
+
+An entry's dwell time in a stage is the gap between the transition that put
+it there and its next transition. Entries still in a stage (or Completed)
+have no dwell time yet and are left out.
+"""
+from django.db import connection
+from django.db.models import Count, F, Window
+from django.db.models.functions import Lead, TruncHour
+
+from .models import QueueTransition
+
+STAGE_ORDER = [
+    'Waiting',
+    'Queued for Assessment',
+    'Queued for Treatment',
+    'Ongoing for Laboratory',
+    'Ongoing for Treatment',
+    'Completed',
+]
+
+DWELL_SQL = """
+    WITH timed AS (
+        SELECT to_status AS stage,
+               EXTRACT(EPOCH FROM
+                   LEAD(created_at) OVER (PARTITION BY entry_id ORDER BY created_at, id)
+                   - created_at
+               ) AS dwell
+        FROM {table}
+        WHERE queue_date BETWEEN %s AND %s
+    )
+    SELECT stage,
+           COUNT(*),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY dwell),
+           percentile_cont(0.9) WITHIN GROUP (ORDER BY dwell),
+           AVG(dwell)
+    FROM timed
+    WHERE dwell IS NOT NULL
+    GROUP BY stage
+"""
+
+
+def stage_sort_key(stage):
+    return STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER)
+
+
+def percentile(values, fraction):
+    """Linear interpolation between closest ranks, like PostgreSQL's percentile_cont."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = fraction * (len(values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def stage_dwell_times(start, end):
+    """
+    Per-stage dwell times in seconds for queue dates `start`..`end`:
+    a list of {stage, count, p50_seconds, p90_seconds, mean_seconds}.
+    On PostgreSQL everything is computed in one query; elsewhere the gaps
+    come from the database and the percentiles are taken in Python.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(DWELL_SQL.format(table=QueueTransition._meta.db_table), [start, end])
+            rows = cursor.fetchall()
+        stats = [
+            {
+                'stage': stage,
+                'count': count,
+                'p50_seconds': float(p50),
+                'p90_seconds': float(p90),
+                'mean_seconds': float(mean),
+            }
+            for stage, count, p50, p90, mean in rows
+        ]
+    else:
+        timed = QueueTransition.objects.filter(
+            queue_date__range=(start, end)
+        ).annotate(
+            left_at=Window(
+                Lead('created_at'),
+                partition_by=[F('entry_id')],
+                order_by=[F('created_at').asc(), F('id').asc()],
+            )
+        ).values_list('to_status', 'created_at', 'left_at')
+
+        dwell = {}
+        for stage, entered_at, left_at in timed:
+            if left_at is not None:
+                dwell.setdefault(stage, []).append((left_at - entered_at).total_seconds())
+        stats = [
+            {
+                'stage': stage,
+                'count': len(values),
+                'p50_seconds': percentile(values, 0.5),
+                'p90_seconds': percentile(values, 0.9),
+                'mean_seconds': sum(values) / len(values),
+            }
+            for stage, values in dwell.items()
+        ]
+    return sorted(stats, key=lambda s: stage_sort_key(s['stage']))
+
+
+def hourly_throughput(start, end):
+    """Entries reaching each stage per hour for queue dates `start`..`end`."""
+    rows = QueueTransition.objects.filter(
+        queue_date__range=(start, end)
+    ).annotate(
+        hour=TruncHour('created_at')
+    ).values('hour', 'to_status').annotate(
+        count=Count('id')
+    ).order_by('hour')
+    return sorted(
+        ({'hour': row['hour'], 'stage': row['to_status'], 'count': row['count']} for row in rows),
+        key=lambda row: (row['hour'], stage_sort_key(row['stage'])),
+    )
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class QueueingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'queueing'
+
+    def ready(self):
+        from .archive import create_queue_history_view
+        post_migrate.connect(create_queue_history_view, sender=self)
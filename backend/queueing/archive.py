@@ -0,0 +1,84 @@
+"""
+Daily hot/cold split of the queue.
+
+TemporaryStorageQueue is read on every status change and queue refresh, but
+only today's unfinished entries matter there. archive_queue() moves
+completed and past-date entries to ArchivedQueueEntry (same columns, same
+ids); reports read both through the queueing_queuehistory view.
+"""
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import localdate
+
+from .models import ArchivedQueueEntry, QueueHistory, TemporaryStorageQueue
+
+
+def shared_columns():
+    """Columns of TemporaryStorageQueue, all of which ArchivedQueueEntry also has."""
+    return [f.column for f in TemporaryStorageQueue._meta.concrete_fields]
+
+
+def create_queue_history_view(using=None, **kwargs):
+    """
+    (Re)create the queueing_queuehistory view from the current model columns.
+    Connected to post_migrate, so it follows schema changes of the queue
+    tables and also exists in test databases built without migrations.
+    """
+    from django.db import connections
+
+    conn = connections[using or "default"]
+    tables = conn.introspection.table_names()
+    if (TemporaryStorageQueue._meta.db_table not in tables
+            or ArchivedQueueEntry._meta.db_table not in tables):
+        return
+    qn = conn.ops.quote_name
+    columns = ", ".join(qn(c) for c in shared_columns())
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP VIEW IF EXISTS {qn(QueueHistory._meta.db_table)}")
+        cursor.execute(
+            f"CREATE VIEW {qn(QueueHistory._meta.db_table)} AS "
+            f"SELECT {columns}, FALSE AS is_archived FROM {qn(TemporaryStorageQueue._meta.db_table)} "
+            f"UNION ALL "
+            f"SELECT {columns}, TRUE AS is_archived FROM {qn(ArchivedQueueEntry._meta.db_table)}"
+        )
+
+
+def archive_queue(before=None, dry_run=False):
+    """
+    Move entries dated before `before` (default today) and all Completed
+    entries to the archive. Returns the number of entries moved.
+    """
+    from .queue_index import queue_index
+
+    before = before or localdate()
+    qn = connection.ops.quote_name
+    hot = qn(TemporaryStorageQueue._meta.db_table)
+    cold = qn(ArchivedQueueEntry._meta.db_table)
+    columns = ", ".join(qn(c) for c in shared_columns())
+    condition = f"{qn('queue_date')} < %s OR {qn('status')} = %s"
+    params = [before, "Completed"]
+
+    if dry_run:
+        return TemporaryStorageQueue.objects.filter(
+            Q(queue_date__lt=before) | Q(status="Completed")
+        ).count()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # one statement, so a row cannot change between the copy and the delete
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {hot} WHERE {condition} RETURNING {columns}) "
+                f"INSERT INTO {cold} ({columns}) SELECT {columns} FROM moved",
+                params,
+            )
+            moved = cursor.rowcount
+        else:
+            # SQLite holds the write lock for the whole transaction
+            cursor.execute(
+                f"INSERT INTO {cold} ({columns}) SELECT {columns} FROM {hot} WHERE {condition}",
+                params,
+            )
+            moved = cursor.rowcount
+            cursor.execute(f"DELETE FROM {hot} WHERE {condition}", params)
+        transaction.on_commit(queue_index.invalidate)
+    return moved
@@ -0,0 +1,89 @@
+"""
+End-of-day carry-over of unfinished queue entries.
+
+Entries still queued at closing keep their old queue_date, so today's boards
+(all filtered on queue_date) stop showing them. carry_over_queue() moves them
+to today: one UPDATE renumbers them from a block of today's queue numbers,
+in their old order, and respaces their positions. Run it before
+archive_queue, which would otherwise archive them as past-date entries.
+"""
+from django.db import connection, transaction
+from django.utils.timezone import localdate
+
+from .models import DailyQueueCounter, TemporaryStorageQueue
+
+# everything but Completed is unfinished
+CARRY_OVER_STATUSES = (
+    "Waiting",
+    "Queued for Assessment",
+    "Queued for Treatment",
+    "Ongoing for Laboratory",
+    "Ongoing for Treatment",
+)
+
+
+def carry_over_queue(to_day=None, statuses=CARRY_OVER_STATUSES, dry_run=False):
+    """
+    Move entries in `statuses` dated before `to_day` (default today) to
+    `to_day`. Claims are released, since nobody is serving them anymore.
+    Returns the number of entries carried over.
+    """
+    from .queue_index import queue_index
+    from .utils import broadcast_status_change
+
+    to_day = to_day or localdate()
+    stale = TemporaryStorageQueue.objects.filter(queue_date__lt=to_day, status__in=statuses)
+    if dry_run:
+        return stale.count()
+
+    qn = connection.ops.quote_name
+    table = qn(TemporaryStorageQueue._meta.db_table)
+    status_list = ", ".join(["%s"] * len(statuses))
+    with transaction.atomic():
+        count = stale.count()
+        if not count:
+            return 0
+        # numbers first..last are ours; the counter row stays locked until commit
+        first = DailyQueueCounter.allocate(to_day, count=count) - count + 1
+        with connection.cursor() as cursor:
+            # UPDATE ... FROM is supported by PostgreSQL and SQLite >= 3.33
+            cursor.execute(
+                f"UPDATE {table} SET "
+                f"{qn('queue_date')} = %s, "
+                f"{qn('queue_number')} = %s + carried.carried_rank, "
+                f"{qn('position')} = (%s + carried.carried_rank) * %s, "
+                f"{qn('claimed_by_id')} = NULL, {qn('claimed_at')} = NULL, {qn('claimed_status')} = NULL "
+                f"FROM ("
+                f"SELECT {qn('id')} AS carried_id, ROW_NUMBER() OVER ("
+                f"ORDER BY {qn('queue_date')}, {qn('position')}, {qn('queue_number')}, {qn('id')}"
+                f") - 1 AS carried_rank FROM {table} "
+                f"WHERE {qn('queue_date')} < %s AND {qn('status')} IN ({status_list})"
+                f") AS carried "
+                f"WHERE {table}.{qn('id')} = carried.carried_id",
+                [to_day, first, first, TemporaryStorageQueue.POSITION_GAP, to_day, *statuses],
+            )
+            carried = cursor.rowcount
+        # raw UPDATE skips post_save
+        transaction.on_commit(queue_index.invalidate)
+        broadcast_status_change(*statuses)
+    return carried
+
+
+def warm_queue_caches(day=None):
+    """
+    Prepare `day` (default today) before the first registration: create its
+    queue counter row and load the queue index, the wait-time estimator and
+    the registration snapshot of this process. Returns the number of
+    waiting entries in the index.
+    """
+    from .queue_index import queue_index, LANES
+    from .utils import compute_queue_snapshot
+    from .wait_time import wait_estimator
+
+    day = day or localdate()
+    # the day's counter row exists, so the first registration only increments it
+    DailyQueueCounter.allocate(day, count=0)
+    queue_index.rebuild(day)
+    wait_estimator.stats()
+    compute_queue_snapshot()
+    return sum(len(queue_index.heads(lane, count=None)) for lane in LANES)
@@ -1,9 +1,199 @@
-
+import asyncio
 import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .queue_index import queue_index
+from .utils import registration_snapshot_texts, topic_event, with_wait_estimates, TOPIC_GROUPS
+
+
+class ConnectionStats:
+    """Send-side counters of one WebSocket connection, read by the connections endpoint."""
+
+    def __init__(self, channel_name, consumer):
+        self.channel_name = channel_name
+        self.consumer = consumer
+        self.connected_at = time.time()
+        self.received = 0       # events taken from the channel layer
+        self.sent = 0           # messages handed to the server; not proof the client got them
+        self.acked = None       # messages the client confirmed; None if it never acks
+        self.unacked = None     # sent but not confirmed: the real backlog of an acking client
+        self.superseded = 0     # events dropped because a newer one replaced them
+        self.behind = 0         # superseded since the last completed send
+        self.pending = 0        # topics waiting for the writer (at most one event each)
+        self.max_pending = 0
+        self.last_version = None
+        self.last_send_ms = None
+        self.slowest_send_ms = 0.0
+        self.disconnected_slow = False
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class ConnectionRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def register(self, stats):
+        with self._lock:
+            self._stats[stats.channel_name] = stats
+
+    def unregister(self, stats):
+        with self._lock:
+            self._stats.pop(stats.channel_name, None)
+
+    def snapshot(self):
+        with self._lock:
+            return [stats.as_dict() for stats in self._stats.values()]
+
+
+connection_registry = ConnectionRegistry()
+
+
+class LatestOnlySenderMixin:
+    """
+    Decouples the channel-layer handlers from the socket.
+
+    Handlers only park the newest event per key (a topic) in `pending` and
+    return, so the consumer keeps draining the channel layer even when the
+    client reads slowly and the layer never fills up with stale snapshots.
+    A writer task sends whatever is pending; an event replaced before it was
+    sent is counted as superseded. A client that falls more than
+    QUEUE_WS_MAX_BEHIND updates behind is disconnected (close code 4008) so
+    it reconnects and resumes from a fresh snapshot.
+
+    send() returns once the server has buffered the frame, not when the
+    client has read it, so on its own the writer never sees a slow network.
+    Clients report what they have processed with
+
+        {"action": "ack", "received": <messages received so far>}
+
+    and once a client acks, the writer holds back while QUEUE_WS_ACK_WINDOW
+    messages are unacknowledged. Its updates then pile up as superseded
+    events instead of in the server's write buffer, and the QUEUE_WS_MAX_BEHIND
+    limit applies to it. For clients that never ack, `behind` only counts
+    events superseded while a send was running, so the limit does not catch
+    a slow network.
+    """
+
+    def start_writer(self):
+        self.pending = {}
+        self.wakeup = asyncio.Event()
+        self.ack_received = asyncio.Event()
+        self.stats = ConnectionStats(self.channel_name, type(self).__name__)
+        connection_registry.register(self.stats)
+        self.writer = asyncio.ensure_future(self.write_loop())
+
+    def stop_writer(self):
+        if getattr(self, "writer", None):
+            self.writer.cancel()
+            connection_registry.unregister(self.stats)
+
+    async def enqueue(self, key, event):
+        stats = self.stats
+        stats.received += 1
+        if key in self.pending:
+            stats.superseded += 1
+            stats.behind += 1
+            del self.pending[key]
+        self.pending[key] = event
+        stats.pending = len(self.pending)
+        stats.max_pending = max(stats.max_pending, stats.pending)
+
+        if stats.behind > getattr(settings, "QUEUE_WS_MAX_BEHIND", 50) and not stats.disconnected_slow:
+            stats.disconnected_slow = True
+            print(f"❌ Closing slow WebSocket client {self.channel_name}: {stats.behind} updates behind")
+            await self.close(code=4008)
+            return
+        self.wakeup.set()
+
+    async def acknowledge(self, received):
+        """Handle an ack: the client has processed `received` messages."""
+        stats = self.stats
+        if not isinstance(received, int) or isinstance(received, bool) or received < 0:
+            return
+        stats.acked = min(max(received, stats.acked or 0), stats.sent)
+        stats.unacked = stats.sent - stats.acked
+        self.ack_received.set()
+
+    async def wait_for_acks(self):
+        window = getattr(settings, "QUEUE_WS_ACK_WINDOW", 8)
+        while self.stats.acked is not None and self.stats.unacked >= window:
+            self.ack_received.clear()
+            await self.ack_received.wait()
+
+    async def write_loop(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                await self.wait_for_acks()
+                key = next(iter(self.pending))
+                event = self.pending.pop(key)
+                self.stats.pending = len(self.pending)
+                started = time.monotonic()
+                try:
+                    await self.deliver(key, event)
+                except Exception as e:
+                    print(f"❌ Error sending message to {self.channel_name}: {e}")
+                elapsed_ms = (time.monotonic() - started) * 1000
+                self.stats.last_send_ms = elapsed_ms
+                self.stats.slowest_send_ms = max(self.stats.slowest_send_ms, elapsed_ms)
+                self.stats.behind = 0
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        if getattr(self, "stats", None) and (text_data or bytes_data):
+            self.stats.sent += 1
+            if self.stats.acked is not None:
+                self.stats.unacked = self.stats.sent - self.stats.acked
+
+    async def deliver(self, key, event):
+        raise NotImplementedError
+
+
+class RegistrationQueueConsumer(LatestOnlySenderMixin, AsyncWebsocketConsumer):
+    """
+    Pushes the registration queue to secretary screens and displays.
+
+    Clients connecting without query parameters get the full six-slot
+    snapshot on every change (the original protocol).
+
+    Clients connecting with ``?since=<version>&epoch=<epoch>`` opt into the
+    versioned protocol and receive two kinds of messages:
+
+        {"type": "snapshot", "version": v, "epoch": e, "data": {...six slots...}}
+        {"type": "delta", "version": v, "epoch": e, "changes": [...], "wait_estimates": {...}}
+
+    Snapshots carry estimated_wait_seconds on every entry, like the REST
+    endpoint; deltas carry the estimate of every slot as of their version.
+
+    On connect the missed deltas are replayed from the queue index's ring
+    buffer, or a snapshot is sent when they are no longer available (first
+    connect, server restart, or the client fell too far behind).
+
+    Updates are sent by a writer task (LatestOnlySenderMixin): a client that
+    reads slowly skips superseded snapshots and, with deltas, gets everything
+    it missed in one go.
+    """
 
-class RegistrationQueueConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        self.versioned = "since" in params
+        self.epoch = params.get("epoch", [None])[0]
+        try:
+            self.version = int(params.get("since", ["-1"])[0])
+        except ValueError:
+            self.version = -1
+
         # Optionally check permissions: e.g. only secretaries
         await self.channel_layer.group_add("registration_queue", self.channel_name)
         await self.accept()
@@ -11,20 +201,173 @@ class RegistrationQueueConsumer(AsyncWebsocketConsumer):
         print(f"✅ WebSocket client connected: {self.channel_name}")
         print(f"📊 Added to group: registration_queue")
 
+        # started first so catch-up messages count towards acks
+        self.start_writer()
+        if self.versioned:
+            await self.catch_up()
+
     async def disconnect(self, close_code):
+        self.stop_writer()
         await self.channel_layer.group_discard("registration_queue", self.channel_name)
         print(f"❌ WebSocket client disconnected: {self.channel_name}")
 
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or "{}")
+        except ValueError:
+            return
+        if isinstance(message, dict) and message.get("action") == "ack":
+            await self.acknowledge(message.get("received"))
+
+    async def catch_up(self):
+        deltas = queue_index.deltas_since(self.version, self.epoch)
+        if deltas is None:
+            version, snapshot = await database_sync_to_async(queue_index.versioned_snapshot)()
+            # same payload as the broadcasts (utils.registration_snapshot)
+            snapshot = await database_sync_to_async(with_wait_estimates)(snapshot)
+            texts = registration_snapshot_texts(version, queue_index.epoch, snapshot)
+            await self.send_snapshot(version, queue_index.epoch, texts["snapshot_text"])
+        else:
+            await self.send_deltas(deltas)
+
+    async def send_snapshot(self, version, epoch, text):
+        self.version, self.epoch = version, epoch
+        await self.send(text_data=text)
+
+    async def send_deltas(self, deltas):
+        self.epoch = queue_index.epoch
+        for version, text in deltas:
+            await self.send(text_data=text)
+            self.version = version
+
     async def queue_update(self, event):
-        # event["data"] is the payload dictionary
-        data = event["data"]
-        # Debug
-        print(f"📤 Sending queue_update to client: {self.channel_name}")
-        print(f"📦 Data being sent: {data}")
-        
+        await self.enqueue("registration", event)
+
+    async def deliver(self, key, event):
+        # the event carries the snapshot already encoded (utils.queue_update_event)
+        current = event.get("epoch") == self.epoch
+        if not self.versioned:
+            # an older snapshot can still arrive after a newer one. An equal
+            # version is resent: the slots are the same but the
+            # estimated_wait_seconds in them (utils.registration_snapshot) are
+            # recomputed for every event
+            if current and event.get("version", 0) < self.version:
+                return
+            await self.send(text_data=event["text"])
+            self.version, self.epoch = event.get("version", 0), event.get("epoch")
+        elif current and event.get("version", 0) <= self.version:
+            # already replayed during catch-up
+            return
+        else:
+            deltas = queue_index.deltas_since(self.version, self.epoch)
+            if deltas is not None and event.get("epoch") == queue_index.epoch:
+                await self.send_deltas(deltas)
+            else:
+                await self.send_snapshot(event.get("version"), event.get("epoch"), event["snapshot_text"])
+        self.stats.last_version = self.version
+
+
+class QueueTopicsConsumer(LatestOnlySenderMixin, AsyncWebsocketConsumer):
+    """
+    One socket for several queue boards.
+
+    Topics are "registration", "assessment", "treatment" and "lab". They are
+    picked with ``ws/queue/<topic>/``, ``ws/queue/?topics=assessment,treatment``
+    or later with messages on the socket:
+
+        {"action": "subscribe", "topics": ["lab"]}
+        {"action": "unsubscribe", "topics": ["assessment"]}
+        {"action": "ack", "received": 12}    (see LatestOnlySenderMixin)
+
+    Every subscribe is answered with the topic's current snapshot, then each
+    change is pushed as
+
+        {"type": "snapshot", "topic": t, "data": {...six slots...}}
+
+    Registration snapshots also carry "version" and "epoch".
+    """
+
+    async def connect(self):
+        self.topics = set()
+        self.versions = {}
+        await self.accept()
+        self.start_writer()
+
+        topics = []
+        if self.scope["url_route"]["kwargs"].get("topic"):
+            topics.append(self.scope["url_route"]["kwargs"]["topic"])
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        for value in params.get("topics", []):
+            topics.extend(t.strip() for t in value.split(",") if t.strip())
+        print(f"✅ WebSocket client connected: {self.channel_name} topics={topics}")
+        await self.subscribe(topics)
+
+    async def disconnect(self, close_code):
+        self.stop_writer()
+        for topic in self.topics:
+            await self.channel_layer.group_discard(TOPIC_GROUPS[topic], self.channel_name)
+        print(f"❌ WebSocket client disconnected: {self.channel_name}")
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            await self.send(text_data=json.dumps(data))
-            print(f"✅ Message successfully sent to {self.channel_name}")
-        except Exception as e:
-            print(f"❌ Error sending message to {self.channel_name}: {e}")
+            message = json.loads(text_data or "{}")
+        except ValueError:
+            await self.send_json_message({"type": "error", "error": "Invalid JSON"})
+            return
+        if not isinstance(message, dict):
+            await self.send_json_message({"type": "error", "error": "Unknown action"})
+            return
+        if message.get("action") == "ack":
+            await self.acknowledge(message.get("received"))
+            return
+        topics = message.get("topics") or []
+        if isinstance(topics, str):
+            topics = [topics]
+        if message.get("action") == "subscribe":
+            await self.subscribe(topics)
+        elif message.get("action") == "unsubscribe":
+            await self.unsubscribe(topics)
+        else:
+            await self.send_json_message({"type": "error", "error": "Unknown action"})
+
+    async def subscribe(self, topics):
+        unknown = [t for t in topics if t not in TOPIC_GROUPS]
+        if unknown:
+            await self.send_json_message({"type": "error", "error": f"Unknown topics: {unknown}"})
+        for topic in topics:
+            if topic not in TOPIC_GROUPS or topic in self.topics:
+                continue
+            await self.channel_layer.group_add(TOPIC_GROUPS[topic], self.channel_name)
+            self.topics.add(topic)
+            await self.send_event(topic, await database_sync_to_async(topic_event)(topic))
+
+    async def unsubscribe(self, topics):
+        for topic in topics:
+            if topic in self.topics:
+                await self.channel_layer.group_discard(TOPIC_GROUPS[topic], self.channel_name)
+                self.topics.discard(topic)
+
+    async def send_json_message(self, message):
+        await self.send(text_data=json.dumps(message, cls=JSONEncoder))
+
+    async def send_event(self, topic, event):
+        await self.send(text_data=event["topic_text"])
+
+    # channel-layer handlers; both events carry the message already encoded
+
+    async def queue_update(self, event):
+        await self.enqueue("registration", event)
+
+    async def stage_update(self, event):
+        await self.enqueue(event["topic"], event)
 
+    async def deliver(self, topic, event):
+        if topic not in self.topics:
+            return
+        if topic == "registration":
+            sent = self.versions.get(topic)
+            if sent and sent[0] == event["epoch"] and sent[1] > event["version"]:
+                return
+            self.versions[topic] = (event["epoch"], event["version"])
+            self.stats.last_version = event["version"]
+        await self.send_event(topic, event)
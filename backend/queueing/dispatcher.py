@@ -0,0 +1,77 @@
+"""
+Sends queue board updates to the WebSocket groups outside the request.
+
+Views used to call async_to_sync(channel_layer.group_send) inline, so every
+status change waited on a Redis round trip and a burst of clicks produced one
+broadcast each. notify() only records which boards changed, once the
+surrounding transaction has committed. A background timer then sends each
+board's current snapshot once per QUEUE_BROADCAST_WINDOW, however many
+changes landed in that window.
+"""
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+
+
+class BroadcastDispatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+
+    @property
+    def window(self):
+        return getattr(settings, "QUEUE_BROADCAST_WINDOW", 0.1)
+
+    def notify(self, *topics):
+        """Schedule a broadcast of `topics` after the current transaction commits."""
+        from .utils import TOPIC_GROUPS
+
+        topics = {t for t in topics if t in TOPIC_GROUPS}
+        if topics:
+            transaction.on_commit(lambda: self._schedule(topics))
+
+    def _schedule(self, topics):
+        with self._lock:
+            self._pending |= topics
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Send every pending topic now. Returns the topics sent."""
+        with self._lock:
+            topics, self._pending = self._pending, set()
+            self._timer = None
+        if topics:
+            self._send(topics)
+        return topics
+
+    def _send(self, topics):
+        from .utils import TOPIC_GROUPS, topic_event
+
+        channel_layer = get_channel_layer()
+        for topic in sorted(topics):
+            try:
+                async_to_sync(channel_layer.group_send)(TOPIC_GROUPS[topic], topic_event(topic))
+            except Exception as e:
+                print(f"❌ Error broadcasting {topic} queue:", e)
+        if "registration" in topics:
+            from .sse import public_broadcaster
+            try:
+                public_broadcaster.publish()
+            except Exception as e:
+                print("❌ Error publishing public queue:", e)
+
+
+dispatcher = BroadcastDispatcher()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from queueing.archive import archive_queue
+
+
+class Command(BaseCommand):
+    help = 'Move completed and past-date queue entries to the archive table (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=str, default=None,
+            help='Archive entries dated before this day (YYYY-MM-DD, default today)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count the entries')
+
+    def handle(self, *args, **options):
+        before = None
+        if options['before']:
+            before = parse_date(options['before'])
+            if before is None:
+                raise CommandError('--before must be YYYY-MM-DD')
+
+        moved = archive_queue(before=before, dry_run=options['dry_run'])
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {moved} queue entries'))
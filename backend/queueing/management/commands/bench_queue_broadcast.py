@@ -0,0 +1,94 @@
+import asyncio
+import json
+import time
+from datetime import date, datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from queueing.consumers import ConnectionStats, RegistrationQueueConsumer
+from queueing.utils import SNAPSHOT_SLOTS, json_safe, registration_snapshot_texts
+
+
+def sample_snapshot():
+    """A full six-slot snapshot shaped like utils.format_queue_entry() output."""
+    snapshot = {}
+    for lane in ("priority", "regular"):
+        for i, slot in enumerate(SNAPSHOT_SLOTS):
+            snapshot[f"{lane}_{slot}"] = {
+                "id": 1000 + i,
+                "patient_id": f"PT-{lane[0].upper()}{i:04d}",
+                "first_name": "Maria Cristina",
+                "last_name": "Dela Cruz",
+                "phone_number": "09171234567",
+                "date_of_birth": date(1988, 4, 12),
+                "age": 37,
+                "priority_level": lane.title(),
+                "complaint": "General Illness",
+                "status": "Waiting",
+                "queue_number": 40 + i,
+                "position": (40 + i) * 1024,
+                "created_at": datetime(2025, 3, 1, 8, 15, i, tzinfo=timezone.utc),
+                "is_new_patient": False,
+            }
+    return snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure CPU time per registration queue update against the number of "
+        "connected subscribers: encoding the snapshot in every consumer versus "
+        "encoding it once and forwarding the text."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscribers', type=str, default='1,10,50,100,250,500',
+            help='Comma separated subscriber counts'
+        )
+        parser.add_argument('--updates', type=int, default=200, help='Updates per measurement')
+
+    def handle(self, *args, **options):
+        counts = [int(n) for n in options['subscribers'].split(',') if n.strip()]
+        updates = options['updates']
+        snapshot = sample_snapshot()
+
+        self.stdout.write(f"{'subscribers':>11}  {'per-consumer ms':>15}  {'shared ms':>9}  {'speedup':>7}")
+        for count in counts:
+            consumers = [self.make_consumer(n) for n in range(count)]
+            per_consumer = asyncio.run(self.measure(consumers, updates, snapshot, shared=False))
+            shared = asyncio.run(self.measure(consumers, updates, snapshot, shared=True))
+            self.stdout.write(
+                f"{count:>11}  {per_consumer * 1000:>15.3f}  {shared * 1000:>9.3f}  "
+                f"{per_consumer / shared if shared else float('inf'):>6.1f}x"
+            )
+
+    def make_consumer(self, n):
+        consumer = RegistrationQueueConsumer()
+        consumer.channel_name = f"bench.{n}"
+        consumer.versioned = False
+        consumer.version, consumer.epoch = -1, None
+        consumer.stats = ConnectionStats(consumer.channel_name, "bench")
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            consumer.sent_bytes = len(text_data)
+        consumer.send = send
+        return consumer
+
+    async def measure(self, consumers, updates, snapshot, shared):
+        """CPU seconds per update: building the event plus delivering it to every consumer."""
+        start = time.process_time()
+        for version in range(updates):
+            if shared:
+                event = {"type": "queue_update", "version": version, "epoch": "bench",
+                         **registration_snapshot_texts(version, "bench", snapshot)}
+                for consumer in consumers:
+                    # what the consumer's writer task does with the event
+                    await consumer.deliver("registration", event)
+            else:
+                # previous behaviour: the event carried the data and every
+                # consumer ran json.dumps on it
+                event = {"type": "queue_update", "version": version, "epoch": "bench",
+                         "data": json_safe(snapshot)}
+                for consumer in consumers:
+                    await consumer.send(text_data=json.dumps(event["data"]))
+        return (time.process_time() - start) / updates
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from queueing.carryover import CARRY_OVER_STATUSES, carry_over_queue, warm_queue_caches
+from queueing.dispatcher import dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Carry unfinished queue entries over to today and prepare the day (run daily, before archive_queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to', type=str, default=None,
+            help='Day to carry the entries over to (YYYY-MM-DD, default today)'
+        )
+        parser.add_argument(
+            '--status', action='append', choices=CARRY_OVER_STATUSES, default=None,
+            help='Only carry over entries in this status (repeatable, default all unfinished)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count the entries')
+
+    def handle(self, *args, **options):
+        to_day = None
+        if options['to']:
+            to_day = parse_date(options['to'])
+            if to_day is None:
+                raise CommandError('--to must be YYYY-MM-DD')
+
+        statuses = tuple(options['status'] or CARRY_OVER_STATUSES)
+        carried = carry_over_queue(to_day=to_day, statuses=statuses, dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would carry over {carried} queue entries'))
+            return
+
+        # send the boards now; the dispatcher's timer would not outlive the command
+        dispatcher.flush()
+        waiting = warm_queue_caches(to_day)
+        self.stdout.write(self.style.SUCCESS(
+            f'Carried over {carried} queue entries, {waiting} waiting for registration'
+        ))
@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import date
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from queueing.analytics import percentile
+from queueing.models import TemporaryStorageQueue
+from user.models import UserAccount
+
+# writes that change a queue board; their responses start the broadcast lag clock
+BOARD_WRITES = {"register", "accept", "preliminary assessment", "treatment"}
+
+ASSESSMENT = {
+    "blood_pressure": "120/80", "temperature": "36.8", "heart_rate": "78",
+    "respiratory_rate": "16", "pulse_rate": "78", "symptoms": "Cough and fever",
+    "pain_scale": "2", "assessment": "Load test",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the queue flow in-process: secretaries register and accept "
+        "patients, doctors claim and finish assessments and treatments, and "
+        "WebSocket listeners follow the boards. Runs against the ASGI application "
+        "with an in-memory channel layer and a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--secretaries', type=int, default=4)
+        parser.add_argument('--doctors', type=int, default=4)
+        parser.add_argument('--listeners', type=int, default=20, help='WebSocket clients following the boards')
+        parser.add_argument('--patients', type=int, default=10, help='Patients registered by each secretary')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+        parser.add_argument('--verbose', action='store_true', help="Keep the views' debug output")
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Replace a leftover test database without asking'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.error_samples = {}
+        self.writes = []
+        self.received = []
+        self.secretaries_done = False
+
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=not options['interactive'], serialize=False
+        )
+        # worker threads close their connections after each request, so the
+        # test database can be dropped at the end
+        connection.settings_dict["CONN_MAX_AGE"] = 0
+        try:
+            with override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}):
+                quiet = contextlib.ExitStack()
+                if not options['verbose']:
+                    # the views print every request; failures are counted in the report
+                    quiet.enter_context(contextlib.redirect_stdout(io.StringIO()))
+                    quiet.enter_context(mock.patch.object(logging.getLogger("django.request"), "disabled", True))
+                    # Django's disconnect listener outliving HttpCommunicator is reported at loop shutdown
+                    quiet.enter_context(mock.patch.object(logging.getLogger("asyncio"), "disabled", True))
+                with quiet:
+                    elapsed = asyncio.run(self.run())
+                    gc.collect()
+                self.report(elapsed)
+        finally:
+            # connections of finished worker threads close once collected
+            gc.collect()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self):
+        from backend.asgi import application
+        from queueing.dispatcher import dispatcher
+        from queueing.utils import TOPIC_GROUPS, topic_event
+
+        self.application = application
+        options = self.options
+        secretaries = [await self.make_user(f"secretary{n}", "secretary") for n in range(options['secretaries'])]
+        doctors = [await self.make_user(f"doctor{n}", "doctor") for n in range(options['doctors'])]
+
+        # The dispatcher flushes from a timer thread with async_to_sync, i.e. a
+        # second event loop, and InMemoryChannelLayer only wakes consumers
+        # waiting on the loop that sends. Hand the group_send to this loop.
+        loop = asyncio.get_running_loop()
+        layer = get_channel_layer()
+
+        def send_on_loop(topics):
+            for topic in sorted(topics):
+                event = topic_event(topic)
+                asyncio.run_coroutine_threadsafe(
+                    layer.group_send(TOPIC_GROUPS[topic], event), loop
+                ).result(options['timeout'])
+
+        with mock.patch.object(dispatcher, "_send", send_on_loop):
+            listeners = []
+            for n in range(options['listeners']):
+                communicator = WebsocketCommunicator(application, "/ws/queue/?topics=registration,assessment,treatment")
+                connected, _ = await communicator.connect(timeout=options['timeout'])
+                if not connected:
+                    self.fail("websocket connect", "refused")
+                    continue
+                listeners.append(communicator)
+            stop = asyncio.Event()
+            listening = [asyncio.create_task(self.listen(c, stop)) for c in listeners]
+
+            started = time.perf_counter()
+            working = [asyncio.create_task(self.secretary(n, user)) for n, user in enumerate(secretaries)]
+            working += [asyncio.create_task(self.doctor(user)) for user in doctors]
+            await asyncio.gather(*working[:len(secretaries)])
+            self.secretaries_done = True
+            await asyncio.gather(*working[len(secretaries):])
+            elapsed = time.perf_counter() - started
+
+            # let the last coalesced broadcast arrive
+            await asyncio.sleep(dispatcher.window + 0.5)
+            stop.set()
+            await asyncio.gather(*listening)
+            for communicator in listeners:
+                await communicator.disconnect()
+        # the thread running the sync views outlives the loop; release its connection
+        await sync_to_async(connections.close_all)()
+        return elapsed
+
+    async def make_user(self, name, role):
+        def create():
+            user = UserAccount.objects.create_user(
+                email=f"{name}@load.test", password="x", first_name="Load", last_name=name, role=role
+            )
+            return user, str(AccessToken.for_user(user))
+        return await database_sync_to_async(create)()
+
+    async def request(self, name, method, path, user, body=None, ok=(200, 201)):
+        _, token = user
+        payload = json.dumps(body).encode() if body is not None else b""
+        communicator = HttpCommunicator(
+            self.application, method, path, body=payload,
+            headers=[
+                (b"host", b"localhost"),
+                (b"authorization", f"Bearer {token}".encode()),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+            ],
+        )
+        started = time.perf_counter()
+        try:
+            response = await communicator.get_response(timeout=self.options['timeout'])
+        except Exception as e:
+            self.fail(name, f"{type(e).__name__}: {e}")
+            return None, None
+        finished = time.perf_counter()
+        self.latencies[name].append(finished - started)
+
+        try:
+            data = json.loads(response["body"]) if response["body"] else None
+        except ValueError:
+            # Django's HTML error pages
+            data = response["body"].decode(errors="replace")
+        if response["status"] not in ok:
+            self.fail(name, f"HTTP {response['status']}: {str(data)[:200]}")
+        elif name in BOARD_WRITES:
+            self.writes.append(finished)
+        return response["status"], data
+
+    def fail(self, name, detail):
+        self.errors[name] += 1
+        self.error_samples.setdefault(name, detail)
+
+    async def secretary(self, n, user):
+        for i in range(self.options['patients']):
+            status, data = await self.request("register", "POST", "/patient/patient-register/", user, {
+                "first_name": "Load", "last_name": f"Patient{n}x{i}",
+                "email": f"patient{n}x{i}@load.test", "phone_number": "09170000000",
+                "date_of_birth": str(date(1990, 1 + i % 12, 1 + n % 28)), "gender": "Female",
+                "street_address": "1 Load St", "barangay": "Test", "municipal_city": "Test",
+                "agree_terms": True, "complaint": "General Illness",
+                "priority_level": "Priority" if i % 4 == 0 else "Regular",
+            })
+            if status != 201:
+                continue
+            await self.request("accept", "POST", "/patient/update-status/", user, {
+                "action": "preliminary", "queue_entry_id": data["queue_entry"]["id"],
+            })
+
+    async def doctor(self, user):
+        while True:
+            status, entry = await self.request("claim assessment", "POST", "/queueing/assessment/next/", user, ok=(200, 204))
+            if status == 200:
+                await self.request(
+                    "preliminary assessment", "POST",
+                    f"/queueing/patient-preliminary-assessment/{entry['patient_id']}/{entry['queue_number']}/",
+                    user, ASSESSMENT,
+                )
+                continue
+            status, entry = await self.request("claim treatment", "POST", "/queueing/treatment/next/", user, ok=(200, 204))
+            if status == 200:
+                await self.request(
+                    "treatment", "POST",
+                    f"/queueing/patient-treatment/{entry['patient_id']}/{entry['queue_number']}/",
+                    user, {"treatment_notes": "Load test", "diagnoses": [], "prescriptions": []},
+                )
+                continue
+            if self.secretaries_done:
+                return
+            await asyncio.sleep(0.05)
+
+    async def listen(self, communicator, stop):
+        # receive_from() cancels the consumer when it times out, so wait on
+        # the communicator's output queue directly
+        received = []
+        stopped = asyncio.ensure_future(stop.wait())
+        while True:
+            message = asyncio.ensure_future(communicator.output_queue.get())
+            await asyncio.wait({message, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if not message.done():
+                message.cancel()
+                break
+            received.append(time.perf_counter())
+        self.received.append(received)
+
+    def broadcast_lags(self):
+        """Per listener, time from each board write's response to the next message it received."""
+        lags, missed = [], 0
+        for received in self.received:
+            for written in self.writes:
+                i = bisect_left(received, written)
+                if i < len(received):
+                    lags.append(received[i] - written)
+                else:
+                    missed += 1
+        return lags, missed
+
+    def report(self, elapsed):
+        requests = sum(len(v) for v in self.latencies.values())
+        self.stdout.write(
+            f"{self.options['secretaries']} secretaries, {self.options['doctors']} doctors, "
+            f"{self.options['listeners']} listeners on {connection.vendor}: "
+            f"{requests} requests in {elapsed:.2f}s ({requests / elapsed if elapsed else 0:.1f}/s)\n"
+        )
+        self.stdout.write(f"{'endpoint':<24}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies[name]
+            self.stdout.write(
+                f"{name:<24}{len(values):>7}{self.errors[name]:>8}"
+                + "".join(f"{ms(percentile(values, p)):>9}" for p in (0.5, 0.95, 0.99))
+            )
+
+        lags, missed = self.broadcast_lags()
+        self.stdout.write(
+            f"\nbroadcast lag           p50 {ms(percentile(lags, 0.5))} ms, p95 {ms(percentile(lags, 0.95))} ms, "
+            f"p99 {ms(percentile(lags, 0.99))} ms over {len(lags)} write/listener pairs, {missed} never followed by a message"
+        )
+        self.stdout.write(f"messages received       {sum(len(r) for r in self.received)}")
+
+        duplicates = TemporaryStorageQueue.objects.values("queue_date", "queue_number").annotate(
+            entries=Count("id")
+        ).filter(entries__gt=1)
+        statuses = Counter(TemporaryStorageQueue.objects.values_list("status", flat=True))
+        self.stdout.write(f"duplicate queue numbers {duplicates.count()}")
+        self.stdout.write(f"final statuses          {dict(statuses)}")
+
+        for name, detail in self.error_samples.items():
+            self.stdout.write(self.style.ERROR(f"first {name} error: {detail}"))
+        failed = sum(self.errors.values()) + duplicates.count()
+        style = self.style.ERROR if failed else self.style.SUCCESS
+        self.stdout.write(style(f"\n{sum(self.errors.values())} errors, {duplicates.count()} duplicate queue numbers"))
+
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
@@ -0,0 +1,90 @@
+import itertools
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+
+from queueing.simulation import STAGES, historical_profile, simulate
+
+
+def staff_counts(value):
+    try:
+        counts = [int(n) for n in value.split(",")]
+    except ValueError:
+        raise CommandError(f"Staff counts must be comma-separated numbers, got {value!r}")
+    if any(n < 1 for n in counts):
+        raise CommandError("Every stage needs at least one staff member")
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Simulate the clinic queue with historical arrivals and a given staffing to predict waits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=str, default=None, help='First day of history (YYYY-MM-DD, default 90 days ago)')
+        parser.add_argument('--end', type=str, default=None, help='Last day of history (YYYY-MM-DD, default yesterday)')
+        parser.add_argument('--days', type=int, default=30, help='Days to simulate')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--demand', type=float, default=1.0, help='Scale the historical arrivals, e.g. 1.3 for flu season')
+        for stage in STAGES:
+            parser.add_argument(
+                f'--{stage}', type=str, default='1',
+                help=f'Staff for {stage}; a comma-separated list tries every combination'
+            )
+            parser.add_argument(
+                f'--{stage}-minutes', type=float, default=None,
+                help=f'Mean {stage} service minutes (default from history)'
+            )
+        parser.add_argument('--json', action='store_true', help='Print the full reports as JSON')
+
+    def handle(self, *args, **options):
+        end = parse_date(options['end']) if options['end'] else localdate() - timedelta(days=1)
+        start = parse_date(options['start']) if options['start'] else end - timedelta(days=89)
+        if start is None or end is None:
+            raise CommandError('--start and --end must be YYYY-MM-DD')
+
+        try:
+            profile = historical_profile(start, end)
+        except ValueError as e:
+            raise CommandError(str(e))
+        profile["rates"] = profile["rates"] * options['demand']
+        service_minutes = {
+            stage: options[f'{stage}_minutes'] for stage in STAGES if options[f'{stage}_minutes']
+        }
+
+        reports = []
+        started = time.perf_counter()
+        for counts in itertools.product(*(staff_counts(options[stage]) for stage in STAGES)):
+            reports.append(simulate(
+                profile, dict(zip(STAGES, counts)), days=options['days'],
+                service_minutes=service_minutes, seed=options['seed'],
+            ))
+        elapsed = time.perf_counter() - started
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+
+        self.stdout.write(
+            f"History {start}..{end}: {profile['days']} days, "
+            f"{profile['rates'].sum():.1f} arrivals/day (x{options['demand']})"
+        )
+        for report in reports:
+            staff = ", ".join(f"{stage} {n}" for stage, n in report['staff'].items())
+            self.stdout.write(f"\n{staff} - {report['patients']} patients in {report['days']} days")
+            for stage, stats in report['stages'].items():
+                waits = "  ".join(
+                    f"{lane} p50 {fmt(w['p50'])} p90 {fmt(w['p90'])} min"
+                    for lane, w in stats['wait_minutes'].items()
+                )
+                self.stdout.write(f"  {stage:<11} utilization {stats['utilization']:.0%}  {waits}")
+            total = report['time_in_clinic_minutes']
+            self.stdout.write(f"  time in clinic p50 {fmt(total['p50'])} p90 {fmt(total['p90'])} min")
+        self.stdout.write(self.style.SUCCESS(f"\n{len(reports)} scenario(s) simulated in {elapsed:.2f}s"))
+
+
+def fmt(value):
+    return "-" if value is None else f"{value:.0f}"
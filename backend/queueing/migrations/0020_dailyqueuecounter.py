@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queueing', '0019_temporarystoragequeue_patient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyQueueCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue_date', models.DateField(unique=True)),
+                ('last_number', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
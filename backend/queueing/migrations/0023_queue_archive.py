@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:33
+
+import datetime
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0016_patient_role_id'),
+        ('queueing', '0022_queuetransition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority_level', models.CharField(choices=[('Regular', 'Regular'), ('Priority', 'Priority Lane (PWD/Pregnant)')], default='Regular', max_length=10)),
+                ('complaint', models.TextField(blank=True, choices=[('General Illness', 'General Illness'), ('Injury', 'Injury'), ('Check-up', 'Check-up'), ('Other', 'Other')], help_text="Either one of the predefined choices, or a custom text when 'Other'", max_length=100, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('Waiting', 'Waiting'), ('Queued for Assessment', 'Queued for Assessment'), ('Queued for Treatment', 'Queued for Treatment'), ('Ongoing for Laboratory', 'Ongoing for Laboratory'), ('Ongoing for Treatment', 'Ongoing for Treatment'), ('Completed', 'Completed')], default='Waiting', max_length=50)),
+                ('queue_number', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('queue_date', models.DateField(default=datetime.date.today)),
+                ('position', models.IntegerField(db_index=True, default=0)),
+                ('is_new_patient', models.BooleanField(default=False)),
+                ('temp_first_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_middle_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_last_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('temp_phone_number', models.CharField(blank=True, max_length=15, null=True)),
+                ('temp_date_of_birth', models.DateField(blank=True, null=True)),
+                ('temp_gender', models.CharField(blank=True, max_length=10, null=True)),
+                ('temp_street_address', models.TextField(blank=True, null=True)),
+                ('temp_barangay', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_municipal_city', models.CharField(blank=True, max_length=100, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('claimed_status', models.CharField(blank=True, max_length=50, null=True)),
+                ('is_archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'queueing_queuehistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedQueueEntry',
+            fields=[
+                ('priority_level', models.CharField(choices=[('Regular', 'Regular'), ('Priority', 'Priority Lane (PWD/Pregnant)')], default='Regular', max_length=10)),
+                ('complaint', models.TextField(blank=True, choices=[('General Illness', 'General Illness'), ('Injury', 'Injury'), ('Check-up', 'Check-up'), ('Other', 'Other')], help_text="Either one of the predefined choices, or a custom text when 'Other'", max_length=100, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('Waiting', 'Waiting'), ('Queued for Assessment', 'Queued for Assessment'), ('Queued for Treatment', 'Queued for Treatment'), ('Ongoing for Laboratory', 'Ongoing for Laboratory'), ('Ongoing for Treatment', 'Ongoing for Treatment'), ('Completed', 'Completed')], default='Waiting', max_length=50)),
+                ('queue_number', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('queue_date', models.DateField(default=datetime.date.today)),
+                ('position', models.IntegerField(db_index=True, default=0)),
+                ('is_new_patient', models.BooleanField(default=False)),
+                ('temp_first_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_middle_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_last_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('temp_phone_number', models.CharField(blank=True, max_length=15, null=True)),
+                ('temp_date_of_birth', models.DateField(blank=True, null=True)),
+                ('temp_gender', models.CharField(blank=True, max_length=10, null=True)),
+                ('temp_street_address', models.TextField(blank=True, null=True)),
+                ('temp_barangay', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_municipal_city', models.CharField(blank=True, max_length=100, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('claimed_status', models.CharField(blank=True, max_length=50, null=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('archived_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+                ('claimed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_queue_entries', to='patient.patient')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0016_patient_role_id'),
+        ('queueing', '0023_queue_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='temporarystoragequeue',
+            index=models.Index(fields=['queue_date', 'status', 'priority_level', 'position'], name='queue_date_status_lane_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='temporarystoragequeue',
+            index=models.Index(fields=['queue_date', 'position'], name='queue_date_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='temporarystoragequeue',
+            index=models.Index(fields=['patient', 'created_at'], name='queue_patient_created_idx'),
+        ),
+    ]
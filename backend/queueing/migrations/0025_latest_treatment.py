@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_latest_treatments(apps, schema_editor):
+    Treatment = apps.get_model('queueing', 'Treatment')
+    LatestTreatment = apps.get_model('queueing', 'LatestTreatment')
+    latest = Treatment.objects.filter(patient_id=OuterRef('patient_id')).order_by('-created_at', '-id').values('id')[:1]
+    rows = Treatment.objects.filter(id=Subquery(latest)).values_list('patient_id', 'id', 'created_at')
+    LatestTreatment.objects.bulk_create(
+        [LatestTreatment(patient_id=patient_id, treatment_id=treatment_id, created_at=created_at)
+         for patient_id, treatment_id, created_at in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0017_patient_last_visit_at'),
+        ('queueing', '0024_queue_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestTreatment',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_treatment', serialize=False, to='patient.patient')),
+                ('created_at', models.DateTimeField()),
+                ('treatment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='latest_for', to='queueing.treatment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-created_at', '-patient'], name='latest_treatment_created_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_latest_treatments, migrations.RunPython.noop),
+    ]
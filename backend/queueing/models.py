@@ -9,8 +9,18 @@ from django.db import models
 from django.utils.timezone import now
 from patient.models import Patient
 from django.db.models import Max
+from django.db import transaction, IntegrityError
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest, Now
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-class TemporaryStorageQueue(models.Model):
+class QueueEntryBase(models.Model):
+    """
+    Columns shared by the live queue (TemporaryStorageQueue), its archive
+    (ArchivedQueueEntry) and the union of both (QueueHistory). Relations are
+    declared on each model, since their reverse names differ.
+    """
     PRIORITY_CHOICES = [
         ('Regular', 'Regular'),
         ('Priority', 'Priority Lane (PWD/Pregnant)'),
@@ -61,7 +71,15 @@ class TemporaryStorageQueue(models.Model):
     temp_street_address = models.TextField(blank=True, null=True)
     temp_barangay = models.CharField(max_length=100, blank=True, null=True)
     temp_municipal_city = models.CharField(max_length=100, blank=True, null=True)
-    
+
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claimed_status = models.CharField(max_length=50, blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+class TemporaryStorageQueue(QueueEntryBase):
     patient = models.ForeignKey(
         Patient,
         on_delete=models.CASCADE,
@@ -78,24 +96,98 @@ class TemporaryStorageQueue(models.Model):
         limit_choices_to={"role": "patient"},
     )
 
+    # staff member who called this patient from the stage queue (see
+    # queueing.utils.claim_next); cleared once the status moves on
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="claimed_queue_entries",
+    )
+
+    # Positions are sparse so an entry can be slotted between two others by
+    # writing only its own row; see queueing.utils.position_after().
+    POSITION_GAP = 1024
+
+    class Meta:
+        # hot paths filter on today's queue_date (never on created_at__date,
+        # which wraps the column in a function); see QueueIndexPlanTests
+        indexes = [
+            # waiting lanes, stage boards and call-next
+            models.Index(fields=['queue_date', 'status', 'priority_level', 'position'],
+                         name='queue_date_status_lane_idx'),
+            # inserting behind the head (utils.position_after)
+            models.Index(fields=['queue_date', 'position'], name='queue_date_position_idx'),
+            # a patient's latest visit
+            models.Index(fields=['patient', 'created_at'], name='queue_patient_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so save() can log status transitions
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_patient_id = instance.__dict__.get('patient_id')
+        return instance
+
+    def transition_to(self, status, actor=None):
+        """Move the entry to `status`, logging who did it. Returns the previous status."""
+        previous_status = self.status
+        self.status = status
+        self._transition_actor = actor
+        self.save()
+        return previous_status
+
     def save(self, *args, **kwargs):
         # Only auto-generate queue_number when it is not supplied
         if self.queue_number is None:
-            # get the max queue_number for the same date, handle None safely
-            max_q = TemporaryStorageQueue.objects.filter(
-                queue_date=self.queue_date
-            ).aggregate(Max('queue_number'))['queue_number__max'] or 0
+            self.queue_number = DailyQueueCounter.allocate(self.queue_date)
+        # New entries go to the back of the day's queue
+        if self._state.adding and not self.position:
+            self.position = self.queue_number * self.POSITION_GAP
+        # a claim only holds for the stage it was made in
+        if self.claimed_status and self.claimed_status != self.status:
+            self.claimed_by = None
+            self.claimed_at = None
+            self.claimed_status = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {
+                    *kwargs['update_fields'], 'claimed_by', 'claimed_at', 'claimed_status'
+                }
 
-            self.queue_number = max_q + 1
+        adding = self._state.adding
+        previous_status = None if adding else getattr(self, '_loaded_status', None)
+        # a status that was never loaded (deferred) cannot be compared
+        status_known = adding or (previous_status is not None and 'status' in self.__dict__)
+        if not status_known or (not adding and previous_status == self.status):
+            super().save(*args, **kwargs)
+            return
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            logged = QueueTransition.objects.create(
+                entry=self,
+                from_status=previous_status,
+                to_status=self.status,
+                queue_date=self.queue_date,
+                actor=getattr(self, '_transition_actor', None),
+            )
+            from .wait_time import wait_estimator
+            transaction.on_commit(lambda: wait_estimator.observe(
+                logged.entry_id, self.priority_level, logged.from_status, logged.to_status, logged.created_at
+            ))
+        self._loaded_status = self.status
+        self._transition_actor = None
         
     def get_age(self):
-        if not self.date_of_birth:
+        if self.patient_id:
+            return self.patient.get_age()
+        if not self.temp_date_of_birth:
             return None
         today = date.today()
-        return today.year - self.date_of_birth.year - (
-            (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day)
+        return today.year - self.temp_date_of_birth.year - (
+            (today.month, today.day) < (self.temp_date_of_birth.month, self.temp_date_of_birth.day)
         )
         
     @property
@@ -115,6 +207,190 @@ class TemporaryStorageQueue(models.Model):
         return f"Patient {name} ({patient_id}) - Queue {self.queue_number} ({self.priority_level})"
 
 
+class DailyQueueCounter(models.Model):
+    """
+    Last queue number handed out for a date. Every entry path allocates
+    through here instead of scanning TemporaryStorageQueue for the max.
+    """
+    queue_date = models.DateField(unique=True)
+    last_number = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, queue_date, count=1):
+        """
+        Reserve `count` consecutive queue numbers for `queue_date` and return
+        the last one. The increment is a single UPDATE, so the counter row
+        stays locked until the caller's transaction ends and concurrent
+        registrations queue up on it instead of reading the same max. Numbers
+        taken by a transaction that later fails are simply skipped.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(queue_date=queue_date).update(
+                last_number=F('last_number') + count
+            )
+            if not updated:
+                # first allocation of the day; continue after any existing entries
+                seed = TemporaryStorageQueue.objects.filter(
+                    queue_date=queue_date
+                ).aggregate(Max('queue_number'))['queue_number__max'] or 0
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(queue_date=queue_date, last_number=seed + count)
+                except IntegrityError:
+                    # another registration created the row first
+                    cls.objects.filter(queue_date=queue_date).update(
+                        last_number=F('last_number') + count
+                    )
+            return cls.objects.get(queue_date=queue_date).last_number
+
+    def __str__(self):
+        return f"{self.queue_date}: {self.last_number}"
+
+
+class ArchivedQueueEntry(QueueEntryBase):
+    """
+    Completed and past-date queue entries, moved out of TemporaryStorageQueue
+    by queueing/archive.py so the live table only holds today's queue.
+    Rows keep their original id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name='archived_queue_entries',
+        null=True,
+        blank=True
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+    archived_at = models.DateTimeField(db_default=Now())
+
+    def __str__(self):
+        return f"Archived queue {self.queue_number} ({self.queue_date})"
+
+
+class QueueHistory(QueueEntryBase):
+    """
+    Read-only view over live and archived queue entries, for reports that
+    span past days. The view is (re)created after every migrate by
+    queueing.archive.create_queue_history_view.
+    """
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        null=True,
+        blank=True,
+    )
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        null=True,
+        blank=True,
+    )
+    is_archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'queueing_queuehistory'
+
+
+class QueueTransition(models.Model):
+    """
+    Append-only log of queue status changes, written by
+    TemporaryStorageQueue.save(). Entries are created with from_status None.
+    Read by queueing/analytics.py for time-in-stage reports.
+    """
+    # no FK constraint so the log survives entries being archived or deleted
+    entry = models.ForeignKey(
+        TemporaryStorageQueue,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='transitions',
+    )
+    from_status = models.CharField(max_length=50, blank=True, null=True)
+    to_status = models.CharField(max_length=50)
+    queue_date = models.DateField()
+    created_at = models.DateTimeField(default=now)
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='queue_transitions',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue_date', 'to_status']),
+            models.Index(fields=['entry', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.entry_id}: {self.from_status} -> {self.to_status} at {self.created_at}"
+
+
+# keep the in-memory queue index (queueing/queue_index.py) in step with the table
+@receiver(post_save, sender=TemporaryStorageQueue)
+def update_queue_index(sender, instance, **kwargs):
+    from .queue_index import queue_index
+    entry_id, entry_status = instance.id, instance.status
+    record = queue_index.record_for(instance)
+    transaction.on_commit(lambda: queue_index.apply(entry_id, record, entry_status))
+
+def record_visits(entries):
+    """
+    Move each patient's last_visit_at up to the created_at of their entries
+    in `entries` (never back), in one UPDATE.
+    """
+    visits = {}
+    for entry in entries:
+        if entry.patient_id and entry.created_at:
+            visits[entry.patient_id] = max(entry.created_at, visits.get(entry.patient_id, entry.created_at))
+    if not visits:
+        return
+    Patient.objects.filter(pk__in=visits).update(last_visit_at=Case(*[
+        When(pk=patient_id, then=Greatest(Coalesce('last_visit_at', Value(at)), Value(at)))
+        for patient_id, at in visits.items()
+    ]))
+
+@receiver(post_save, sender=TemporaryStorageQueue)
+def update_last_visit(sender, instance, created, **kwargs):
+    # new entries, and walk-ins accepted as patients
+    if instance.patient_id and (created or instance.patient_id != getattr(instance, '_loaded_patient_id', None)):
+        record_visits([instance])
+    instance._loaded_patient_id = instance.patient_id
+
+@receiver(post_delete, sender=TemporaryStorageQueue)
+def remove_from_queue_index(sender, instance, **kwargs):
+    from .queue_index import queue_index
+    entry_id = instance.id
+    transaction.on_commit(lambda: queue_index.discard(entry_id))
+
+
 
     
 class PreliminaryAssessment(models.Model):
@@ -155,4 +431,61 @@ class Treatment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)  
     objects = TreatmentManager()
     def __str__(self):
-        return f"Treatment for {self.patient.first_name} {self.patient.last_name}"
\ No newline at end of file
+        return f"Treatment for {self.patient.first_name} {self.patient.last_name}"
+
+class LatestTreatment(models.Model):
+    """
+    Each patient's most recent treatment, kept by the Treatment receivers
+    below so treatment boards read one row per patient instead of
+    reducing every treatment.
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='latest_treatment')
+    treatment = models.OneToOneField(Treatment, on_delete=models.CASCADE, related_name='latest_for')
+    # the treatment's created_at, for ordering and date windows
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-patient'], name='latest_treatment_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id}: treatment {self.treatment_id}"
+
+
+def record_latest_treatment(treatment):
+    """Point the patient's LatestTreatment at `treatment` unless a newer one is there."""
+    for _ in range(2):
+        if LatestTreatment.objects.filter(
+            patient_id=treatment.patient_id, created_at__lte=treatment.created_at
+        ).update(treatment=treatment, created_at=treatment.created_at):
+            return
+        try:
+            with transaction.atomic():
+                LatestTreatment.objects.create(
+                    patient_id=treatment.patient_id, treatment=treatment, created_at=treatment.created_at
+                )
+            return
+        except IntegrityError:
+            # the patient already has a row (newer, or created concurrently); compare again
+            continue
+
+def refresh_latest_treatment(patient_id):
+    """Recompute the patient's LatestTreatment from their treatments."""
+    latest = Treatment.objects.filter(patient_id=patient_id).order_by('-created_at', '-id').first()
+    if latest is None:
+        LatestTreatment.objects.filter(patient_id=patient_id).delete()
+    else:
+        LatestTreatment.objects.update_or_create(
+            patient_id=patient_id, defaults={'treatment': latest, 'created_at': latest.created_at}
+        )
+
+@receiver(post_save, sender=Treatment)
+def update_latest_treatment(sender, instance, created, **kwargs):
+    # PatientTreatmentForm and every other place that records a treatment
+    if created:
+        record_latest_treatment(instance)
+
+@receiver(post_delete, sender=Treatment)
+def replace_latest_treatment(sender, instance, **kwargs):
+    refresh_latest_treatment(instance.patient_id)
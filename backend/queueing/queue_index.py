@@ -0,0 +1,271 @@
+"""
+In-memory index of today's registration queue.
+
+compute_queue_snapshot() used to run two ORM queries on every status change.
+The index keeps one ordered list per lane (Priority/Regular) for the current
+day. It is built once from the database and then kept in step by the
+TemporaryStorageQueue post_save/post_delete receivers, so reading the six head
+slots never touches the database.
+
+Every change to the six-slot snapshot bumps a monotonic `version` and is
+recorded, already encoded, as a delta in a bounded ring buffer, so WebSocket
+clients that reconnect can replay what they missed instead of re-fetching
+the queue.
+`epoch` identifies this process's version sequence; versions from another
+epoch (another process, or before a restart) cannot be replayed.
+"""
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from collections import deque
+
+from django.conf import settings
+from django.utils.timezone import localdate
+
+LANES = ("Priority", "Regular")
+
+
+def entry_key(entry):
+    """Sort key matching waiting_lane(): position, queue_number, id."""
+    queue_number = entry.queue_number if entry.queue_number is not None else float("inf")
+    return (entry.position, queue_number, entry.id)
+
+
+def is_indexed(entry, day):
+    """Whether `entry` belongs in the waiting lanes of `day`."""
+    return (
+        entry.status == "Waiting"
+        and entry.priority_level in LANES
+        and entry.queue_date == day
+    )
+
+
+def diff_snapshots(old, new, statuses=None):
+    """
+    Describe how the six-slot snapshot changed from `old` to `new`.
+
+    added          entry appeared in a slot
+    moved          entry is still visible but in another slot (carries the
+                   entry only when its data changed as well)
+    updated        entry kept its slot but its data changed
+    status_changed entry left the waiting lanes because its status changed
+    removed        entry is no longer visible (deleted or pushed past next2)
+
+    All changes describe the same transition, so clients should apply them
+    against the old slots at once rather than one after another.
+    `statuses` maps entry ids to their new status for entries that left the
+    waiting lanes, so those are reported as status_changed.
+    """
+    statuses = statuses or {}
+    old_slots = {v["id"]: (slot, v) for slot, v in (old or {}).items() if v}
+    new_slots = {v["id"]: (slot, v) for slot, v in new.items() if v}
+
+    changes = []
+    for entry_id, (slot, entry) in new_slots.items():
+        if entry_id not in old_slots:
+            changes.append({"op": "added", "slot": slot, "entry": entry})
+        elif old_slots[entry_id][0] != slot:
+            change = {"op": "moved", "id": entry_id, "slot": slot, "from": old_slots[entry_id][0]}
+            if old_slots[entry_id][1] != entry:
+                change["entry"] = entry
+            changes.append(change)
+        elif old_slots[entry_id][1] != entry:
+            changes.append({"op": "updated", "slot": slot, "entry": entry})
+    for entry_id, (slot, entry) in old_slots.items():
+        if entry_id in new_slots:
+            continue
+        if entry_id in statuses:
+            changes.append({"op": "status_changed", "id": entry_id, "from": slot, "status": statuses[entry_id]})
+        else:
+            changes.append({"op": "removed", "id": entry_id, "from": slot})
+    return changes
+
+
+class QueueIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._day = None
+        self._built_at = None
+        self._lanes = {lane: [] for lane in LANES}
+        # entry id -> (lane, key, formatted payload)
+        self._entries = {}
+        # changes that arrive while rebuild() reads the database, replayed
+        # onto what it read; None when no rebuild is reading
+        self._pending = None
+        self._generation = 0
+
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self._last_snapshot = None
+        self._deltas = deque(maxlen=getattr(settings, "QUEUE_DELTA_BUFFER", 256))
+
+    # building --------------------------------------------------------------
+
+    def rebuild(self, day=None):
+        """Cold start: load `day`'s (default today) waiting lanes from the database."""
+        from .utils import waiting_lane, format_queue_entry
+
+        day = day or localdate()
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._pending = []
+        lanes = {lane: [] for lane in LANES}
+        entries = {}
+        for lane in LANES:
+            for q in waiting_lane(lane, day):
+                key = entry_key(q)
+                lanes[lane].append(key)
+                entries[q.id] = (lane, key, format_queue_entry(q))
+
+        with self._lock:
+            if generation != self._generation:
+                # a later rebuild started reading; it installs its own result
+                return
+            pending, self._pending = self._pending, None
+            self._day = day
+            self._built_at = time.monotonic()
+            self._lanes = lanes
+            self._entries = entries
+            # the read may have missed commits applied meanwhile
+            for entry_id, record in pending:
+                self._replace(entry_id, record)
+            self._record_change()
+
+    def invalidate(self):
+        """Drop the index; the next read rebuilds it from the database."""
+        with self._lock:
+            self._day = None
+
+    def _ensure_fresh(self):
+        max_age = getattr(settings, "QUEUE_INDEX_MAX_AGE", None)
+        stale = (
+            self._day != localdate()
+            or (max_age is not None and time.monotonic() - self._built_at > max_age)
+        )
+        if stale:
+            self.rebuild()
+
+    # incremental updates ---------------------------------------------------
+
+    def record_for(self, entry):
+        """
+        Compute what the index should hold for `entry` right now.
+        Returns None when the entry is not part of today's waiting lanes.
+        """
+        from .utils import format_queue_entry
+
+        if not is_indexed(entry, localdate()):
+            return None
+        return (entry.priority_level, entry_key(entry), format_queue_entry(entry))
+
+    def apply(self, entry_id, record, status=None):
+        """
+        Insert, move or remove one entry. `record` comes from record_for();
+        `status` is the entry's current status, used to label departures.
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((entry_id, record))
+            if self._day is None:
+                # Not built yet; the first read loads the current state.
+                return
+            self._replace(entry_id, record)
+            departed = {entry_id: status} if record is None and status and status != "Waiting" else None
+            self._record_change(departed)
+
+    def discard(self, entry_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((entry_id, None))
+            self._remove(entry_id)
+            if self._day is not None:
+                self._record_change()
+
+    def _replace(self, entry_id, record):
+        self._remove(entry_id)
+        if record is not None:
+            lane, key, payload = record
+            insort(self._lanes[lane], key)
+            self._entries[entry_id] = record
+
+    def _remove(self, entry_id):
+        old = self._entries.pop(entry_id, None)
+        if old is None:
+            return
+        lane, key, _ = old
+        keys = self._lanes[lane]
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    def _record_change(self, statuses=None):
+        new = self._build_snapshot()
+        if self._last_snapshot is not None:
+            changes = diff_snapshots(self._last_snapshot, new, statuses)
+            if changes:
+                from .utils import encode_message, with_wait_estimates
+                self.version += 1
+                # the estimates are as of this version; the six slots themselves
+                # stay without them so time alone does not make a change
+                estimates = {
+                    slot: entry["estimated_wait_seconds"] if entry else None
+                    for slot, entry in with_wait_estimates(new).items()
+                }
+                # encoded once here; every resuming client gets the same text
+                self._deltas.append((self.version, encode_message({
+                    "type": "delta", "version": self.version, "epoch": self.epoch, "changes": changes,
+                    "wait_estimates": estimates,
+                })))
+        self._last_snapshot = new
+
+    # reading ---------------------------------------------------------------
+
+    def _heads(self, lane, count=3):
+        keys = self._lanes[lane] if count is None else self._lanes[lane][:count]
+        return [dict(self._entries[key[2]][2]) for key in keys]
+
+    def _build_snapshot(self):
+        from .utils import snapshot_from_heads
+        return snapshot_from_heads(self._heads("Priority"), self._heads("Regular"))
+
+    def heads(self, lane, count=3):
+        """Formatted payloads of the first `count` entries of `lane` (all when None)."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._heads(lane, count)
+
+    def snapshot(self):
+        with self._lock:
+            self._ensure_fresh()
+            return self._build_snapshot()
+
+    def versioned_snapshot(self):
+        """(version, snapshot) read atomically."""
+        with self._lock:
+            self._ensure_fresh()
+            return self.version, self._build_snapshot()
+
+    def deltas_since(self, version, epoch):
+        """
+        Deltas after `version` as a list of (version, encoded delta message),
+        oldest first.
+        Returns None when they cannot be replayed (unknown epoch, a version
+        from the future, or a gap already evicted from the ring buffer); the
+        caller should send a full snapshot instead.
+        """
+        with self._lock:
+            if epoch != self.epoch:
+                return None
+            if version is None or version > self.version:
+                return None
+            if version == self.version:
+                return []
+            oldest = self._deltas[0][0] if self._deltas else self.version + 1
+            if version + 1 < oldest:
+                return None
+            return [(v, text) for v, text in self._deltas if v > version]
+
+
+queue_index = QueueIndex()
@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"ws/queue/registration/$", consumers.RegistrationQueueConsumer.as_asgi()),
+    re_path(r"ws/queue/(?P<topic>assessment|treatment|lab)/$", consumers.QueueTopicsConsumer.as_asgi()),
+    re_path(r"ws/queue/$", consumers.QueueTopicsConsumer.as_asgi()),
 ]
\ No newline at end of file
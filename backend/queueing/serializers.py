@@ -5,6 +5,7 @@ from patient.models import Diagnosis, Patient, Prescription
 
 from rest_framework import serializers
 from queueing.models import TemporaryStorageQueue
+from queueing.utils import lane_position
 
 class TemporaryStorageQueueSerializer(serializers.ModelSerializer):
     age = serializers.SerializerMethodField()
@@ -13,7 +14,6 @@ class TemporaryStorageQueueSerializer(serializers.ModelSerializer):
         default='Regular'
     )
     queue_number = serializers.SerializerMethodField()
-    queue_data = serializers.SerializerMethodField()
     complaint = serializers.ChoiceField(
         choices=[
             ('General Illness', 'General Illness'),
@@ -33,26 +33,13 @@ class TemporaryStorageQueueSerializer(serializers.ModelSerializer):
         return obj.get_age()
     
     def get_queue_number(self, obj):
-        queue = TemporaryStorageQueue.objects.filter(
-            priority_level=obj.priority_level, status='Waiting'
-        ).order_by('created_at')
-        queue_list = list(queue)
-        return f'#{queue_list.index(obj) + 1}' if obj in queue_list else 'N/A'
+        # rank from utils.with_lane_rank (waiting_lane() listings), otherwise
+        # one count query for this single entry
+        if obj.status != 'Waiting':
+            return 'N/A'
+        rank = getattr(obj, 'lane_rank', None) or lane_position(obj)
+        return f'#{rank}'
     
-    def get_queue_data(self, obj):
-        """Fetch queue data for the patient using the correct related manager."""
-        # Access the patient's related temporary storage queues via the defined related_name.
-        queue_info = obj.patient.temporarystoragequeue.filter(status='Waiting').first()
-        if queue_info:
-            return {
-                'id': queue_info.id,
-                'priority_level': queue_info.priority_level,
-                'status': queue_info.status,
-                'created_at': queue_info.created_at,
-                'complaint': queue_info.complaint,
-            }
-        return None
-
     def get_complaint_display(self, obj):
         if isinstance(obj, dict):
             complaint = obj.get('complaint')
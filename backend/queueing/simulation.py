@@ -0,0 +1,273 @@
+"""
+Discrete-event simulation of the clinic queue for capacity planning.
+
+historical_profile() reads how patients arrived (per lane and hour of day),
+what they came for and which stages each complaint went through.
+simulate() then replays that demand through a given number of staff per
+stage for any number of days and reports the waits and utilization it
+predicts:
+
+    profile = historical_profile(date(2025, 1, 1), date(2025, 3, 31))
+    report = simulate(profile, staff={"assessment": 1, "treatment": 3, "lab": 1}, days=30)
+
+Arrivals are Poisson per lane and hour, drawn for all days at once with
+NumPy; each stage is a multi-server queue that serves Priority before
+Regular, first come first served within a lane, like claim_next(). Every
+simulated day starts empty. Registration itself is not simulated: a patient
+enters the first stage of their route on arrival.
+"""
+import heapq
+from collections import deque
+
+import numpy as np
+from django.db.models import Count
+from django.db.models.functions import ExtractHour
+
+from .analytics import stage_dwell_times
+from .models import QueueHistory, QueueTransition
+
+LANES = ("Priority", "Regular")
+STAGES = ("assessment", "lab", "treatment")
+
+# statuses that mean an entry went through a stage
+STAGE_STATUSES = {
+    "Queued for Assessment": "assessment",
+    "Ongoing for Laboratory": "lab",
+    "Queued for Treatment": "treatment",
+    "Ongoing for Treatment": "treatment",
+}
+# dwell of these statuses is the stage's service time
+SERVICE_STATUSES = {
+    "lab": "Ongoing for Laboratory",
+    "treatment": "Ongoing for Treatment",
+}
+DEFAULT_SERVICE_MINUTES = {"assessment": 10.0, "lab": 30.0, "treatment": 15.0}
+# route of complaints with no logged transitions
+DEFAULT_ROUTE = {"assessment": 1.0, "lab": 0.0, "treatment": 1.0}
+
+
+def historical_profile(start, end):
+    """
+    Demand of queue dates `start`..`end`, archived entries included:
+
+        rates             arrivals per day, array [lane, hour]
+        complaints        complaint names
+        complaint_share   array [lane, complaint], rows sum to 1
+        routing           array [complaint, stage], chance of visiting each stage
+        service_minutes   mean service time per stage, from the transition log
+                          where it has one, else DEFAULT_SERVICE_MINUTES
+        days              number of queue dates with arrivals
+    """
+    history = QueueHistory.objects.filter(queue_date__range=(start, end))
+    days = history.values("queue_date").distinct().count()
+    if not days:
+        raise ValueError(f"No queue entries between {start} and {end}")
+
+    rates = np.zeros((len(LANES), 24))
+    rows = history.filter(priority_level__in=LANES).annotate(
+        hour=ExtractHour("created_at")
+    ).values_list("priority_level", "hour").annotate(count=Count("id"))
+    for lane, hour, count in rows:
+        rates[LANES.index(lane), hour] += count
+    rates /= days
+
+    complaints = {}
+    for lane, complaint, count in history.filter(priority_level__in=LANES).values_list(
+        "priority_level", "complaint"
+    ).annotate(count=Count("id")):
+        complaints.setdefault(complaint or "Other", {})[lane] = count
+    names = sorted(complaints)
+    share = np.array([[complaints[name].get(lane, 0) for name in names] for lane in LANES], dtype=float)
+    totals = share.sum(axis=1, keepdims=True)
+    share = np.divide(share, totals, out=np.full_like(share, 1 / len(names)), where=totals > 0)
+
+    return {
+        "rates": rates,
+        "complaints": names,
+        "complaint_share": share,
+        "routing": historical_routing(start, end, history, names),
+        "service_minutes": historical_service_minutes(start, end),
+        "days": days,
+    }
+
+
+def historical_routing(start, end, history, complaints):
+    """Share of each complaint's entries that went through each stage."""
+    complaint_of = {
+        entry_id: complaint or "Other"
+        for entry_id, complaint in history.values_list("id", "complaint")
+    }
+    visits = {}
+    for entry_id, status in QueueTransition.objects.filter(
+        queue_date__range=(start, end), to_status__in=list(STAGE_STATUSES)
+    ).values_list("entry_id", "to_status").distinct():
+        if entry_id in complaint_of:
+            visits.setdefault(entry_id, set()).add(STAGE_STATUSES[status])
+
+    routed = {name: [0, np.zeros(len(STAGES))] for name in complaints}
+    for entry_id, stages in visits.items():
+        counts = routed[complaint_of[entry_id]]
+        counts[0] += 1
+        counts[1] += [stage in stages for stage in STAGES]
+
+    routing = np.array([[DEFAULT_ROUTE[stage] for stage in STAGES]] * len(complaints))
+    for i, name in enumerate(complaints):
+        entries, stage_counts = routed[name]
+        if entries:
+            routing[i] = stage_counts / entries
+    return routing
+
+
+def historical_service_minutes(start, end):
+    dwell = {row["stage"]: row["mean_seconds"] for row in stage_dwell_times(start, end)}
+    minutes = dict(DEFAULT_SERVICE_MINUTES)
+    for stage, status in SERVICE_STATUSES.items():
+        if dwell.get(status):
+            minutes[stage] = dwell[status] / 60
+    return minutes
+
+
+def generate_arrivals(profile, days, rng):
+    """
+    Arrivals of `days` days as arrays sorted by time: (day, seconds since
+    midnight, lane index, complaint index), drawn without Python loops.
+    """
+    rates = profile["rates"]
+    counts = rng.poisson(np.broadcast_to(rates, (days, *rates.shape)))
+    day, lane, hour = np.nonzero(counts)
+    repeat = counts[day, lane, hour]
+    day, lane, hour = np.repeat(day, repeat), np.repeat(lane, repeat), np.repeat(hour, repeat)
+    seconds = (hour + rng.random(len(hour))) * 3600
+
+    # complaint per arrival, by inverse CDF of its lane's complaint share
+    cdf = np.cumsum(profile["complaint_share"], axis=1)
+    complaint = (rng.random(len(lane))[:, None] > cdf[lane]).sum(axis=1)
+    complaint = np.minimum(complaint, cdf.shape[1] - 1)
+
+    order = np.lexsort((seconds, day))
+    return day[order], seconds[order], lane[order], complaint[order]
+
+
+class StageQueue:
+    """A stage with `servers` staff, serving Priority before Regular."""
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.busy = 0
+        self.waiting = tuple(deque() for _ in LANES)
+        self.busy_seconds = 0.0
+
+    def next_patient(self):
+        for lane in self.waiting:
+            if lane:
+                return lane.popleft()
+        return None
+
+
+def simulate(profile, staff, days=30, service_minutes=None, seed=None):
+    """
+    Run `days` days of the demand in `profile` through `staff` servers per
+    stage ({"assessment": 1, "lab": 1, "treatment": 2}). Service times are
+    exponential around `service_minutes` (default the profile's). Returns
+    per-stage waits and utilization and the time patients spent in the
+    clinic, in minutes.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = {**profile["service_minutes"], **(service_minutes or {})}
+    for stage in STAGES:
+        if staff.get(stage, 0) < 1:
+            raise ValueError(f"{stage} needs at least one staff member")
+
+    day, seconds, lane, complaint = generate_arrivals(profile, days, rng)
+    patients = len(day)
+    routes = rng.random((patients, len(STAGES))) < profile["routing"][complaint]
+    service = {
+        stage: rng.exponential(minutes[stage] * 60, patients) for stage in STAGES
+    }
+
+    waits = {stage: ([], []) for stage in STAGES}
+    open_seconds = {stage: 0.0 for stage in STAGES}
+    busy_seconds = {stage: 0.0 for stage in STAGES}
+    sojourn = np.zeros(patients)
+
+    # days are independent, so each one is a separate event loop
+    bounds = np.searchsorted(day, np.arange(days + 1))
+    for d in range(days):
+        first, last = bounds[d], bounds[d + 1]
+        if first == last:
+            continue
+        stages = {stage: StageQueue(staff[stage]) for stage in STAGES}
+        queued_at = {}
+        events = [(seconds[p], 0, p, -1) for p in range(first, last)]
+        heapq.heapify(events)
+        sequence = last
+        day_end = {stage: None for stage in STAGES}
+
+        def start(stage_index, p, at):
+            nonlocal sequence
+            stage = STAGES[stage_index]
+            waits[stage][lane[p]].append((at - queued_at[p]) / 60)
+            sequence += 1
+            heapq.heappush(events, (at + service[stage][p], sequence, p, stage_index))
+
+        while events:
+            at, _, p, done = heapq.heappop(events)
+            if done >= 0:
+                stage = STAGES[done]
+                queue = stages[stage]
+                queue.busy_seconds += service[stage][p]
+                day_end[stage] = at
+                following = queue.next_patient()
+                if following is None:
+                    queue.busy -= 1
+                else:
+                    start(done, following, at)
+            # move on to the next stage of the route, or leave
+            following_stage = next((i for i in range(done + 1, len(STAGES)) if routes[p, i]), None)
+            if following_stage is None:
+                sojourn[p] = (at - seconds[p]) / 60
+                continue
+            queue = stages[STAGES[following_stage]]
+            queued_at[p] = at
+            if queue.busy < queue.servers:
+                queue.busy += 1
+                start(following_stage, p, at)
+            else:
+                queue.waiting[lane[p]].append(p)
+
+        opened = seconds[first]
+        for stage in STAGES:
+            if day_end[stage] is not None:
+                open_seconds[stage] += (day_end[stage] - opened) * staff[stage]
+                busy_seconds[stage] += stages[stage].busy_seconds
+
+    report = {
+        "days": days,
+        "patients": patients,
+        "patients_per_day": patients / days if days else 0.0,
+        "staff": {stage: staff[stage] for stage in STAGES},
+        "service_minutes": {stage: minutes[stage] for stage in STAGES},
+        "stages": {},
+        "time_in_clinic_minutes": summarize(sojourn),
+    }
+    for stage in STAGES:
+        report["stages"][stage] = {
+            "utilization": busy_seconds[stage] / open_seconds[stage] if open_seconds[stage] else 0.0,
+            "wait_minutes": {
+                name: summarize(np.array(waits[stage][i])) for i, name in enumerate(LANES)
+            },
+        }
+    return report
+
+
+def summarize(values):
+    if not len(values):
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "max": None}
+    p50, p90 = np.percentile(values, [50, 90])
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "max": float(values.max()),
+    }
@@ -0,0 +1,115 @@
+"""
+Server-Sent Events feed for the waiting-room displays.
+
+Displays only show which queue numbers are being called, so they get a
+public snapshot (queue numbers per lane slot, no patient data) over a plain
+HTTP stream instead of a Channels WebSocket. The broadcaster lives in the
+ASGI process: the dispatcher publishes each registration change once, the
+SSE frame is encoded once, and every open stream is handed the same bytes
+on the event loop. No channel-layer or Redis round trip per display.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+
+
+def public_snapshot():
+    """(version, {slot: queue_number}) for the six registration slots, from the queue index."""
+    from .queue_index import queue_index
+
+    version, snapshot = queue_index.versioned_snapshot()
+    return version, {
+        slot: entry["queue_number"] if entry else None
+        for slot, entry in snapshot.items()
+    }
+
+
+def sse_frame(version, data):
+    return f"id: {version}\nevent: snapshot\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class PublicQueueBroadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self._data = None
+        # event loop -> set of per-stream queues living on that loop
+        self._subscribers = {}
+
+    @property
+    def keepalive(self):
+        return getattr(settings, "QUEUE_SSE_KEEPALIVE", 15)
+
+    def publish(self, version=None, data=None):
+        """
+        Hand the current public snapshot to every open stream. Safe to call
+        from any thread; does nothing if the displayed numbers did not change.
+        """
+        if data is None:
+            version, data = public_snapshot()
+        with self._lock:
+            if data == self._data:
+                return
+            self._data = data
+            self._frame = sse_frame(version, data)
+            frame = self._frame
+            subscribers = [(loop, list(queues)) for loop, queues in self._subscribers.items()]
+        for loop, queues in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queues, frame)
+
+    @staticmethod
+    def _deliver(queues, frame):
+        for queue in queues:
+            # a display that has not caught up only needs the newest frame
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    def current_frame(self):
+        with self._lock:
+            if self._frame is None:
+                version, data = public_snapshot()
+                self._data = data
+                self._frame = sse_frame(version, data)
+            return self._frame
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(loop, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            queues = self._subscribers.get(loop, set())
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(loop, None)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    async def stream(self):
+        """Frames for one display: the current snapshot, then every change."""
+        from asgiref.sync import sync_to_async
+
+        queue = self.subscribe()
+        try:
+            yield b"retry: 3000\n\n"
+            yield await sync_to_async(self.current_frame)()
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+
+public_broadcaster = PublicQueueBroadcaster()
@@ -1,3 +1,1137 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from unittest import skipIf, mock
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from patient.models import Patient
+from patient.views import BulkAcceptButton, GetQueue, PatientRegister, SearchPatient
+from user.models import UserAccount
+from .analytics import hourly_throughput, stage_dwell_times
+from .archive import archive_queue
+from .carryover import carry_over_queue, warm_queue_caches
+from .consumers import LatestOnlySenderMixin, connection_registry
+from .queue_index import QueueIndex, diff_snapshots, queue_index
+from .models import ArchivedQueueEntry, DailyQueueCounter, QueueHistory, QueueTransition, TemporaryStorageQueue
+from .dispatcher import BroadcastDispatcher
+from .simulation import historical_profile, simulate
+from .sse import PublicQueueBroadcaster
+from .wait_time import WaitTimeEstimator
+from .serializers import TemporaryStorageQueueSerializer
+from .utils import queue_update_event, registration_snapshot_texts, wrap_encoded, claim_next, release_claim, compute_queue_snapshot_from_db, lane_position, bulk_transition, waiting_lane, with_lane_rank, compute_stage_snapshot, compact_positions, position_after, stage_candidates
+from .views import PatientQueuePosition, QueueIndexCheck, StageDequeue, StageRelease
+
+
+def make_patient(n=0):
+    user = UserAccount.objects.create_user(
+        email=f"patient{n}@example.com", password="x",
+        first_name="Juan", last_name=f"Cruz{n}", role="patient",
+    )
+    return Patient.objects.create(
+        user=user, first_name="Juan", last_name=f"Cruz{n}",
+        email=user.email, phone_number="09170000000",
+    )
+
+
+class DailyQueueCounterTests(TestCase):
+    def test_numbers_increase_per_date(self):
+        today = date(2025, 3, 1)
+        self.assertEqual(DailyQueueCounter.allocate(today), 1)
+        self.assertEqual(DailyQueueCounter.allocate(today), 2)
+        self.assertEqual(DailyQueueCounter.allocate(date(2025, 3, 2)), 1)
+
+    def test_block_allocation_returns_last_number(self):
+        today = date(2025, 3, 1)
+        self.assertEqual(DailyQueueCounter.allocate(today, count=5), 5)
+        self.assertEqual(DailyQueueCounter.allocate(today), 6)
+
+    def test_first_allocation_continues_after_existing_entries(self):
+        today = date(2025, 3, 1)
+        TemporaryStorageQueue.objects.create(queue_date=today, queue_number=41)
+        self.assertEqual(DailyQueueCounter.allocate(today), 42)
+
+    def test_save_assigns_queue_number(self):
+        first = TemporaryStorageQueue.objects.create(temp_first_name="A")
+        second = TemporaryStorageQueue.objects.create(temp_first_name="B")
+        self.assertEqual(second.queue_number, first.queue_number + 1)
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serialises writers; run against PostgreSQL")
+class ConcurrentRegistrationTests(TransactionTestCase):
+    registrations = 200
+    workers = 50
+
+    def setUp(self):
+        self.patient = make_patient()
+        self.secretary = UserAccount.objects.create_user(
+            email="secretary@example.com", password="x",
+            first_name="Ana", last_name="Reyes", role="secretary",
+        )
+
+    def register(self, _):
+        try:
+            request = APIRequestFactory().post(
+                "/patient/patient-register/",
+                {"patient_id": self.patient.patient_id, "complaint": "Check-up"},
+                format="json",
+            )
+            force_authenticate(request, user=self.secretary)
+            response = PatientRegister.as_view()(request)
+            return response.status_code, response.data["queue_entry"]["queue_number"]
+        finally:
+            connection.close()
+
+    def test_parallel_registrations_get_unique_numbers(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self.register, range(self.registrations)))
+
+        self.assertTrue(all(code == 201 for code, _ in results))
+        numbers = [number for _, number in results]
+        self.assertEqual(len(set(numbers)), self.registrations)
+        self.assertEqual(sorted(numbers), list(range(1, self.registrations + 1)))
+
+
+def make_staff(n=0, role="doctor"):
+    return UserAccount.objects.create_user(
+        email=f"{role}{n}@example.com", password="x",
+        first_name="Jose", last_name=f"Rizal{n}", role=role,
+    )
+
+
+class PositionTests(TestCase):
+    def setUp(self):
+        self.first, self.second, self.third = (
+            TemporaryStorageQueue.objects.create(temp_first_name=name) for name in "ABC"
+        )
+
+    def lane(self):
+        return list(TemporaryStorageQueue.objects.order_by("position").values_list("temp_first_name", flat=True))
+
+    def test_insert_between_neighbours_writes_only_the_new_row(self):
+        before = dict(TemporaryStorageQueue.objects.values_list("id", "position"))
+        with CaptureQueriesContext(connection) as captured:
+            position = position_after(self.first)
+            TemporaryStorageQueue.objects.create(temp_first_name="X", position=position)
+        table = TemporaryStorageQueue._meta.db_table
+        self.assertFalse([q for q in captured.captured_queries if q["sql"].startswith("UPDATE") and table in q["sql"]])
+        self.assertEqual(
+            dict(TemporaryStorageQueue.objects.filter(id__in=before).values_list("id", "position")), before
+        )
+        self.assertEqual(self.lane(), ["A", "X", "B", "C"])
+
+    def test_used_up_gap_is_compacted_first(self):
+        TemporaryStorageQueue.objects.filter(id=self.second.id).update(position=self.first.position + 1)
+        position = position_after(self.first)
+        TemporaryStorageQueue.objects.create(temp_first_name="X", position=position)
+        self.assertEqual(self.lane(), ["A", "X", "B", "C"])
+        gap = TemporaryStorageQueue.POSITION_GAP
+        self.assertEqual(
+            list(TemporaryStorageQueue.objects.exclude(temp_first_name="X").order_by("position").values_list("position", flat=True)),
+            [gap, 2 * gap, 3 * gap],
+        )
+
+    def test_nearly_used_gap_schedules_a_compaction(self):
+        TemporaryStorageQueue.objects.filter(id=self.second.id).update(position=self.first.position + 4)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(position_after(self.first), self.first.position + 2)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_compaction_keeps_the_order(self):
+        TemporaryStorageQueue.objects.filter(id=self.third.id).update(position=self.first.position + 1)
+        self.assertEqual(compact_positions(date.today()), 2)
+        gap = TemporaryStorageQueue.POSITION_GAP
+        self.assertEqual(
+            list(TemporaryStorageQueue.objects.order_by("position").values_list("temp_first_name", "position")),
+            [("A", gap), ("C", 2 * gap), ("B", 3 * gap)],
+        )
+        self.assertEqual(compact_positions(date.today()), 0)
+
+
+class StageSnapshotTests(TestCase):
+    def test_three_oldest_per_lane_in_one_query(self):
+        entries = {"Priority": [], "Regular": []}
+        for n in range(24):
+            lane = "Priority" if n % 3 == 0 else "Regular"
+            entry = TemporaryStorageQueue.objects.create(
+                patient=make_patient(n), status="Queued for Treatment", priority_level=lane
+            )
+            entries[lane].append(entry.id)
+        # other stages and other days stay off the board
+        TemporaryStorageQueue.objects.create(temp_first_name="A", status="Queued for Assessment", priority_level="Priority")
+        TemporaryStorageQueue.objects.create(
+            temp_first_name="Y", status="Queued for Treatment", priority_level="Priority",
+            queue_date=date.today() - timedelta(days=1),
+        )
+
+        with self.assertNumQueries(1):
+            snapshot = compute_stage_snapshot("Queued for Treatment")
+        self.assertEqual(sorted(snapshot), sorted(
+            f"{lane}_{slot}" for lane in ("priority", "regular") for slot in ("current", "next1", "next2")
+        ))
+        for lane in ("Priority", "Regular"):
+            slots = [snapshot[f"{lane.lower()}_{slot}"] for slot in ("current", "next1", "next2")]
+            self.assertEqual([e["id"] for e in slots], entries[lane][:3])
+        self.assertEqual(snapshot["priority_current"]["first_name"], "Juan")
+
+    def test_short_lanes_leave_empty_slots(self):
+        entry = TemporaryStorageQueue.objects.create(
+            temp_first_name="A", status="Queued for Assessment", priority_level="Regular"
+        )
+        snapshot = compute_stage_snapshot("Queued for Assessment")
+        self.assertIsNone(snapshot["priority_current"])
+        self.assertEqual(snapshot["regular_current"]["id"], entry.id)
+        # walk-ins without a patient record carry no patient fields
+        self.assertNotIn("first_name", snapshot["regular_current"])
+        self.assertIsNone(snapshot["regular_next1"])
+
+
+class ClaimNextTests(TestCase):
+    def setUp(self):
+        self.regular = TemporaryStorageQueue.objects.create(
+            patient=make_patient(1), status="Queued for Treatment", priority_level="Regular"
+        )
+        self.priority = TemporaryStorageQueue.objects.create(
+            patient=make_patient(2), status="Queued for Treatment", priority_level="Priority"
+        )
+
+    def test_priority_lane_first_then_regular(self):
+        first, second = make_staff(1), make_staff(2)
+        self.assertEqual(claim_next("Queued for Treatment", first), self.priority)
+        self.assertEqual(claim_next("Queued for Treatment", second), self.regular)
+        self.assertIsNone(claim_next("Queued for Treatment", make_staff(3)))
+
+    def test_repeated_call_returns_held_entry(self):
+        doctor = make_staff(1)
+        self.assertEqual(claim_next("Queued for Treatment", doctor), self.priority)
+        self.assertEqual(claim_next("Queued for Treatment", doctor), self.priority)
+
+    def test_claim_cleared_when_status_moves_on(self):
+        doctor = make_staff(1)
+        entry = claim_next("Queued for Treatment", doctor)
+        entry.status = "Completed"
+        entry.save()
+        entry.refresh_from_db()
+        self.assertIsNone(entry.claimed_by)
+        self.assertIsNone(entry.claimed_status)
+
+    @override_settings(QUEUE_CLAIM_TTL=600)
+    def test_abandoned_claim_expires(self):
+        first, second = make_staff(1), make_staff(2)
+        claim_next("Queued for Treatment", first)
+        TemporaryStorageQueue.objects.filter(id=self.priority.id).update(
+            claimed_at=datetime.now(timezone.utc) - timedelta(minutes=11)
+        )
+        self.assertEqual(claim_next("Queued for Treatment", second), self.priority)
+        # the first doctor no longer holds it and moves on
+        self.assertEqual(claim_next("Queued for Treatment", first), self.regular)
+
+    def test_release(self):
+        doctor = make_staff(1)
+        claim_next("Queued for Treatment", doctor)
+        request = APIRequestFactory().post("/queueing/treatment/release/")
+        force_authenticate(request, user=doctor)
+        response = StageRelease.as_view()(request, stage="treatment")
+        self.assertEqual(response.data, {"released": 1})
+        self.assertEqual(claim_next("Queued for Treatment", make_staff(2)), self.priority)
+        self.assertEqual(release_claim("Queued for Treatment", doctor), 0)
+
+    def test_endpoint(self):
+        request = APIRequestFactory().post("/queueing/treatment/next/")
+        force_authenticate(request, user=make_staff(1))
+        response = StageDequeue.as_view()(request, stage="treatment")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], self.priority.id)
+
+        request = APIRequestFactory().post("/queueing/x-ray/next/")
+        force_authenticate(request, user=make_staff(2))
+        self.assertEqual(StageDequeue.as_view()(request, stage="x-ray").status_code, 404)
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serialises writers; run against PostgreSQL")
+class ConcurrentClaimTests(TransactionTestCase):
+    entries = 60
+    doctors = 20
+
+    def setUp(self):
+        for n in range(self.entries):
+            TemporaryStorageQueue.objects.create(
+                temp_first_name=f"P{n}", status="Queued for Assessment",
+                priority_level="Priority" if n % 3 == 0 else "Regular",
+            )
+        self.staff = [make_staff(n) for n in range(self.doctors)]
+
+    def drain(self, doctor):
+        claimed = []
+        try:
+            while True:
+                entry = claim_next("Queued for Assessment", doctor)
+                if entry is None:
+                    return claimed
+                claimed.append(entry.id)
+                # hand the patient on so the next call claims a new one
+                entry.status = "Queued for Treatment"
+                entry.save()
+        finally:
+            connection.close()
+
+    def test_parallel_claims_never_overlap(self):
+        with ThreadPoolExecutor(max_workers=self.doctors) as pool:
+            results = list(pool.map(self.drain, self.staff))
+
+        claimed = [entry_id for ids in results for entry_id in ids]
+        self.assertEqual(len(claimed), self.entries)
+        self.assertEqual(len(set(claimed)), self.entries)
+
+
+class BroadcastDispatcherTests(TestCase):
+    @override_settings(QUEUE_BROADCAST_WINDOW=60)
+    def test_burst_is_sent_once_after_commit(self):
+        dispatcher = BroadcastDispatcher()
+        with mock.patch.object(dispatcher, "_send") as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(5):
+                    dispatcher.notify("registration", "treatment")
+                dispatcher.notify("unknown")
+                send.assert_not_called()
+            dispatcher._timer.cancel()
+            self.assertEqual(dispatcher.flush(), {"registration", "treatment"})
+            send.assert_called_once_with({"registration", "treatment"})
+            self.assertEqual(dispatcher.flush(), set())
+
+
+class QueueTransitionTests(TestCase):
+    def test_status_changes_are_logged(self):
+        doctor = make_staff(1)
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="A")
+        entry = TemporaryStorageQueue.objects.get(id=entry.id)
+        entry.transition_to("Queued for Treatment", doctor)
+        entry.complaint = "Injury"
+        entry.save()
+        entry.transition_to("Completed", doctor)
+
+        log = list(entry.transitions.order_by("id").values_list("from_status", "to_status", "actor"))
+        self.assertEqual(log, [
+            (None, "Waiting", None),
+            ("Waiting", "Queued for Treatment", doctor.id),
+            ("Queued for Treatment", "Completed", doctor.id),
+        ])
+
+    def test_dwell_percentiles_and_throughput(self):
+        day = date(2025, 3, 1)
+        start = datetime(2025, 3, 1, 8, tzinfo=timezone.utc)
+        for n, minutes in enumerate((10, 20, 30, 40)):
+            entry = TemporaryStorageQueue.objects.create(temp_first_name=f"P{n}", queue_date=day)
+            QueueTransition.objects.filter(entry=entry).update(created_at=start)
+            QueueTransition.objects.create(
+                entry=entry, from_status="Waiting", to_status="Completed",
+                queue_date=day, created_at=start + timedelta(minutes=minutes),
+            )
+
+        stats = stage_dwell_times(day, day)
+        self.assertEqual([s["stage"] for s in stats], ["Waiting"])
+        self.assertEqual(stats[0]["count"], 4)
+        self.assertAlmostEqual(stats[0]["p50_seconds"], 25 * 60)
+        self.assertAlmostEqual(stats[0]["p90_seconds"], 37 * 60)
+
+        throughput = {(row["hour"].hour, row["stage"]): row["count"] for row in hourly_throughput(day, day)}
+        self.assertEqual(throughput, {(8, "Waiting"): 4, (8, "Completed"): 4})
+
+
+class ArchiveQueueTests(TestCase):
+    def test_moves_completed_and_past_entries(self):
+        today = date(2025, 3, 2)
+        patient = make_patient(1)
+        old = TemporaryStorageQueue.objects.create(patient=patient, queue_date=date(2025, 3, 1))
+        done = TemporaryStorageQueue.objects.create(patient=patient, queue_date=today, status="Completed")
+        waiting = TemporaryStorageQueue.objects.create(temp_first_name="W", queue_date=today)
+
+        self.assertEqual(archive_queue(before=today, dry_run=True), 2)
+        self.assertEqual(archive_queue(before=today), 2)
+
+        self.assertEqual(list(TemporaryStorageQueue.objects.values_list("id", flat=True)), [waiting.id])
+        archived = ArchivedQueueEntry.objects.get(id=done.id)
+        self.assertEqual((archived.patient, archived.status, archived.queue_number),
+                         (patient, "Completed", done.queue_number))
+        self.assertEqual(
+            sorted(QueueHistory.objects.values_list("id", "is_archived")),
+            sorted([(old.id, True), (done.id, True), (waiting.id, False)]),
+        )
+
+
+    def test_history_reads_include_archived_visits(self):
+        patient = make_patient(1)
+        # SearchPatient formats the date of birth
+        Patient.objects.filter(pk=patient.pk).update(date_of_birth=date(1990, 5, 1))
+        TemporaryStorageQueue.objects.create(patient=patient, status="Completed", complaint="Injury")
+        archive_queue()
+        staff = make_staff(1)
+
+        request = APIRequestFactory().get("/patient/get-queue/", {"patient_id": patient.patient_id})
+        force_authenticate(request, user=staff)
+        self.assertEqual(GetQueue.as_view()(request).data, {"complaint": "Injury"})
+
+        request = APIRequestFactory().get("/patient/search-patients/", {"q": "injur"})
+        force_authenticate(request, user=staff)
+        found = SearchPatient.as_view()(request).data["patients"]
+        self.assertEqual([(p["patient_id"], p["complaint"]) for p in found], [(patient.patient_id, "Injury")])
+
+        # a patient who never queued gets the default instead of an error
+        request = APIRequestFactory().get("/patient/get-queue/", {"patient_id": make_patient(2).patient_id})
+        force_authenticate(request, user=staff)
+        self.assertEqual(GetQueue.as_view()(request).data, {"complaint": "General Illness"})
+
+class CarryOverTests(TestCase):
+    def test_unfinished_entries_move_to_today_in_order(self):
+        yesterday, today = date(2025, 3, 1), date(2025, 3, 2)
+        doctor = make_staff(1)
+        second = TemporaryStorageQueue.objects.create(temp_first_name="B", queue_date=yesterday)
+        first = TemporaryStorageQueue.objects.create(
+            temp_first_name="A", queue_date=yesterday, status="Queued for Treatment",
+            position=second.position - 1, claimed_by=doctor, claimed_status="Queued for Treatment",
+        )
+        done = TemporaryStorageQueue.objects.create(temp_first_name="C", queue_date=yesterday, status="Completed")
+        early = TemporaryStorageQueue.objects.create(temp_first_name="D", queue_date=today)
+
+        self.assertEqual(carry_over_queue(to_day=today, dry_run=True), 2)
+        with mock.patch("queueing.dispatcher.dispatcher") as dispatcher:
+            self.assertEqual(carry_over_queue(to_day=today), 2)
+        dispatcher.notify.assert_called_once()
+
+        rows = TemporaryStorageQueue.objects.filter(queue_date=today).order_by("position")
+        self.assertEqual(
+            list(rows.values_list("id", "queue_number", "position", "claimed_by")),
+            [(early.id, 1, 1024, None), (first.id, 2, 2048, None), (second.id, 3, 3072, None)],
+        )
+        self.assertEqual(TemporaryStorageQueue.objects.get(id=done.id).queue_date, yesterday)
+        self.assertEqual(DailyQueueCounter.objects.get(queue_date=today).last_number, 3)
+        self.assertEqual(TemporaryStorageQueue.objects.create(queue_date=today).queue_number, 4)
+        self.assertEqual(archive_queue(before=today), 1)
+
+    def test_warm_up_creates_counter_row(self):
+        TemporaryStorageQueue.objects.create(temp_first_name="A")
+        self.assertEqual(warm_queue_caches(), 1)
+        self.assertEqual(DailyQueueCounter.objects.get(queue_date=date.today()).last_number, 1)
+
+
+class QueueIndexRebuildTests(TestCase):
+    def test_changes_committed_during_the_read_are_kept(self):
+        index = QueueIndex()
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="A", priority_level="Regular")
+        reads = []
+
+        def waiting_lane(lane, day):
+            # the entry's on_commit lands after the lanes were read
+            if not reads:
+                index.apply(entry.id, index.record_for(entry))
+            reads.append(lane)
+            return []
+
+        with mock.patch("queueing.utils.waiting_lane", waiting_lane):
+            index.rebuild()
+        self.assertEqual([e["id"] for e in index.heads("Regular")], [entry.id])
+
+
+def index_record(entry_id, lane="Regular", position=None):
+    """A queue_index record for a made-up waiting entry."""
+    position = entry_id * 1000 if position is None else position
+    return lane, (position, entry_id, entry_id), {"id": entry_id, "priority_level": lane, "queue_number": entry_id}
+
+
+class QueueDeltaTests(TestCase):
+    def test_diff_snapshots(self):
+        a, b, c = ({"id": n, "queue_number": n} for n in (1, 2, 3))
+        old = {"regular_current": a, "regular_next1": b, "regular_next2": c}
+        new = {"regular_current": b, "regular_next1": {**c, "complaint": "Injury"}, "regular_next2": None,
+               "priority_current": {"id": 4}}
+        self.assertEqual(diff_snapshots(old, new, statuses={1: "Queued for Assessment"}), [
+            {"op": "moved", "id": 2, "slot": "regular_current", "from": "regular_next1"},
+            {"op": "moved", "id": 3, "slot": "regular_next1", "from": "regular_next2",
+             "entry": {**c, "complaint": "Injury"}},
+            {"op": "added", "slot": "priority_current", "entry": {"id": 4}},
+            {"op": "status_changed", "id": 1, "from": "regular_current", "status": "Queued for Assessment"},
+        ])
+        self.assertEqual(diff_snapshots(new, {**new, "priority_current": None}), [
+            {"op": "removed", "id": 4, "from": "priority_current"},
+        ])
+        self.assertEqual(diff_snapshots(old, {**old, "regular_current": {**a, "complaint": "Injury"}}), [
+            {"op": "updated", "slot": "regular_current", "entry": {**a, "complaint": "Injury"}},
+        ])
+
+    def test_deltas_since(self):
+        index = QueueIndex()
+        index.rebuild()
+        for n in (1, 2, 3):
+            index.apply(n, index_record(n))
+        self.assertEqual(index.version, 3)
+        self.assertEqual([v for v, _ in index.deltas_since(1, index.epoch)], [2, 3])
+        self.assertEqual(index.deltas_since(3, index.epoch), [])
+        # another process or a restart, or a version from the future
+        self.assertIsNone(index.deltas_since(1, "another-epoch"))
+        self.assertIsNone(index.deltas_since(4, index.epoch))
+        # a change past the three visible slots is not a version
+        index.apply(4, index_record(4))
+        self.assertEqual(index.version, 3)
+
+    @override_settings(QUEUE_DELTA_BUFFER=2)
+    def test_evicted_deltas_need_a_snapshot(self):
+        index = QueueIndex()
+        index.rebuild()
+        for n in (1, 2, 3):
+            index.apply(n, index_record(n))
+        self.assertEqual([v for v, _ in index.deltas_since(1, index.epoch)], [2, 3])
+        self.assertIsNone(index.deltas_since(0, index.epoch))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class RegistrationConsumerResumeTests(TestCase):
+    def setUp(self):
+        self.index = QueueIndex()
+        self.index.rebuild()
+        for n in (1, 2):
+            self.index.apply(n, index_record(n))
+        patcher = mock.patch("queueing.consumers.queue_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def resume(self, since, epoch):
+        from .routing import websocket_urlpatterns
+
+        async def run():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/queue/registration/?since={since}&epoch={epoch}"
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            first = await communicator.receive_json_from()
+            # a change while connected arrives as a delta
+            self.index.apply(3, index_record(3))
+            version, snapshot = self.index.versioned_snapshot()
+            await get_channel_layer().group_send("registration_queue", {
+                "type": "queue_update", "version": version, "epoch": self.index.epoch,
+                **registration_snapshot_texts(version, self.index.epoch, snapshot),
+            })
+            live = await communicator.receive_json_from()
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return first, live
+
+        return asyncio.run(run())
+
+    def test_replays_missed_deltas(self):
+        first, live = self.resume(1, self.index.epoch)
+        self.assertEqual((first["type"], first["version"]), ("delta", 2))
+        self.assertEqual(first["changes"], [{"op": "added", "slot": "regular_next1", "entry": index_record(2)[2]}])
+        self.assertEqual((live["type"], live["version"]), ("delta", 3))
+
+    def test_unknown_epoch_gets_a_snapshot(self):
+        first, live = self.resume(1, "before-restart")
+        self.assertEqual((first["type"], first["version"], first["epoch"]), ("snapshot", 2, self.index.epoch))
+        self.assertEqual([first["data"][slot]["id"] for slot in ("regular_current", "regular_next1")], [1, 2])
+        self.assertEqual((live["type"], live["version"]), ("delta", 3))
+
+    @override_settings(QUEUE_DELTA_BUFFER=1)
+    def test_evicted_versions_get_a_snapshot(self):
+        # rebuilt with a one-delta buffer: version 1 is gone by version 2
+        self.index = QueueIndex()
+        self.index.rebuild()
+        for n in (1, 2):
+            self.index.apply(n, index_record(n))
+        with mock.patch("queueing.consumers.queue_index", self.index):
+            first, live = self.resume(0, self.index.epoch)
+        self.assertEqual((first["type"], first["version"]), ("snapshot", 2))
+        self.assertEqual((live["type"], live["version"]), ("delta", 3))
+
+
+def fake_topic_event(topic, version=0):
+    """A topic_event() stand-in that does not read the database."""
+    if topic == "registration":
+        return {"type": "queue_update", "version": version, "epoch": "test",
+                **registration_snapshot_texts(version, "test", {"board": topic})}
+    return {"type": "stage_update", "topic": topic,
+            "topic_text": wrap_encoded(f'{{"board": "{topic}", "n": {version}}}', type="snapshot", topic=topic)}
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class QueueTopicsConsumerTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("queueing.consumers.topic_event", fake_topic_event)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_client(self, path, script):
+        from .routing import websocket_urlpatterns
+
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            try:
+                await script(communicator, get_channel_layer())
+            finally:
+                await communicator.disconnect()
+
+        asyncio.run(run())
+
+    def test_subscribe_unsubscribe_and_errors(self):
+        async def script(ws, layer):
+            self.assertEqual(await ws.receive_json_from(), {"type": "snapshot", "topic": "assessment",
+                                                            "data": {"board": "assessment", "n": 0}})
+            await ws.send_json_to({"action": "subscribe", "topics": ["lab", "x-ray"]})
+            self.assertEqual(await ws.receive_json_from(), {"type": "error", "error": "Unknown topics: ['x-ray']"})
+            self.assertEqual((await ws.receive_json_from())["topic"], "lab")
+
+            # only subscribed boards are delivered
+            await layer.group_send("treatment_queue", fake_topic_event("treatment", 1))
+            await layer.group_send("lab_queue", fake_topic_event("lab", 1))
+            self.assertEqual((await ws.receive_json_from())["data"], {"board": "lab", "n": 1})
+            self.assertTrue(await ws.receive_nothing())
+
+            await ws.send_json_to({"action": "unsubscribe", "topics": ["lab"]})
+            await ws.send_json_to({"action": "list"})
+            self.assertEqual(await ws.receive_json_from(), {"type": "error", "error": "Unknown action"})
+            await layer.group_send("lab_queue", fake_topic_event("lab", 2))
+            await layer.group_send("assessment_queue", fake_topic_event("assessment", 2))
+            self.assertEqual((await ws.receive_json_from())["data"], {"board": "assessment", "n": 2})
+
+            await ws.send_to(text_data="{not json")
+            self.assertEqual(await ws.receive_json_from(), {"type": "error", "error": "Invalid JSON"})
+            self.assertTrue(await ws.receive_nothing())
+
+        self.run_client("/ws/queue/assessment/", script)
+
+    def test_registration_skips_older_versions(self):
+        async def script(ws, layer):
+            self.assertEqual((await ws.receive_json_from())["version"], 0)
+            await layer.group_send("registration_queue", fake_topic_event("registration", 5))
+            self.assertEqual((await ws.receive_json_from())["version"], 5)
+            # a late event from before version 5
+            await layer.group_send("registration_queue", fake_topic_event("registration", 4))
+            self.assertTrue(await ws.receive_nothing())
+
+        self.run_client("/ws/queue/?topics=registration", script)
+
+
+class RegistrationPayloadTests(TestCase):
+    def tearDown(self):
+        queue_index.invalidate()
+
+    def test_broadcasts_carry_wait_estimates(self):
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="A", priority_level="Regular")
+        queue_index.rebuild()
+        event = queue_update_event()
+        for text in (event["text"], event["topic_text"], event["snapshot_text"]):
+            message = json.loads(text)
+            data = message.get("data", message)
+            self.assertEqual(data["regular_current"]["id"], entry.id)
+            self.assertIn("estimated_wait_seconds", data["regular_current"])
+
+        # versioned clients get the estimates with each delta
+        second = TemporaryStorageQueue.objects.create(temp_first_name="B", priority_level="Regular")
+        queue_index.apply(second.id, queue_index.record_for(second))
+        _, delta = queue_index.deltas_since(queue_index.version - 1, queue_index.epoch)[0]
+        estimates = json.loads(delta)["wait_estimates"]
+        self.assertIsInstance(estimates["regular_next1"], int)
+        self.assertIsNone(estimates["priority_current"])
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class RegistrationConsumerResendTests(TestCase):
+    def test_equal_version_is_resent_older_is_dropped(self):
+        from .routing import websocket_urlpatterns
+
+        def event(version, seconds):
+            snapshot = {"regular_current": {"id": 1, "estimated_wait_seconds": seconds}}
+            return {"type": "queue_update", "version": version, "epoch": "test",
+                    **registration_snapshot_texts(version, "test", snapshot)}
+
+        async def run():
+            ws = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/queue/registration/")
+            await ws.connect()
+            layer = get_channel_layer()
+            received = []
+            for version, seconds in ((3, 600), (3, 540)):
+                await layer.group_send("registration_queue", event(version, seconds))
+                received.append(await ws.receive_json_from())
+            await layer.group_send("registration_queue", event(2, 900))
+            self.assertTrue(await ws.receive_nothing())
+            await ws.disconnect()
+            return received
+
+        received = asyncio.run(run())
+        self.assertEqual([r["regular_current"]["estimated_wait_seconds"] for r in received], [600, 540])
+
+
+class QueueIndexCheckTests(TestCase):
+    def tearDown(self):
+        queue_index.invalidate()
+
+    def check(self, **params):
+        request = APIRequestFactory().get("/queueing/registration_queueing/index-check/", params)
+        force_authenticate(request, user=self.secretary)
+        return QueueIndexCheck.as_view()(request).data
+
+    def test_reports_drift_until_rebuilt(self):
+        self.secretary = make_staff(1, role="secretary")
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="A", priority_level="Regular")
+        queue_index.rebuild()
+        self.assertEqual(self.check(), {"consistent": True, "mismatches": {}})
+
+        # the index loses the entry behind the database's back
+        queue_index.discard(entry.id)
+        data = self.check(rebuild="1")
+        self.assertFalse(data["consistent"])
+        self.assertEqual(data["mismatches"]["regular_current"]["index"], None)
+        self.assertEqual(data["mismatches"]["regular_current"]["database"]["id"], entry.id)
+
+        self.assertEqual(self.check(), {"consistent": True, "mismatches": {}})
+
+
+@skipIf(connection.vendor != "postgresql", "query plans are checked against PostgreSQL")
+class QueueIndexPlanTests(TestCase):
+    """
+    Runs the hot queue queries, then EXPLAINs each one with sequential scans
+    disabled. Every scan of the queue table must be narrowed by an index
+    condition: a sequential scan, or an index walked end to end only for its
+    order, means no index fits the filter.
+    """
+    table = TemporaryStorageQueue._meta.db_table
+
+    def setUp(self):
+        self.patient = make_patient(1)
+        for n in range(20):
+            TemporaryStorageQueue.objects.create(
+                temp_first_name=f"P{n}",
+                priority_level="Priority" if n % 4 == 0 else "Regular",
+                status=("Waiting", "Queued for Assessment", "Queued for Treatment")[n % 3],
+            )
+        self.entry = TemporaryStorageQueue.objects.create(patient=self.patient)
+
+    def assert_indexed(self, run):
+        with CaptureQueriesContext(connection) as captured:
+            run()
+        # QueueHistory reads expand to the queue table through the view
+        tables = (self.table, QueueHistory._meta.db_table)
+        queries = [q["sql"] for q in captured.captured_queries
+                   if q["sql"].startswith("SELECT") and any(t in q["sql"] for t in tables)]
+        self.assertTrue(queries)
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                for sql in queries:
+                    cursor.execute("EXPLAIN " + sql)
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                    self.assertNotIn(f"Seq Scan on {self.table}", plan, f"{sql}\n{plan}")
+                    self.assert_scans_use_index_conditions(plan, sql)
+            finally:
+                cursor.execute("RESET enable_seqscan")
+
+    def assert_scans_use_index_conditions(self, plan, sql):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, self.table)
+        leading = {name: c["columns"][0] for name, c in constraints.items() if c["index"] and c["columns"]}
+
+        lines = plan.splitlines()
+        for i, line in enumerate(lines):
+            match = re.search(r"Index (?:Only )?Scan (?:Backward )?(?:using|on) (\S+)", line)
+            if f" on {self.table}" not in line and not (match and match.group(1) in leading):
+                continue
+            if "Bitmap Heap Scan" in line:
+                # checked through its Bitmap Index Scan child
+                continue
+            self.assertTrue(match and match.group(1) in leading, f"{sql}\n{plan}")
+            conditions = []
+            for detail in lines[i + 1:]:
+                if "->" in detail:
+                    break
+                if "Index Cond" in detail:
+                    conditions.append(detail)
+            # the index must be entered through its first column
+            self.assertTrue(
+                any(leading[match.group(1)] in c for c in conditions),
+                f"{sql}\n{plan}",
+            )
+
+    def test_waiting_lanes(self):
+        self.assert_indexed(compute_queue_snapshot_from_db)
+
+    def test_stage_board(self):
+        self.assert_indexed(lambda: compute_stage_snapshot("Queued for Treatment"))
+
+    def test_call_next_candidates(self):
+        self.assert_indexed(lambda: stage_candidates("Queued for Assessment").first())
+
+    def test_insert_behind_head(self):
+        self.assert_indexed(lambda: position_after(self.entry))
+
+    def test_patient_latest_visit(self):
+        def run():
+            request = APIRequestFactory().get("/patient/get-queue/", {"patient_id": self.patient.patient_id})
+            force_authenticate(request, user=make_staff(1))
+            GetQueue.as_view()(request)
+        self.assert_indexed(run)
+
+
+@override_settings(QUEUE_WAIT_ALPHA=0.5, QUEUE_WAIT_DEFAULT_SECONDS=600, QUEUE_WAIT_MAX_INTERVAL=3600)
+class WaitTimeEstimatorTests(TestCase):
+    def test_service_interval_starts_at_later_of_arrival_and_previous_departure(self):
+        estimator = WaitTimeEstimator()
+        t0 = datetime.now(timezone.utc)
+        for n in range(3):
+            estimator.observe(n, "Regular", None, "Waiting", t0)
+        # served one after another, 4, 6 and 8 minutes apart
+        estimator.observe(0, "Regular", "Waiting", "Queued for Treatment", t0 + timedelta(minutes=4))
+        estimator.observe(1, "Regular", "Waiting", "Queued for Treatment", t0 + timedelta(minutes=10))
+        self.assertEqual(estimator.service_seconds("Waiting", "Regular"), (300, 2))
+
+        # an idle gap does not count: entry 3 arrives long after the last departure
+        estimator.observe(2, "Regular", "Waiting", "Queued for Treatment", t0 + timedelta(minutes=15))
+        estimator.observe(3, "Regular", None, "Waiting", t0 + timedelta(minutes=50))
+        estimator.observe(3, "Regular", "Waiting", "Queued for Treatment", t0 + timedelta(minutes=55))
+        self.assertEqual(estimator.service_seconds("Waiting", "Regular"), (300, 4))
+
+    def test_estimate_counts_entries_ahead(self):
+        estimator = WaitTimeEstimator()
+        now = datetime.now(timezone.utc)
+        self.assertEqual(estimator.estimate("Waiting", "Priority", 0, now), 600)
+        self.assertEqual(estimator.estimate("Waiting", "Priority", 2, now), 1800)
+
+        estimator.observe(1, "Priority", None, "Waiting", now - timedelta(minutes=20))
+        estimator.observe(1, "Priority", "Waiting", "Completed", now - timedelta(minutes=10))
+        # mean is 10 minutes and the last departure was 4 minutes ago
+        self.assertEqual(estimator.estimate("Waiting", "Priority", 1, now + timedelta(minutes=-6)), 600 + 360)
+
+
+class PublicQueueBroadcasterTests(TestCase):
+    def test_publish_from_another_thread_reaches_streams_once(self):
+        broadcaster = PublicQueueBroadcaster()
+        data = {"priority_current": 4, "regular_current": 7}
+
+        async def run():
+            first, second = broadcaster.subscribe(), broadcaster.subscribe()
+            for _ in range(2):
+                # the second publish is unchanged and is dropped
+                thread = threading.Thread(target=broadcaster.publish, args=(3, data))
+                thread.start()
+                thread.join()
+            frames = [await asyncio.wait_for(q.get(), 1) for q in (first, second)]
+            self.assertTrue(first.empty() and second.empty())
+            broadcaster.unsubscribe(first)
+            broadcaster.unsubscribe(second)
+            return frames
+
+        frames = asyncio.run(run())
+        self.assertEqual(frames[0], frames[1])
+        self.assertEqual(frames[0], b'id: 3\nevent: snapshot\ndata: {"priority_current": 4, "regular_current": 7}\n\n')
+        self.assertEqual(broadcaster.subscriber_count, 0)
+
+
+class BufferedSocket:
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        pass
+
+
+class SlowClient(LatestOnlySenderMixin, BufferedSocket):
+    """Consumer stand-in whose socket writes block until `gate` is set."""
+
+    channel_name = "test.slow"
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.delivered = []
+        self.closed = None
+
+    async def deliver(self, key, event):
+        await self.gate.wait()
+        self.delivered.append((key, event["version"]))
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+class LatestOnlySenderTests(TestCase):
+    def test_slow_client_only_gets_latest_update_per_topic(self):
+        async def run():
+            client = SlowClient()
+            client.start_writer()
+            await client.enqueue("registration", {"version": 1})
+            await asyncio.sleep(0)  # writer picks up version 1 and blocks
+            for version in range(2, 6):
+                await client.enqueue("registration", {"version": version})
+            await client.enqueue("lab", {"version": 0})
+            stats = dict(connection_registry.snapshot()[0])
+            client.gate.set()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            client.stop_writer()
+            return client, stats
+
+        client, stats = asyncio.run(run())
+        self.assertEqual(client.delivered, [("registration", 1), ("registration", 5), ("lab", 0)])
+        self.assertEqual(stats["superseded"], 3)
+        self.assertEqual(stats["pending"], 2)
+        self.assertIsNone(client.closed)
+        self.assertEqual(client.stats.behind, 0)
+        self.assertEqual(connection_registry.snapshot(), [])
+
+    @override_settings(QUEUE_WS_MAX_BEHIND=3)
+    def test_client_too_far_behind_is_disconnected(self):
+        async def run():
+            client = SlowClient()
+            client.start_writer()
+            await client.enqueue("registration", {"version": 1})
+            await asyncio.sleep(0)
+            for version in range(2, 7):
+                await client.enqueue("registration", {"version": version})
+            client.stop_writer()
+            return client
+
+        client = asyncio.run(run())
+        self.assertEqual(client.closed, 4008)
+        self.assertTrue(client.stats.disconnected_slow)
+
+
+    @override_settings(QUEUE_WS_MAX_BEHIND=3, QUEUE_WS_ACK_WINDOW=2)
+    def test_client_that_stops_acking_is_held_back_and_disconnected(self):
+        async def run():
+            client = SlowClient()
+            # sends return at once, like a server buffering the frames
+            client.gate.set()
+            client.start_writer()
+            await client.acknowledge(0)
+
+            async def deliver(key, event):
+                await client.send(text_data="x")
+                client.delivered.append((key, event["version"]))
+            client.deliver = deliver
+            for version in range(1, 4):
+                await client.enqueue("registration", {"version": version})
+                await asyncio.sleep(0)
+            held = list(client.delivered)
+            await client.acknowledge(2)
+            for _ in range(3):
+                await asyncio.sleep(0)
+            after_ack = list(client.delivered)
+            for version in range(4, 10):
+                await client.enqueue("registration", {"version": version})
+            client.stop_writer()
+            return client, held, after_ack
+
+        client, held, after_ack = asyncio.run(run())
+        # two sends fill the window; the third waits for an ack
+        self.assertEqual(held, [("registration", 1), ("registration", 2)])
+        self.assertEqual(after_ack[-1], ("registration", 3))
+        self.assertEqual(client.closed, 4008)
+        self.assertEqual(client.stats.unacked, 1)
+
+
+class LaneRankTests(TestCase):
+    def setUp(self):
+        lanes = ["Regular", "Priority", "Regular", "Regular", "Priority"]
+        self.entries = [
+            TemporaryStorageQueue.objects.create(temp_first_name=f"P{n}", status="Waiting", priority_level=lane)
+            for n, lane in enumerate(lanes)
+        ]
+        # move the last regular entry to the front of its lane
+        last = self.entries[3]
+        last.position = self.entries[0].position - 1
+        last.save()
+        TemporaryStorageQueue.objects.create(temp_first_name="Done", status="Completed", priority_level="Regular")
+
+    def test_serializer_ranks_in_lane_order(self):
+        waiting = TemporaryStorageQueue.objects.filter(status="Waiting").order_by("id")
+        data = TemporaryStorageQueueSerializer(waiting, many=True).data
+        ranks = {row["id"]: row["queue_number"] for row in data}
+        e = self.entries
+        self.assertEqual(ranks, {e[0].id: "#2", e[1].id: "#1", e[2].id: "#3", e[3].id: "#1", e[4].id: "#2"})
+
+    def test_lane_listing_is_one_query(self):
+        for n in range(8):
+            TemporaryStorageQueue.objects.create(patient=make_patient(n), status="Waiting", priority_level="Regular")
+        with self.assertNumQueries(1):
+            data = TemporaryStorageQueueSerializer(waiting_lane("Regular"), many=True).data
+        self.assertEqual([row["queue_number"] for row in data], [f"#{n}" for n in range(1, 12)])
+        self.assertEqual(data[-1]["age"], None)
+
+    def test_count_fallback_matches_window_rank(self):
+        for entry in with_lane_rank(TemporaryStorageQueue.objects.filter(status="Waiting")):
+            self.assertEqual(lane_position(entry), entry.lane_rank)
+        completed = TemporaryStorageQueue.objects.get(status="Completed")
+        self.assertEqual(TemporaryStorageQueueSerializer(completed).data["queue_number"], "N/A")
+
+    def test_patient_position_endpoint(self):
+        patient = make_patient(1)
+        entry = TemporaryStorageQueue.objects.create(patient=patient, status="Waiting", priority_level="Priority")
+        request = APIRequestFactory().get("/queueing/my-position/")
+        force_authenticate(request, user=patient.user)
+        response = PatientQueuePosition.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["queue_entry_id"], entry.id)
+        self.assertEqual(response.data["position"], 3)
+        self.assertEqual(response.data["ahead"], 2)
+
+        request = APIRequestFactory().get("/queueing/my-position/")
+        force_authenticate(request, user=make_patient(2).user)
+        self.assertEqual(PatientQueuePosition.as_view()(request).status_code, 404)
+
+
+class BulkAcceptTests(TestCase):
+    def post(self, transitions, user):
+        request = APIRequestFactory().post("/patient/update-status/bulk/", {"transitions": transitions}, format="json")
+        force_authenticate(request, user=user)
+        return BulkAcceptButton.as_view()(request)
+
+    def test_batch_is_applied_and_broadcast_once(self):
+        secretary = make_staff(1, role="secretary")
+        known = TemporaryStorageQueue.objects.create(patient=make_patient(1))
+        new = [
+            TemporaryStorageQueue.objects.create(
+                temp_first_name="Ana", temp_last_name=f"Reyes{n}", temp_email=f"ana{n}@example.com",
+                temp_phone_number="09170000000", temp_date_of_birth=date(1990, 5, n + 1), is_new_patient=True,
+            )
+            for n in range(2)
+        ]
+        with mock.patch("patient.views.broadcast_status_change") as broadcast:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post([
+                    {"queue_entry_id": known.id, "action": "treatment"},
+                    {"queue_entry_id": new[0].id, "action": "preliminary"},
+                    {"queue_entry_id": str(new[1].id), "action": "lab"},
+                ], secretary)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["patients_created"], 2)
+        broadcast.assert_called_once()
+        self.assertEqual(
+            set(broadcast.call_args.args),
+            {"Waiting", "Queued for Treatment", "Queued for Assessment", "Ongoing for Laboratory"},
+        )
+        statuses = dict(TemporaryStorageQueue.objects.values_list("id", "status"))
+        self.assertEqual(statuses[known.id], "Queued for Treatment")
+        self.assertEqual(statuses[new[1].id], "Ongoing for Laboratory")
+
+        entry = TemporaryStorageQueue.objects.select_related("patient__user").get(id=new[0].id)
+        self.assertFalse(entry.is_new_patient)
+        self.assertEqual(entry.patient.user.email, "ana0@example.com")
+        self.assertEqual(entry.patient.role_id, entry.patient.user.id)
+        self.assertTrue(entry.patient.user.check_password(f"{entry.patient_id}19900501"))
+        self.assertEqual(
+            QueueTransition.objects.filter(to_status="Queued for Assessment", entry=entry).values_list("actor", flat=True).get(),
+            secretary.id,
+        )
+
+    def test_invalid_item_rejects_whole_batch(self):
+        secretary = make_staff(1, role="secretary")
+        entry = TemporaryStorageQueue.objects.create(temp_first_name="A", temp_email="a@example.com", is_new_patient=True)
+        response = self.post([
+            {"queue_entry_id": entry.id, "action": "preliminary"},
+            {"queue_entry_id": "abc", "action": "lab"},
+        ], secretary)
+        self.assertEqual(response.status_code, 400)
+        # a new patient without a birth date cannot get a password
+        response = self.post([{"queue_entry_id": entry.id, "action": "preliminary"}], secretary)
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"queue_entry_id": entry.id + 100, "action": "preliminary"}], secretary)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(TemporaryStorageQueue.objects.get(id=entry.id).status, "Waiting")
+
+    def test_unchanged_status_is_not_a_transition(self):
+        moved = TemporaryStorageQueue.objects.create(patient=make_patient(1))
+        kept = TemporaryStorageQueue.objects.create(patient=make_patient(2), status="Queued for Treatment")
+        QueueTransition.objects.all().delete()
+        with mock.patch("queueing.wait_time.wait_estimator.observe") as observe:
+            with self.captureOnCommitCallbacks(execute=True):
+                bulk_transition([(moved, "Queued for Treatment"), (kept, "Queued for Treatment")])
+        self.assertEqual(list(QueueTransition.objects.values_list("entry", flat=True)), [moved.id])
+        self.assertEqual([call.args[0] for call in observe.call_args_list], [moved.id])
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    def test_small_run_reports_summary(self):
+        # the test runner's database stands in for the command's throwaway one
+        creation = connection.creation
+        out = StringIO()
+        with mock.patch.object(creation, "create_test_db", return_value=connection.settings_dict["NAME"]), \
+                mock.patch.object(creation, "destroy_test_db"), \
+                mock.patch.object(logging.getLogger("asyncio"), "disabled", True):
+            call_command(
+                "load_test_queue", "--secretaries", "1", "--doctors", "1", "--listeners", "1",
+                "--patients", "2", "--noinput", stdout=out,
+            )
+            # the command's leftover disconnect listeners are reported when collected
+            gc.collect()
+        output = out.getvalue()
+        self.assertIn("1 secretaries, 1 doctors, 1 listeners", output)
+        self.assertIn("register", output)
+        self.assertIn("duplicate queue numbers 0", output)
+        self.assertEqual(TemporaryStorageQueue.objects.count(), 2)
+        self.assertIn(", 0 duplicate queue numbers", output)
+
+
+class QueueSimulationTests(TestCase):
+    def setUp(self):
+        self.days = [date(2025, 3, 1), date(2025, 3, 2)]
+        for day in self.days:
+            for n in range(12):
+                at = datetime(day.year, day.month, day.day, 8 + n % 4, 5 * n, tzinfo=timezone.utc)
+                entry = TemporaryStorageQueue.objects.create(
+                    temp_first_name=f"P{n}", queue_date=day,
+                    priority_level="Priority" if n % 3 == 0 else "Regular",
+                    complaint="Injury" if n % 2 else "Check-up",
+                )
+                TemporaryStorageQueue.objects.filter(id=entry.id).update(created_at=at)
+                stages = ["Queued for Treatment", "Ongoing for Treatment", "Completed"]
+                if n % 2:
+                    stages.insert(0, "Ongoing for Laboratory")
+                for minutes, stage in enumerate(stages, start=1):
+                    QueueTransition.objects.create(
+                        entry=entry, from_status="Waiting", to_status=stage,
+                        queue_date=day, created_at=at + timedelta(minutes=20 * minutes),
+                    )
+
+    def test_profile_from_history(self):
+        profile = historical_profile(*self.days)
+        self.assertEqual(profile["days"], 2)
+        self.assertAlmostEqual(profile["rates"].sum(), 12)
+        self.assertEqual(profile["rates"][:, 8:12].sum(), profile["rates"].sum())
+        self.assertEqual(profile["complaints"], ["Check-up", "Injury"])
+        # injuries went through the lab, nobody was assessed
+        self.assertEqual(profile["routing"].tolist(), [[0.0, 0.0, 1.0], [0.0, 1.0, 1.0]])
+        self.assertAlmostEqual(profile["service_minutes"]["treatment"], 20)
+        with self.assertRaises(ValueError):
+            historical_profile(date(2024, 1, 1), date(2024, 1, 2))
+
+    def test_more_doctors_shorten_waits(self):
+        profile = historical_profile(*self.days)
+        short = simulate(profile, {"assessment": 1, "lab": 1, "treatment": 1}, days=30, seed=7)
+        staffed = simulate(profile, {"assessment": 1, "lab": 1, "treatment": 3}, days=30, seed=7)
+        self.assertEqual(short["patients"], staffed["patients"])
+        self.assertGreater(short["patients"], 0)
+        self.assertEqual(short["stages"]["assessment"]["wait_minutes"]["Regular"]["count"], 0)
+        treatment = [r["stages"]["treatment"] for r in (short, staffed)]
+        self.assertLess(treatment[1]["wait_minutes"]["Regular"]["mean"], treatment[0]["wait_minutes"]["Regular"]["mean"])
+        self.assertLess(treatment[1]["utilization"], treatment[0]["utilization"])
+        self.assertLessEqual(treatment[0]["utilization"], 1)
+
+    def test_command_tries_every_staffing(self):
+        out = StringIO()
+        call_command(
+            "simulate_queue", "--start", "2025-03-01", "--end", "2025-03-02",
+            "--treatment", "1,2", "--days", "5", "--seed", "1", stdout=out,
+        )
+        self.assertIn("assessment 1, lab 1, treatment 2", out.getvalue())
+        self.assertIn("2 scenario(s) simulated", out.getvalue())
@@ -5,8 +5,17 @@ app_name = 'queueing'
 
 urlpatterns = [
     path('queueing/registration_queueing/', views.PatientRegistrationQueue.as_view(), name='registration_queueing'),
+    path('queueing/registration_queueing/index-check/', views.QueueIndexCheck.as_view(), name='registration_queueing_index_check'),
+    path('queueing/registration_queueing/stream/', views.public_registration_stream, name='registration_queueing_stream'),
     path('queueing/preliminary_assessment_queueing/', views.PreliminaryAssessmentQueue.as_view(), name='preliminary_assessment_queueing'),
     path('queueing/treatment_queueing/', views.PatientTreatmentQueue.as_view(), name='treatment_queueing'),
+    path('queueing/<str:stage>/next/', views.StageDequeue.as_view(), name='stage_dequeue'),
+    path('queueing/<str:stage>/release/', views.StageRelease.as_view(), name='stage_release'),
+    path('queueing/analytics/stages/', views.QueueStageAnalytics.as_view(), name='stage_analytics'),
+    path('queueing/wait-times/', views.QueueWaitTimes.as_view(), name='wait_times'),
+    path('queueing/connections/', views.QueueConnectionStats.as_view(), name='connection_stats'),
+    path('queueing/my-position/', views.PatientQueuePosition.as_view(), name='my_position'),
+    path('queueing/carry-over/', views.QueueCarryOver.as_view(), name='carry_over'),
 
     path('queueing/patient-preliminary-assessment/<str:patient_id>/<str:queue_number>/', 
         views.PreliminaryAssessmentForm.as_view(), 
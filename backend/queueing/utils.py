@@ -1,83 +1,544 @@
+import json
+import threading
 from .models import TemporaryStorageQueue
-from django.utils.timezone import localdate
-from datetime import date
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils.timezone import localdate, now
+from datetime import date, timedelta
+from rest_framework.utils.encoders import JSONEncoder
 
-def compute_queue_snapshot():
-    today = localdate()
-    priority = TemporaryStorageQueue.objects.filter(
-        status="Waiting",
-        priority_level="Priority",
-        created_at__date=today
-    ).order_by("position", "queue_number")
-    regular = TemporaryStorageQueue.objects.filter(
+SNAPSHOT_SLOTS = ("current", "next1", "next2")
+LANE_ORDERING = ("position", "queue_number", "id")
+
+
+def waiting_lane(priority_level, day=None):
+    """
+    Waiting entries of one lane for `day` (default today), head first, each
+    with its `lane_rank`, so serializing the lane is a single query.
+    """
+    return with_lane_rank(TemporaryStorageQueue.objects.select_related(
+        "user__patient_profile", "patient"
+    ).filter(
         status="Waiting",
-        priority_level="Regular",
-        created_at__date=today
-    ).order_by("position", "queue_number")
-
-    def get_next(qs):
-        lst = list(qs)
-        return (
-            lst[0] if len(lst) > 0 else None,
-            lst[1] if len(lst) > 1 else None,
-            lst[2] if len(lst) > 2 else None,
+        priority_level=priority_level,
+        queue_date=day or localdate()
+    )).order_by(*LANE_ORDERING)
+
+
+def with_lane_rank(queryset):
+    """
+    Annotate `lane_rank`, the 1-based place of each entry in its day's lane,
+    computed by the database in the same query. Rank a queryset of waiting
+    entries: the rows filtered out before the window are not counted.
+    """
+    return queryset.annotate(
+        lane_rank=Window(
+            RowNumber(),
+            partition_by=[F("queue_date"), F("priority_level")],
+            order_by=[F(field).asc() for field in LANE_ORDERING],
         )
+    )
 
-    def fmt(q):
-        if not q:
-            return None
-        if q.user and hasattr(q.user, "patient_profile"):
-            patient = q.user.patient_profile
-            first_name = patient.first_name
-            last_name = patient.last_name
-            phone = patient.phone_number
-            dob = patient.date_of_birth
-            pid = patient.patient_id
-        else:
-            first_name = q.temp_first_name
-            last_name = q.temp_last_name
-            phone = q.temp_phone_number
-            dob = q.temp_date_of_birth
-            pid = None
-
-        # compute age
-        if dob:
-            try:
-                dob_date = date.fromisoformat(str(dob))
-                today0 = date.today()
-                age = today0.year - dob_date.year - (
-                    (today0.month, today0.day) < (dob_date.month, dob_date.day)
-                )
-            except Exception:
-                age = None
-        else:
+
+def lane_position(entry):
+    """Place of one waiting entry in its lane, counted with one indexed query."""
+    ahead = TemporaryStorageQueue.objects.filter(
+        status="Waiting",
+        queue_date=entry.queue_date,
+        priority_level=entry.priority_level,
+    ).filter(
+        Q(position__lt=entry.position)
+        | Q(position=entry.position, queue_number__lt=entry.queue_number)
+        | Q(position=entry.position, queue_number=entry.queue_number, id__lt=entry.id)
+    ).count()
+    return ahead + 1
+
+
+def format_queue_entry(q):
+    if not q:
+        return None
+    if q.user and hasattr(q.user, "patient_profile"):
+        patient = q.user.patient_profile
+        first_name = patient.first_name
+        last_name = patient.last_name
+        phone = patient.phone_number
+        dob = patient.date_of_birth
+        pid = patient.patient_id
+    else:
+        first_name = q.temp_first_name
+        last_name = q.temp_last_name
+        phone = q.temp_phone_number
+        dob = q.temp_date_of_birth
+        pid = None
+
+    # compute age
+    if dob:
+        try:
+            dob_date = date.fromisoformat(str(dob))
+            today0 = date.today()
+            age = today0.year - dob_date.year - (
+                (today0.month, today0.day) < (dob_date.month, dob_date.day)
+            )
+        except Exception:
             age = None
+    else:
+        age = None
+
+    return {
+        "id": q.id,
+        "patient_id": pid,
+        "first_name": first_name,
+        "last_name": last_name,
+        "phone_number": phone,
+        "date_of_birth": dob,
+        "age": age,
+        "priority_level": q.priority_level,
+        "complaint": q.complaint,
+        "status": q.status,
+        "queue_number": q.queue_number,
+        "position": q.position,
+        "created_at": q.created_at,
+        "is_new_patient": not q.user,
+    }
+
+
+def snapshot_from_heads(priority, regular):
+    """Build the six-slot snapshot from the formatted heads of each lane."""
+    snapshot = {}
+    for lane_name, heads in (("priority", priority), ("regular", regular)):
+        for i, slot in enumerate(SNAPSHOT_SLOTS):
+            snapshot[f"{lane_name}_{slot}"] = heads[i] if i < len(heads) else None
+    return snapshot
+
+
+def with_wait_estimates(snapshot, stage="Waiting"):
+    """Copy of a six-slot snapshot with estimated_wait_seconds on every entry."""
+    from .wait_time import wait_estimator
+
+    estimated = {}
+    for key, entry in snapshot.items():
+        if entry:
+            lane = entry["priority_level"]
+            ahead = SNAPSHOT_SLOTS.index(key.split("_", 1)[1])
+            entry = {**entry, "estimated_wait_seconds": wait_estimator.estimate(stage, lane, ahead)}
+        estimated[key] = entry
+    return estimated
+
+
+def registration_snapshot():
+    """
+    (version, six-slot snapshot with wait estimates) from the in-memory queue
+    index: the payload of the REST endpoint and of every WebSocket protocol.
+    """
+    from .queue_index import queue_index
+    version, snapshot = queue_index.versioned_snapshot()
+    return version, with_wait_estimates(snapshot)
+
+
+def compute_queue_snapshot():
+    """Six-slot registration snapshot, served from the in-memory queue index."""
+    return registration_snapshot()[1]
+
+
+def compute_queue_snapshot_from_db():
+    """Same snapshot as compute_queue_snapshot(), read straight from the database."""
+    today = localdate()
+    priority = [format_queue_entry(q) for q in waiting_lane("Priority", today)[:3]]
+    regular = [format_queue_entry(q) for q in waiting_lane("Regular", today)[:3]]
+    return snapshot_from_heads(priority, regular)
+
+
+def check_queue_index():
+    """
+    Compare the queue index against the database.
+    Returns a dict of {slot: (index_value, db_value)} for every slot that differs;
+    an empty dict means the index is consistent.
+    """
+    from .queue_index import queue_index
+    indexed = queue_index.snapshot()
+    expected = compute_queue_snapshot_from_db()
+    return {
+        slot: (indexed.get(slot), expected[slot])
+        for slot in expected
+        if indexed.get(slot) != expected[slot]
+    }
+
+
+def json_safe(data):
+    """Round-trip through the DRF encoder so dates survive the channel layer."""
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def encode_message(message):
+    return json.dumps(message, cls=JSONEncoder)
+
+
+def wrap_encoded(data_text, **fields):
+    """
+    Encode `fields` plus an already encoded "data" member into one JSON
+    object, so a snapshot encoded once can be framed for every protocol.
+    """
+    head = ", ".join(f"{json.dumps(k)}: {encode_message(v)}" for k, v in fields.items())
+    return "{" + head + (", " if head else "") + '"data": ' + data_text + "}"
+
+
+def registration_snapshot_texts(version, epoch, snapshot):
+    """
+    The registration snapshot framed for each WebSocket protocol, sharing a
+    single encoding of the six slots:
+    text          bare snapshot (RegistrationQueueConsumer without ?since)
+    snapshot_text versioned snapshot message (?since=&epoch=)
+    topic_text    QueueTopicsConsumer message
+    """
+    data_text = encode_message(snapshot)
+    return {
+        "text": data_text,
+        "snapshot_text": wrap_encoded(data_text, type="snapshot", version=version, epoch=epoch),
+        "topic_text": wrap_encoded(
+            data_text, type="snapshot", topic="registration", version=version, epoch=epoch
+        ),
+    }
+
+
+def queue_update_event():
+    """
+    Channel-layer event for the registration_queue group, tagged with the
+    index version. The snapshot is encoded here once; consumers forward the
+    text as is.
+    """
+    from .queue_index import queue_index
+    version, snapshot = registration_snapshot()
+    return {
+        "type": "queue_update",
+        "version": version,
+        "epoch": queue_index.epoch,
+        **registration_snapshot_texts(version, queue_index.epoch, snapshot),
+    }
 
-        return {
-            "id": q.id,
-            "patient_id": pid,
-            "first_name": first_name,
-            "last_name": last_name,
-            "phone_number": phone,
-            "date_of_birth": dob,
-            "age": age,
-            "priority_level": q.priority_level,
-            "complaint": q.complaint,
-            "status": q.status,
-            "queue_number": q.queue_number,
-            "position": q.position,
-            "created_at": q.created_at,
-            "is_new_patient": not q.user,
-        }
-
-    pr0, pr1, pr2 = get_next(priority)
-    rg0, rg1, rg2 = get_next(regular)
 
+# WebSocket topics: one channel-layer group per queue board
+TOPIC_GROUPS = {
+    "registration": "registration_queue",
+    "assessment": "assessment_queue",
+    "treatment": "treatment_queue",
+    "lab": "lab_queue",
+}
+
+# which board shows entries in a given status
+STATUS_TOPICS = {
+    "Waiting": "registration",
+    "Queued for Assessment": "assessment",
+    "Queued for Treatment": "treatment",
+    "Ongoing for Laboratory": "lab",
+}
+
+
+def topic_event(topic):
+    """Channel-layer event carrying the current snapshot of `topic`'s board."""
+    if topic == "registration":
+        return queue_update_event()
+    snapshot_text = encode_message(compute_stage_snapshot(STAGE_QUEUES[topic]))
     return {
-        "priority_current": fmt(pr0),
-        "priority_next1": fmt(pr1),
-        "priority_next2": fmt(pr2),
-        "regular_current": fmt(rg0),
-        "regular_next1": fmt(rg1),
-        "regular_next2": fmt(rg2),
+        "type": "stage_update",
+        "topic": topic,
+        "topic_text": wrap_encoded(snapshot_text, type="snapshot", topic=topic),
+    }
+
+
+def broadcast_topics(*topics):
+    """Push fresh snapshots to the subscribers of each of `topics` (see dispatcher.py)."""
+    from .dispatcher import dispatcher
+    dispatcher.notify(*topics)
+
+
+def broadcast_status_change(*statuses):
+    """Broadcast the boards an entry left and entered when its status changed."""
+    broadcast_topics(*(STATUS_TOPICS.get(s) for s in statuses))
+
+
+def format_stage_entry(q):
+    """Row shape of the assessment/treatment queue boards."""
+    entry = {
+        "id": q.id,
+        "patient_id": q.patient_id,
+        "status": q.status,
+        "created_at": q.created_at,
+        "priority_level": q.priority_level,
+        "complaint": q.complaint,
+        "queue_number": q.queue_number,
+        "queue_date": q.queue_date,
     }
+    if q.patient:
+        entry.update({
+            "first_name": q.patient.first_name,
+            "last_name": q.patient.last_name,
+            "phone_number": q.patient.phone_number,
+            "date_of_birth": q.patient.date_of_birth,
+            "age": q.patient.get_age(),
+        })
+    return entry
+
+
+def compute_stage_snapshot(queue_status):
+    """
+    Six-slot snapshot of today's entries in `queue_status`, oldest first per lane.
+    The lane split and the three-per-lane limit are done by the database, so
+    this is a single query however many patients are waiting.
+    """
+    ranked = TemporaryStorageQueue.objects.select_related("patient").filter(
+        queue_date=localdate(),
+        status=queue_status,
+        priority_level__in=("Priority", "Regular"),
+    ).annotate(
+        lane_rank=Window(
+            RowNumber(),
+            partition_by=[F("priority_level")],
+            order_by=[F("created_at").asc(), F("id").asc()],
+        )
+    ).filter(lane_rank__lte=3).order_by("priority_level", "lane_rank")
+
+    heads = {"Priority": [], "Regular": []}
+    for q in ranked:
+        heads[q.priority_level].append(format_stage_entry(q))
+    return snapshot_from_heads(heads["Priority"], heads["Regular"])
+
+
+def compact_positions(queue_date, ordering=("position", "queue_number", "id")):
+    """
+    Respace the positions of `queue_date`'s entries to multiples of
+    POSITION_GAP, keeping their current order (or `ordering`).
+    Returns the number of rows rewritten.
+    """
+    from .queue_index import queue_index
+
+    gap = TemporaryStorageQueue.POSITION_GAP
+    with transaction.atomic():
+        entries = list(
+            TemporaryStorageQueue.objects.select_for_update().filter(
+                queue_date=queue_date
+            ).order_by(*ordering).only("id", "position")
+        )
+        changed = []
+        for rank, entry in enumerate(entries, start=1):
+            if entry.position != rank * gap:
+                entry.position = rank * gap
+                changed.append(entry)
+        TemporaryStorageQueue.objects.bulk_update(changed, ["position"], batch_size=500)
+        # bulk_update skips post_save
+        transaction.on_commit(queue_index.invalidate)
+    return len(changed)
+
+
+def _compact_in_background(queue_date):
+    def run():
+        try:
+            compact_positions(queue_date)
+        finally:
+            connection.close()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def position_after(entry):
+    """
+    Position for a new entry placed directly behind `entry`: the midpoint
+    between `entry` and whoever follows it, so no other row is rewritten.
+    When the gap is used up the day is compacted first; when it is nearly
+    used up a compaction is scheduled in the background after commit.
+    Call it inside the transaction that inserts the new row, with `entry`
+    locked (select_for_update), so the compaction cannot interleave.
+    """
+    gap = TemporaryStorageQueue.POSITION_GAP
+    following = TemporaryStorageQueue.objects.filter(
+        queue_date=entry.queue_date, position__gt=entry.position
+    ).order_by("position").values_list("position", flat=True).first()
+    if following is None:
+        return entry.position + gap
+    if following - entry.position < 2:
+        compact_positions(entry.queue_date)
+        entry.refresh_from_db(fields=["position"])
+        return entry.position + gap // 2
+    if following - entry.position < 8:
+        transaction.on_commit(lambda: _compact_in_background(entry.queue_date))
+    return (entry.position + following) // 2
+
+
+# stage name in the dequeue URL -> status of the entries waiting for it
+STAGE_QUEUES = {
+    "assessment": "Queued for Assessment",
+    "treatment": "Queued for Treatment",
+    "lab": "Ongoing for Laboratory",
+}
+
+
+def unclaimed():
+    """
+    Entries nobody is serving: never claimed, or claimed more than
+    QUEUE_CLAIM_TTL seconds ago by someone who never finished or released it.
+    """
+    expired = now() - timedelta(seconds=settings.QUEUE_CLAIM_TTL)
+    return Q(claimed_by__isnull=True) | Q(claimed_at__lt=expired)
+
+
+def stage_candidates(queue_status):
+    """Today's unclaimed entries in `queue_status`, Priority lane first, then oldest first."""
+    return TemporaryStorageQueue.objects.filter(
+        unclaimed(),
+        queue_date=localdate(),
+        status=queue_status,
+    ).annotate(
+        lane_order=Case(
+            When(priority_level="Priority", then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by("lane_order", "created_at", "id")
+
+
+def claim_next(queue_status, user):
+    """
+    Claim the head of the `queue_status` queue for `user` and return it, or
+    None when nobody is waiting. A user who already holds a claim in this
+    stage gets that entry back, so a retried request does not take a second
+    patient, and the claim is renewed. Claims left longer than
+    QUEUE_CLAIM_TTL go back to the queue (see unclaimed()).
+
+    On PostgreSQL the head row is locked with SELECT ... FOR UPDATE SKIP
+    LOCKED: concurrent callers skip rows another transaction is claiming and
+    take the next one instead of waiting. Databases without SKIP LOCKED
+    (SQLite in tests) use a conditional UPDATE that only succeeds while the
+    row is still unclaimed, retrying with the next head when it loses.
+    """
+    held = TemporaryStorageQueue.objects.filter(
+        status=queue_status, claimed_by=user, claimed_status=queue_status
+    ).order_by("claimed_at").first()
+    claim = {"claimed_by": user, "claimed_at": now(), "claimed_status": queue_status}
+    if held:
+        # renewed only while it is still ours; someone may have taken it over
+        if TemporaryStorageQueue.objects.filter(id=held.id, claimed_by=user).update(claimed_at=claim["claimed_at"]):
+            held.claimed_at = claim["claimed_at"]
+            return held
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            entry = stage_candidates(queue_status).select_for_update(
+                skip_locked=True, of=("self",)
+            ).first()
+            if entry is None:
+                return None
+            for field, value in claim.items():
+                setattr(entry, field, value)
+            entry.save(update_fields=list(claim))
+            return entry
+
+    while True:
+        entry_id = stage_candidates(queue_status).values_list("id", flat=True).first()
+        if entry_id is None:
+            return None
+        won = TemporaryStorageQueue.objects.filter(
+            unclaimed(), id=entry_id, status=queue_status
+        ).update(**claim)
+        if won:
+            return TemporaryStorageQueue.objects.get(id=entry_id)
+
+
+def release_claim(queue_status, user):
+    """Hand `user`'s claim in the `queue_status` queue back. Returns the number of entries released."""
+    return TemporaryStorageQueue.objects.filter(
+        status=queue_status, claimed_by=user, claimed_status=queue_status
+    ).update(claimed_by=None, claimed_at=None, claimed_status=None)
+
+
+def bulk_transition(changes, actor=None, fields=()):
+    """
+    Move many entries at once: `changes` is a list of (entry, status). The
+    rows are written with one bulk_update (plus any other changed `fields`)
+    and their transitions logged with one insert, doing what save() does
+    per entry. Call inside a transaction. Returns every status involved, to
+    broadcast with broadcast_status_change().
+    """
+    from .models import QueueTransition, record_visits
+    from .queue_index import queue_index
+    from .wait_time import wait_estimator
+
+    statuses = set()
+    logged = []
+    for entry, status in changes:
+        statuses.update((entry.status, status))
+        # like save(), an unchanged status is written but not a transition
+        if entry.status != status:
+            logged.append(QueueTransition(
+                entry=entry,
+                from_status=entry.status,
+                to_status=status,
+                queue_date=entry.queue_date,
+                actor=actor,
+            ))
+        entry.status = status
+        # a claim only holds for the stage it was made in
+        if entry.claimed_status and entry.claimed_status != status:
+            entry.claimed_by = None
+            entry.claimed_at = None
+            entry.claimed_status = None
+        entry._loaded_status = status
+
+    entries = [entry for entry, _ in changes]
+    TemporaryStorageQueue.objects.bulk_update(
+        entries, ["status", "claimed_by", "claimed_at", "claimed_status", *fields], batch_size=500
+    )
+    QueueTransition.objects.bulk_create(logged, batch_size=500)
+    if "patient" in fields:
+        record_visits(entries)
+
+    # bulk_update skips post_save, so update the index and estimator here
+    records = [(entry.id, queue_index.record_for(entry), entry.status) for entry in entries]
+    observed = [
+        (t.entry_id, t.entry.priority_level, t.from_status, t.to_status, t.created_at)
+        for t in logged
+    ]
+
+    def after_commit():
+        for record in records:
+            queue_index.apply(*record)
+        for sample in observed:
+            wait_estimator.observe(*sample)
+    transaction.on_commit(after_commit)
+    return statuses
+
+
+def wait_estimates():
+    """
+    Estimated wait of every waiting entry today, per stage and lane:
+    {stage: {lane: [{id, queue_number, ahead, estimated_wait_seconds}]}}.
+    The registration lanes come from the queue index; the other stages from
+    one query. Claimed entries are being served and are not counted as ahead.
+    """
+    from .queue_index import queue_index
+    from .wait_time import wait_estimator, STAGES, LANES
+
+    estimates = {stage: {lane: [] for lane in LANES} for stage in STAGES}
+    for lane in LANES:
+        for ahead, entry in enumerate(queue_index.heads(lane, count=None)):
+            estimates["Waiting"][lane].append({
+                "id": entry["id"],
+                "queue_number": entry["queue_number"],
+                "ahead": ahead,
+                "estimated_wait_seconds": wait_estimator.estimate("Waiting", lane, ahead),
+            })
+
+    staged = TemporaryStorageQueue.objects.filter(
+        unclaimed(),
+        queue_date=localdate(),
+        status__in=STAGES[1:],
+        priority_level__in=LANES,
+    ).order_by("created_at", "id").values_list("id", "queue_number", "status", "priority_level")
+    for entry_id, queue_number, stage, lane in staged:
+        ahead = len(estimates[stage][lane])
+        estimates[stage][lane].append({
+            "id": entry_id,
+            "queue_number": queue_number,
+            "ahead": ahead,
+            "estimated_wait_seconds": wait_estimator.estimate(stage, lane, ahead),
+        })
+    return estimates
@@ -15,109 +15,148 @@ from rest_framework import status
 from patient.models import Diagnosis, Prescription
 from medicine.models import Medicine
 
-from user.permissions import IsMedicalStaff, isDoctor, isSecretary, IsTreatmentParticipant
+from user.permissions import IsMedicalStaff, isDoctor, isSecretary, isAdmin, IsTreatmentParticipant
 from django.utils.timezone import now, localdate
 
 from appointment.models import AppointmentReferral, Appointment
 # display patient registration queue
-from .utils import compute_queue_snapshot
+from .utils import check_queue_index, lane_position, compute_stage_snapshot, claim_next, release_claim, format_stage_entry, STAGE_QUEUES, broadcast_status_change, registration_snapshot, wait_estimates
+from .wait_time import wait_estimator
+from .sse import public_broadcaster
+from django.http import StreamingHttpResponse
+from django.db.models import Q
+from rest_framework.permissions import IsAuthenticated
+from .queue_index import queue_index
+from .consumers import connection_registry
+from .analytics import stage_dwell_times, hourly_throughput
+from .carryover import carry_over_queue, warm_queue_caches
+from django.utils.dateparse import parse_date
 
 class PatientRegistrationQueue(APIView):
     permission_classes = [isSecretary]
 
     def get(self, request):
         try:
-            snapshot = compute_queue_snapshot()
-            return Response(snapshot, status=status.HTTP_200_OK)
+            version, snapshot = registration_snapshot()
+            # lets WebSocket clients resume with ?since=<version>&epoch=<epoch>
+            return Response(snapshot, status=status.HTTP_200_OK, headers={
+                "X-Queue-Version": str(version),
+                "X-Queue-Epoch": queue_index.epoch,
+            })
         except Exception as e:
             print("Error in GET:", e)
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-# display patient assessment queue
-class PreliminaryAssessmentQueue(APIView):
+# public registration queue for the waiting-room displays (Server-Sent Events,
+# queue numbers only); needs the ASGI server
+async def public_registration_stream(request):
+    response = StreamingHttpResponse(public_broadcaster.stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# compare the in-memory queue index against the database
+class QueueIndexCheck(APIView):
     permission_classes = [isSecretary]
+
+    def get(self, request):
+        mismatches = check_queue_index()
+        if mismatches and request.query_params.get("rebuild") in ("1", "true"):
+            queue_index.rebuild()
+        return Response({
+            "consistent": not mismatches,
+            "mismatches": {
+                slot: {"index": indexed, "database": expected}
+                for slot, (indexed, expected) in mismatches.items()
+            },
+        }, status=status.HTTP_200_OK)
+
+
+# the logged-in patient's place in today's registration queue
+class PatientQueuePosition(APIView):
+    permission_classes = [IsAuthenticated]
+
     def get(self, request):
-        table_name = 'queueing_temporarystoragequeue'
+        user = request.user
+        owner = Q(user=user)
+        if hasattr(user, 'patient_profile'):
+            owner |= Q(patient=user.patient_profile)
+        entry = TemporaryStorageQueue.objects.filter(
+            owner, queue_date=localdate()
+        ).order_by('-created_at').first()
+        if not entry:
+            return Response({"detail": "You are not in today's queue."}, status=status.HTTP_404_NOT_FOUND)
+
+        data = {
+            "queue_entry_id": entry.id,
+            "queue_number": entry.queue_number,
+            "priority_level": entry.priority_level,
+            "status": entry.status,
+            "position": None,
+            "ahead": None,
+            "estimated_wait_seconds": None,
+        }
+        if entry.status == "Waiting":
+            position = lane_position(entry)
+            data.update({
+                "position": position,
+                "ahead": position - 1,
+                "estimated_wait_seconds": wait_estimator.estimate("Waiting", entry.priority_level, position - 1),
+            })
+        return Response(data, status=status.HTTP_200_OK)
+
+
+# same as the carry_over_queue command, but run in the server process so the
+# caches it warms are the ones serving the first registrations
+class QueueCarryOver(APIView):
+    permission_classes = [isAdmin]
+
+    def post(self, request):
+        carried = carry_over_queue()
+        waiting = warm_queue_caches()
+        return Response({"carried_over": carried, "waiting": waiting}, status=status.HTTP_200_OK)
+
+
+# send-side stats of the WebSocket connections held by this process; only
+# "unacked" (clients that ack) shows what has not reached the clients yet
+class QueueConnectionStats(APIView):
+    permission_classes = [isAdmin]
 
+    def get(self, request):
+        connections = connection_registry.snapshot()
+        return Response({
+            "count": len(connections),
+            "pending": sum(c["pending"] for c in connections),
+            "superseded": sum(c["superseded"] for c in connections),
+            "unacked": sum(c["unacked"] or 0 for c in connections),
+            "connections": connections,
+        }, status=status.HTTP_200_OK)
+
+
+# estimated wait of every waiting entry, per stage and lane
+class QueueWaitTimes(APIView):
+    permission_classes = [IsMedicalStaff]
+
+    def get(self, request):
         try:
-            # Fetch Priority Queue
-            priority_response = supabase.table(table_name).select(
-                "id, patient_id, status, created_at, priority_level, complaint", 'queue_number', 'queue_date'
-            ).eq('status', 'Queued for Assessment').eq('priority_level', 'Priority').order('created_at').execute()
-
-            # Fetch Regular Queue
-            regular_response = supabase.table(table_name).select(
-                "id, patient_id, status, created_at, priority_level, complaint",  'queue_number', 'queue_date'
-            ).eq('status', 'Queued for Assessment').eq('priority_level', 'Regular').order('created_at').execute()
-
-            # Access the data attribute directly
-            priority_patients = priority_response.data if hasattr(priority_response, 'data') else []
-            regular_patients = regular_response.data if hasattr(regular_response, 'data') else []
-
-            def get_next_patients(queue):
-                current = queue[0] if len(queue) > 0 else None
-                next1 = queue[1] if len(queue) > 1 else None
-                next2 = queue[2] if len(queue) > 2 else None
-                return current, next1, next2
-
-            # Fetch patient details for the priority queue
-            priority_patient_ids = [queue["patient_id"] for queue in priority_patients]
-            priority_patients_details_response = supabase.table("patient_patient").select(
-                "patient_id, first_name, last_name, date_of_birth, phone_number"
-            ).in_("patient_id", priority_patient_ids).execute()
+            return Response({
+                "stages": wait_estimates(),
+                "service": wait_estimator.stats(),
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            print("Error in wait times:", e)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Fetch patient details for the regular queue
-            regular_patient_ids = [queue["patient_id"] for queue in regular_patients]
-            regular_patients_details_response = supabase.table("patient_patient").select(
-                "patient_id, first_name, last_name, date_of_birth, phone_number"
-            ).in_("patient_id", regular_patient_ids).execute()
-
-            # Access patient data
-            priority_patients_data = priority_patients_details_response.data if hasattr(priority_patients_details_response, 'data') else []
-            regular_patients_data = regular_patients_details_response.data if hasattr(regular_patients_details_response, 'data') else []
-
-            # Merge patient data with queue data and add age using the get_age() method
-            for queue_item in priority_patients:
-                patient = next((patient for patient in priority_patients_data if patient["patient_id"] == queue_item["patient_id"]), None)
-                if patient:
-                    patient_obj = Patient.objects.get(patient_id=patient["patient_id"])  # Get the full patient object
-                    queue_item.update({
-                        "first_name": patient["first_name"],
-                        "last_name": patient["last_name"],
-                        "phone_number": patient["phone_number"],
-                        "date_of_birth": patient["date_of_birth"],
-                        "age": patient_obj.get_age()  # Using get_age() method here
-                    })
-
-            for queue_item in regular_patients:
-                patient = next((patient for patient in regular_patients_data if patient["patient_id"] == queue_item["patient_id"]), None)
-                if patient:
-                    patient_obj = Patient.objects.get(patient_id=patient["patient_id"])  # Get the full patient object
-                    queue_item.update({
-                        "first_name": patient["first_name"],
-                        "last_name": patient["last_name"],
-                        "phone_number": patient["phone_number"],
-                        "date_of_birth": patient["date_of_birth"],
-                        "age": patient_obj.get_age()  # Using get_age() method here
-                    })
-
-            # Get the next patients
-            priority_current, priority_next1, priority_next2 = get_next_patients(priority_patients)
-            regular_current, regular_next1, regular_next2 = get_next_patients(regular_patients)
-
-            # Return the response with explicit renderer
-            return Response(
-                {
-                    "priority_current": priority_current,
-                    "priority_next1": priority_next1,
-                    "priority_next2": priority_next2,
-                    "regular_current": regular_current,
-                    "regular_next1": regular_next1,
-                    "regular_next2": regular_next2
-                },
-                status=status.HTTP_200_OK
-            )
+
+# display patient assessment queue
+class PreliminaryAssessmentQueue(APIView):
+    permission_classes = [isSecretary]
+    def get(self, request):
+        try:
+            snapshot = compute_stage_snapshot('Queued for Assessment')
+            return Response(snapshot, status=status.HTTP_200_OK)
 
         except Exception as e:
             # In case of errors, return a 500 error
@@ -128,89 +167,79 @@ class PreliminaryAssessmentQueue(APIView):
 class PatientTreatmentQueue(APIView):
     permission_classes = [isDoctor]
     def get(self, request):
-        table_name = 'queueing_temporarystoragequeue'
+        try:
+            snapshot = compute_stage_snapshot('Queued for Treatment')
+            return Response(snapshot, status=status.HTTP_200_OK)
 
+        except Exception as e:
+            # In case of errors, return a 500 error
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# call the next patient of a stage (assessment / treatment / lab)
+class StageDequeue(APIView):
+    permission_classes = [IsMedicalStaff]
+
+    def post(self, request, stage):
+        queue_status = STAGE_QUEUES.get(stage)
+        if queue_status is None:
+            return Response({"error": f"Unknown stage '{stage}'"}, status=status.HTTP_404_NOT_FOUND)
         try:
-            # Fetch Priority Queue
-            priority_response = supabase.table(table_name).select(
-                "id, patient_id, status, created_at, priority_level", 'queue_number', 'complaint', 'queue_date'
-            ).eq('status', 'Queued for Treatment').eq('priority_level', 'Priority').order('created_at').execute()
-
-            # Fetch Regular Queue
-            regular_response = supabase.table(table_name).select(
-                "id, patient_id, status, created_at, priority_level",  'queue_number', 'complaint', 'queue_date'
-            ).eq('status', 'Queued for Treatment').eq('priority_level', 'Regular').order('created_at').execute()
-
-            # Access the data attribute directly
-            priority_patients = priority_response.data if hasattr(priority_response, 'data') else []
-            regular_patients = regular_response.data if hasattr(regular_response, 'data') else []
-
-            def get_next_patients(queue):
-                current = queue[0] if len(queue) > 0 else None
-                next1 = queue[1] if len(queue) > 1 else None
-                next2 = queue[2] if len(queue) > 2 else None
-                return current, next1, next2
-
-            # Fetch patient details for the priority queue
-            priority_patient_ids = [queue["patient_id"] for queue in priority_patients]
-            priority_patients_details_response = supabase.table("patient_patient").select(
-                "patient_id, first_name, last_name, date_of_birth, phone_number"
-            ).in_("patient_id", priority_patient_ids).execute()
+            entry = claim_next(queue_status, request.user)
+            if entry is None:
+                return Response(status=status.HTTP_204_NO_CONTENT)
 
-            # Fetch patient details for the regular queue
-            regular_patient_ids = [queue["patient_id"] for queue in regular_patients]
-            regular_patients_details_response = supabase.table("patient_patient").select(
-                "patient_id, first_name, last_name, date_of_birth, phone_number"
-            ).in_("patient_id", regular_patient_ids).execute()
-
-            # Access patient data
-            priority_patients_data = priority_patients_details_response.data if hasattr(priority_patients_details_response, 'data') else []
-            regular_patients_data = regular_patients_details_response.data if hasattr(regular_patients_details_response, 'data') else []
-
-            # Merge patient data with queue data and add age using the get_age() method
-            for queue_item in priority_patients:
-                patient = next((patient for patient in priority_patients_data if patient["patient_id"] == queue_item["patient_id"]), None)
-                if patient:
-                    patient_obj = Patient.objects.get(patient_id=patient["patient_id"])  # Get the full patient object
-                    queue_item.update({
-                        "first_name": patient["first_name"],
-                        "last_name": patient["last_name"],
-                        "phone_number": patient["phone_number"],
-                        "date_of_birth": patient["date_of_birth"],
-                        "age": patient_obj.get_age()  # Using get_age() method here
-                    })
-
-            for queue_item in regular_patients:
-                patient = next((patient for patient in regular_patients_data if patient["patient_id"] == queue_item["patient_id"]), None)
-                if patient:
-                    patient_obj = Patient.objects.get(patient_id=patient["patient_id"])  # Get the full patient object
-                    queue_item.update({
-                        "first_name": patient["first_name"],
-                        "last_name": patient["last_name"],
-                        "phone_number": patient["phone_number"],
-                        "date_of_birth": patient["date_of_birth"],
-                        "age": patient_obj.get_age()  # Using get_age() method here
-                    })
-
-            # Get the next patients
-            priority_current, priority_next1, priority_next2 = get_next_patients(priority_patients)
-            regular_current, regular_next1, regular_next2 = get_next_patients(regular_patients)
-
-            # Return the response with explicit renderer
-            return Response(
-                {
-                    "priority_current": priority_current,
-                    "priority_next1": priority_next1,
-                    "priority_next2": priority_next2,
-                    "regular_current": regular_current,
-                    "regular_next1": regular_next1,
-                    "regular_next2": regular_next2
-                },
-                status=status.HTTP_200_OK
-            )
+            data = format_stage_entry(entry)
+            data.update({
+                "claimed_by": entry.claimed_by_id,
+                "claimed_at": entry.claimed_at,
+            })
+            return Response(data, status=status.HTTP_200_OK)
 
         except Exception as e:
-            # In case of errors, return a 500 error
+            print("Error in dequeue:", e)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# hand a claimed patient back to the stage's queue
+class StageRelease(APIView):
+    permission_classes = [IsMedicalStaff]
+
+    def post(self, request, stage):
+        queue_status = STAGE_QUEUES.get(stage)
+        if queue_status is None:
+            return Response({"error": f"Unknown stage '{stage}'"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            released = release_claim(queue_status, request.user)
+            return Response({"released": released}, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            print("Error in release:", e)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# time spent in each stage and hourly throughput, from the transition log
+class QueueStageAnalytics(APIView):
+    permission_classes = [IsMedicalStaff]
+
+    def get(self, request):
+        day = request.query_params.get('date')
+        start = request.query_params.get('start', day)
+        end = request.query_params.get('end', day)
+        start = parse_date(start) if start else localdate()
+        end = parse_date(end) if end else start
+        if start is None or end is None:
+            return Response({"error": "Dates must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            return Response({
+                "start": start,
+                "end": end,
+                "stages": stage_dwell_times(start, end),
+                "throughput": hourly_throughput(start, end),
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            print("Error in stage analytics:", e)
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -257,8 +286,8 @@ class PreliminaryAssessmentForm(APIView):
             queue_entry = TemporaryStorageQueue.objects.get(patient=patient, queue_number=queue_number)
 
             # Update the status of the queue entry to "Being Assessed"
-            queue_entry.status = 'Queued for Treatment'
-            queue_entry.save()
+            previous_status = queue_entry.transition_to('Queued for Treatment', request.user)
+            broadcast_status_change(previous_status, queue_entry.status)
 
         except Patient.DoesNotExist:
             return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -294,8 +323,8 @@ class PatientTreatmentForm(APIView):
             patient=patient,
             queue_number=queue_number
         )
-        queue_entry.status = 'Completed'
-        queue_entry.save()
+        previous_status = queue_entry.transition_to('Completed', request.user)
+        broadcast_status_change(previous_status, queue_entry.status)
 
         # Update “active” referral, if any
         referral = AppointmentReferral.objects.filter(
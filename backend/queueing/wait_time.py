@@ -0,0 +1,133 @@
+"""
+Estimated waits per lane and stage.
+
+For every (stage, lane) the estimator keeps an exponentially weighted mean
+of the service interval: the time from when an entry could first be served
+(it entered the stage, or the previous entry left it, whichever is later)
+until it left the stage. Each status change updates one mean in O(1), from
+TemporaryStorageQueue.save() after commit, so nothing is recomputed from
+history on the request path.
+
+An entry with k entries ahead of it in its lane is expected to wait
+k * mean + what remains of the current service interval.
+"""
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.timezone import localdate
+
+# statuses an entry waits in, i.e. the stages with a queue
+STAGES = (
+    "Waiting",
+    "Queued for Assessment",
+    "Queued for Treatment",
+    "Ongoing for Laboratory",
+)
+LANES = ("Priority", "Regular")
+
+
+class WaitTimeEstimator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        # (stage, lane) -> [mean seconds, samples]
+        self._service = {}
+        # (stage, lane) -> time the last entry left the stage
+        self._last_departure = {}
+        # entry id -> (stage, time it entered the stage)
+        self._entered = {}
+
+    @property
+    def alpha(self):
+        return getattr(settings, "QUEUE_WAIT_ALPHA", 0.2)
+
+    @property
+    def default_seconds(self):
+        return getattr(settings, "QUEUE_WAIT_DEFAULT_SECONDS", 600)
+
+    @property
+    def max_interval(self):
+        return getattr(settings, "QUEUE_WAIT_MAX_INTERVAL", 3600)
+
+    # updates ---------------------------------------------------------------
+
+    def observe(self, entry_id, lane, from_status, to_status, at):
+        """Record one status change. O(1)."""
+        with self._lock:
+            self._ensure_day()
+            self._observe(entry_id, lane, from_status, to_status, at)
+
+    def _observe(self, entry_id, lane, from_status, to_status, at):
+        if from_status in STAGES:
+            key = (from_status, lane)
+            entered = self._entered.pop(entry_id, None)
+            starts = [self._last_departure.get(key)]
+            if entered and entered[0] == from_status:
+                starts.append(entered[1])
+            starts = [s for s in starts if s is not None]
+            if starts:
+                interval = (at - max(starts)).total_seconds()
+                if 0 < interval <= self.max_interval:
+                    stats = self._service.setdefault(key, [interval, 0])
+                    if stats[1]:
+                        stats[0] += self.alpha * (interval - stats[0])
+                    stats[1] += 1
+            self._last_departure[key] = at
+        if to_status in STAGES:
+            self._entered[entry_id] = (to_status, at)
+        else:
+            self._entered.pop(entry_id, None)
+
+    def _ensure_day(self):
+        today = localdate()
+        if self._day == today:
+            return
+        self._day = today
+        self._service = {}
+        self._last_departure = {}
+        self._entered = {}
+        self._warm_up(today)
+
+    def _warm_up(self, day):
+        """Replay today's transition log once, e.g. after a restart."""
+        from .models import QueueTransition
+
+        rows = QueueTransition.objects.filter(queue_date=day).order_by("created_at", "id").values_list(
+            "entry_id", "entry__priority_level", "from_status", "to_status", "created_at"
+        )
+        for entry_id, lane, from_status, to_status, at in rows:
+            self._observe(entry_id, lane, from_status, to_status, at)
+
+    # reading ---------------------------------------------------------------
+
+    def service_seconds(self, stage, lane):
+        """Current mean service interval of `stage`/`lane` and its sample count."""
+        with self._lock:
+            self._ensure_day()
+            mean, samples = self._service.get((stage, lane), (self.default_seconds, 0))
+            return mean, samples
+
+    def estimate(self, stage, lane, ahead, now=None):
+        """Seconds until an entry with `ahead` entries in front of it is served."""
+        now = now or timezone.now()
+        with self._lock:
+            self._ensure_day()
+            mean, _ = self._service.get((stage, lane), (self.default_seconds, 0))
+            last = self._last_departure.get((stage, lane))
+        elapsed = (now - last).total_seconds() if last else 0
+        remaining = max(0.0, mean - elapsed)
+        return round(ahead * mean + remaining)
+
+    def stats(self):
+        """{stage: {lane: {mean_seconds, samples}}} for every stage and lane."""
+        return {
+            stage: {
+                lane: dict(zip(("mean_seconds", "samples"), self.service_seconds(stage, lane)))
+                for lane in LANES
+            }
+            for stage in STAGES
+        }
+
+
+wait_estimator = WaitTimeEstimator()
@@ -50,23 +50,27 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
     
+def allocate_user_ids(last_names):
+    """IDs for new accounts with these last names, numbered on from the last used ID."""
+    prefix = "02000"
+    start_num = 100
+
+    # Get last used ID
+    last_user = UserAccount.objects.aggregate(max_id=Max("id"))
+    last_num = start_num
+    if last_user["max_id"]:
+        try:
+            last_num = int(last_user["max_id"].split(prefix)[-1]) + 1
+        except ValueError:
+            last_num += 1
+
+    # Build new ID using last_name
+    return [f"{slugify(last_name)}-{prefix}{last_num + n}" for n, last_name in enumerate(last_names)]
+
 @receiver(pre_save, sender=UserAccount)
 def create_user_id(sender, instance, **kwargs):
     if not instance.id:
-        prefix = "02000"
-        start_num = 100
-
-        # Get last used ID
-        last_user = UserAccount.objects.aggregate(max_id=Max("id"))
-        last_num = start_num
-        if last_user["max_id"]:
-            try:
-                last_num = int(last_user["max_id"].split(prefix)[-1]) + 1
-            except ValueError:
-                last_num += 1
-
-        # Build new ID using last_name
-        instance.id = f"{slugify(instance.last_name)}-{prefix}{last_num}"
+        instance.id = allocate_user_ids([instance.last_name])[0]
 
 class BaseProfile(models.Model):
     role_id = models.CharField(max_length=50, null=True, editable=False)
@@ -128,6 +128,8 @@ export default function RegistrationQueue() {
         : "localhost:8000";
 
     const socket = new WebSocket(`${protocol}://${backendHost}/ws/queue/registration/`);
+    // messages handled so far; acked so the server stops sending when we fall behind
+    let received = 0;
 
 
     socket.onopen = () => {
@@ -161,6 +163,8 @@ export default function RegistrationQueue() {
       } catch (err) {
         console.error("❌ Error parsing WS message:", err);
       }
+      received += 1;
+      socket.send(JSON.stringify({ action: "ack", received }));
     };
 
     socket.onclose = (ev) => {
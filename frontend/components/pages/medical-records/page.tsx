@@ -4,9 +4,16 @@ import { PatientColumns } from "./patient-columns";
 import usePatients from "@/hooks/use-patients";
 
 export default function MedicalRecords() {
-  const patients = usePatients();
+  const { patients, hasMore, loadMore, loading } = usePatients();
 
   return (
-    <DataTable title="Patients" columns={PatientColumns} data={patients} />
+    <DataTable
+      title="Patients"
+      columns={PatientColumns}
+      data={patients}
+      hasMore={hasMore}
+      onLoadMore={loadMore}
+      loadingMore={loading}
+    />
   );
 }
@@ -13,7 +13,8 @@ import usePatients from "@/hooks/use-patients";
 
 export default function StaffDashboard() {
   const name = useName();
-  const patients = usePatients();
+  // the dashboard shows the most recent visitors only
+  const { patients } = usePatients();
 
   return (
     <div className="m-6 space-y-4 text-center md:text-left">
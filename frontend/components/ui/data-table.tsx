@@ -26,6 +26,10 @@ interface DataTableProps<TData, TValue> {
   columns: ColumnDef<TData, TValue>[];
   data: TData[];
   title?: string;
+  // rows are fetched a page at a time; more can be requested from the server
+  hasMore?: boolean;
+  onLoadMore?: () => void;
+  loadingMore?: boolean;
 }
 
 import { Button } from "@/components/ui/button";
@@ -36,6 +40,9 @@ export function DataTable<TData, TValue>({
   columns,
   data,
   title,
+  hasMore = false,
+  onLoadMore,
+  loadingMore = false,
 }: DataTableProps<TData, TValue>) {
   const [sorting, setSorting] = React.useState<SortingState>([]);
 
@@ -124,7 +131,7 @@ export function DataTable<TData, TValue>({
       <div className="flex items-center justify-between pt-4">
         {/* Patient count on the left */}
         <div className="text-sm text-muted-foreground">
-          Total: {table.getFilteredRowModel().rows.length} patient(s)
+          {hasMore ? "Loaded" : "Total"}: {table.getFilteredRowModel().rows.length} patient(s)
         </div>
         
         {/* Pagination controls on the right */}
@@ -152,6 +159,16 @@ export function DataTable<TData, TValue>({
             >
               Next
             </Button>
+            {hasMore && onLoadMore && (
+              <Button
+                variant="outline"
+                size="sm"
+                onClick={onLoadMore}
+                disabled={loadingMore}
+              >
+                {loadingMore ? "Loading..." : "Load more"}
+              </Button>
+            )}
           </div>
         </div>
       </div>
@@ -1,25 +1,36 @@
 // hooks/usePatients.ts
 "use client";
 
-import { useEffect, useState } from "react";
+import { useCallback, useEffect, useState } from "react";
 import { getPatients } from "@/lib/api/patients";
 import { Patient } from "@/components/pages/medical-records/patient-columns";
 
 export default function usePatients() {
   const [patients, setPatients] = useState<Patient[]>([]);
+  const [next, setNext] = useState<string | null>(null);
+  const [loading, setLoading] = useState(false);
+
+  const loadPage = useCallback(async (url?: string | null) => {
+    setLoading(true);
+    try {
+      const page = await getPatients(url);
+      // pages arrive in order, so appending keeps latest visit first
+      setPatients((loaded) => (url ? [...loaded, ...page.patients] : page.patients));
+      setNext(page.next);
+    } catch (err) {
+      console.error(err);
+    } finally {
+      setLoading(false);
+    }
+  }, []);
 
   useEffect(() => {
-    const loadPatients = async () => {
-      try {
-        const data = await getPatients();
-        setPatients(data);
-      } catch (err) {
-        console.error(err);
-      }
-    };
+    loadPage();
+  }, [loadPage]);
 
-    loadPatients();
-  }, []);
+  const loadMore = useCallback(() => {
+    if (next && !loading) loadPage(next);
+  }, [next, loading, loadPage]);
 
-  return patients;
+  return { patients, hasMore: next !== null, loadMore, loading };
 }
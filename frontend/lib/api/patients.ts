@@ -1,10 +1,18 @@
 import { Patient } from "@/components/pages/medical-records/patient-columns";
 
-export async function getPatients(): Promise<Patient[]> {
+export interface PatientPage {
+  patients: Patient[];
+  // URL of the following page, or null on the last one
+  next: string | null;
+}
+
+export async function getPatients(url?: string | null): Promise<PatientPage> {
   const accessToken = localStorage.getItem("access");
 
-  const response = await fetch(
-    `${process.env.NEXT_PUBLIC_API_BASE}/patients/`,
+  // The endpoint returns one page at a time ({ next, results }), most
+  // recent visit first; pass `next` back in to fetch the following page.
+  const response: Response = await fetch(
+    url ?? `${process.env.NEXT_PUBLIC_API_BASE}/patients/?page_size=50`,
     {
       method: "GET",
       headers: {
@@ -20,19 +28,8 @@ export async function getPatients(): Promise<Patient[]> {
   const data = await response.json();
 
   // Some APIs wrap data in { results: [...] }
-  const patients: Patient[] = Array.isArray(data) ? data : data.results ?? [];
-
-  // sort by the latest created_at in queue_data
-  return [...patients].sort((a, b) => {
-    const aDate =
-      a.queue_data?.length > 0
-        ? new Date(a.queue_data[a.queue_data.length - 1].created_at).getTime()
-        : 0;
-    const bDate =
-      b.queue_data?.length > 0
-        ? new Date(b.queue_data[b.queue_data.length - 1].created_at).getTime()
-        : 0;
-
-    return bDate - aDate; // newest first
-  });
+  if (Array.isArray(data)) {
+    return { patients: data, next: null };
+  }
+  return { patients: data.results ?? [], next: data.next ?? null };
 }